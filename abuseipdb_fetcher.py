@@ -1,44 +1,61 @@
 # abuseipdb_fetcher.py
-# Fetches IP reputation from AbuseIPDB API and converts to STIX 2.x
+# Fetches IP reputation from AbuseIPDB API and converts it to IOC records for STIX 2.x publishing
 
-import requests
-import json
-from stix2 import Indicator, Observable, Bundle, TLP_WHITE # Added TLP_WHITE import
+from http_client import RateLimitedClient
+from ioc_record import IOCRecord, now_timestamp
+from metrics import API_REQUESTS_SAVED, REPUTATION_CACHE_LOOKUPS
 import logging
-import time
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 class AbuseIPDBFetcher:
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=None, cache=None, max_workers=4, max_requests_per_cycle=None, block_query_min_ips=0,
+                 requests_per_minute=60, daily_quota=1000, max_retries=4):
+        """
+        `cache` is an optional ReputationCache used to skip IPs checked within its TTL.
+        Cache misses are looked up by up to `max_workers` concurrent requests, and at most
+        `max_requests_per_cycle` API calls are made per batch to stay within the plan's quota.
+        If `block_query_min_ips` is set, uncached IPv4 addresses sharing a /24 are looked up
+        with a single check-block request once at least that many of them are pending.
+        Requests go through a RateLimitedClient honoring `requests_per_minute` and `daily_quota`.
+        They are not conditional: `cache` already keeps the answers, so storing validators
+        and a copy of every body for them would only duplicate it.
+        """
         self.api_key = api_key
-        self.base_url = "https://api.abuseipdb.com/api/v2"
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_requests_per_cycle = max_requests_per_cycle
+        self.block_query_min_ips = block_query_min_ips
+        self.stats = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "api_requests": 0,
+            "requests_saved": 0
+        }
+        self._stats_lock = threading.Lock()
+        self.base_url = base_url or "https://api.abuseipdb.com/api/v2"
         self.headers = {
             "Key": self.api_key,
             "Accept": "application/json"
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-
-    def _make_request(self, endpoint, params=None):
-        """Helper to make API requests with rate limiting."""
-        url = f"{self.base_url}/{endpoint}"
-        try:
-            response = self.session.get(url, params=params)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTP error for {endpoint}: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429: # Too Many Requests
-                logging.warning("AbuseIPDB rate limit hit. Waiting for 60 seconds...")
-                time.sleep(60)
-                return self._make_request(endpoint, params) # Retry after delay
-            return None
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error for {endpoint}: {e}")
-            return None
-
-    def check_ip(self, ip_address, max_age_in_days=90):
+        self.client = RateLimitedClient(
+            "AbuseIPDB", self.base_url, self.headers,
+            requests_per_minute=requests_per_minute,
+            daily_quota=daily_quota,
+            max_retries=max_retries,
+            pool_size=max_workers
+        )
+        self.session = self.client.session
+
+    def _make_request(self, endpoint, params=None, deadline=None):
+        """
+        Helper to make API requests through the shared rate-limited client.
+        `deadline` is an optional time.monotonic() value the request must finish by.
+        """
+        return self.client.get_json(endpoint, params, deadline)
+
+    def check_ip(self, ip_address, max_age_in_days=90, deadline=None):
         """Checks the reputation of a single IP address."""
         endpoint = "check"
         params = {
@@ -46,17 +63,139 @@ class AbuseIPDBFetcher:
             "maxAgeInDays": max_age_in_days,
             "verbose": "" # Request verbose output
         }
-        data = self._make_request(endpoint, params)
+        data = self._make_request(endpoint, params, deadline)
         if data and 'data' in data:
             return data['data']
         return None
 
-    def fetch_recent_indicators(self, ip_list=None):
+    def check_block(self, network, max_age_in_days=90, deadline=None):
+        """Checks the reputation of every reported address in a CIDR block (up to /24 on the free tier)."""
+        endpoint = "check-block"
+        params = {
+            "network": network,
+            "maxAgeInDays": max_age_in_days
+        }
+        data = self._make_request(endpoint, params, deadline)
+        if data and 'data' in data:
+            return data['data']
+        return None
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    @property
+    def cache_hit_rate(self):
+        """Fraction of looked-up IPs that were served from the cache."""
+        with self._stats_lock:
+            lookups = self.stats["cache_hits"] + self.stats["cache_misses"]
+            return self.stats["cache_hits"] / lookups if lookups else 0.0
+
+    def _plan_lookups(self, ip_list):
+        """Groups uncached IPs into ('block', network, ips) and ('ip', ip, [ip]) lookups."""
+        lookups = []
+        blocks = {}
+        for ip_address in ip_list:
+            try:
+                parsed = ipaddress.ip_address(ip_address)
+            except ValueError:
+                logging.warning(f"Skipping invalid IP address for AbuseIPDB: {ip_address}")
+                continue
+            if self.block_query_min_ips and parsed.version == 4:
+                network = str(ipaddress.ip_network(f"{ip_address}/24", strict=False))
+                blocks.setdefault(network, []).append(ip_address)
+            else:
+                lookups.append(("ip", ip_address, [ip_address]))
+
+        for network, block_ips in blocks.items():
+            if len(block_ips) >= self.block_query_min_ips:
+                lookups.append(("block", network, block_ips))
+            else:
+                lookups.extend(("ip", ip_address, [ip_address]) for ip_address in block_ips)
+        return lookups
+
+    def _run_lookup(self, lookup, max_age_in_days, deadline):
+        """Executes a single planned lookup and returns {ip: ip_info} for the IPs it covers."""
+        kind, target, covered_ips = lookup
+        self._count(api_requests=1)
+        if kind == "ip":
+            ip_info = self.check_ip(target, max_age_in_days, deadline)
+            return {target: ip_info} if ip_info else {}
+
+        block_info = self.check_block(target, max_age_in_days, deadline)
+        if not block_info:
+            return {}
+        self._count(requests_saved=len(covered_ips) - 1)
+        reported = {
+            entry['ipAddress']: {
+                'ipAddress': entry['ipAddress'],
+                'abuseConfidenceScore': entry.get('abuseConfidenceScore', 0),
+                'totalReports': entry.get('numReports', 0),
+                'lastReportedAt': entry.get('mostRecentReport'),
+                'countryCode': entry.get('countryCode')
+            }
+            for entry in block_info.get('reportedAddress', [])
+        }
+        # Addresses absent from the block report have no reports in the requested window
+        for ip_address in covered_ips:
+            reported.setdefault(ip_address, {
+                'ipAddress': ip_address,
+                'abuseConfidenceScore': 0,
+                'totalReports': 0,
+                'lastReportedAt': None
+            })
+        return reported
+
+    def check_ips(self, ip_list, max_age_in_days=90, deadline=None):
+        """
+        Batch reputation lookup. Returns {ip: ip_info} for every IP that could be resolved.
+        Cached results are reused; misses are fetched concurrently (optionally per /24 block)
+        and written back to the cache. Lookups beyond the per-cycle request budget are deferred.
+        """
+        unique_ips = list(dict.fromkeys(ip_list))
+        results = self.cache.get_many(unique_ips, max_age_in_days) if self.cache else {}
+        misses = [ip_address for ip_address in unique_ips if ip_address not in results]
+        self._count(cache_hits=len(results), cache_misses=len(misses), requests_saved=len(results))
+        REPUTATION_CACHE_LOOKUPS.inc(len(results), source="AbuseIPDB", result="hit")
+        REPUTATION_CACHE_LOOKUPS.inc(len(misses), source="AbuseIPDB", result="miss")
+        API_REQUESTS_SAVED.inc(len(results), source="AbuseIPDB")
+
+        lookups = self._plan_lookups(misses)
+        if self.max_requests_per_cycle is not None and len(lookups) > self.max_requests_per_cycle:
+            logging.warning(
+                f"AbuseIPDB request budget of {self.max_requests_per_cycle} exceeded by {len(lookups)} pending lookups. "
+                f"Deferring {len(lookups) - self.max_requests_per_cycle} to a later cycle."
+            )
+            lookups = lookups[:self.max_requests_per_cycle]
+
+        fetched = {}
+        if lookups:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(lookups))), thread_name_prefix="abuseipdb") as pool:
+                futures = [pool.submit(self._run_lookup, lookup, max_age_in_days, deadline) for lookup in lookups]
+                for future in as_completed(futures):
+                    fetched.update(future.result())
+
+        if self.cache:
+            self.cache.put_many(fetched, max_age_in_days)
+        results.update(fetched)
+
+        logging.info(
+            f"AbuseIPDB lookup: {len(unique_ips)} IPs, {len(unique_ips) - len(misses)} cached, "
+            f"{len(lookups)} API requests. Cache hit rate: {self.cache_hit_rate:.1%}, "
+            f"requests saved: {self.stats['requests_saved']}."
+        )
+        return results
+
+    def fetch_recent_indicators(self, ip_list=None, deadline=None):
         """
         Fetches reputation for a list of IP addresses from AbuseIPDB.
         Since AbuseIPDB's free API is primarily for checking specific IPs,
         we use a predefined list for demonstration. In a real scenario,
         these IPs would come from other feeds or internal logs.
+        Lookups go through check_ips, so cached and block-queried results are reused.
+        Returns IOCRecords; STIX objects are emitted from them at publish time.
+        If `deadline` (a time.monotonic() value) passes, the indicators built so far are returned.
         """
         if ip_list is None:
             # Example IPs (replace with real known bad IPs for better testing, but be careful)
@@ -68,11 +207,14 @@ class AbuseIPDBFetcher:
                 "8.8.4.4"          # Example: Google DNS, should be clean
             ]
 
-        stix_objects = []
+        records = []
+        created = now_timestamp()
         logging.info(f"Checking {len(ip_list)} IP addresses with AbuseIPDB...")
 
+        ip_results = self.check_ips(ip_list, deadline=deadline)
+
         for ip_address in ip_list:
-            ip_info = self.check_ip(ip_address)
+            ip_info = ip_results.get(ip_address)
             if ip_info:
                 abuse_score = ip_info.get('abuseConfidenceScore', 0)
                 is_whitelisted = ip_info.get('isWhitelisted', False)
@@ -86,25 +228,20 @@ class AbuseIPDBFetcher:
                     f"Last reported: {last_reported if last_reported else 'N/A'}."
                 )
 
-                # Create STIX Observable
-                observable = Observable(value=ip_address, type='ipv4-addr')
-
-                # Create STIX Indicator
                 # Pattern based on IP value and potentially score threshold
-                pattern = f"[ipv4-addr:value = '{ip_address}']"
+                extra_pattern = None
                 if abuse_score >= 50 and not is_whitelisted: # Example threshold
-                    pattern = f"[ipv4-addr:value = '{ip_address}'] AND [x-abuseipdb:abuse_confidence_score >= 50]"
+                    extra_pattern = "[x-abuseipdb:abuse_confidence_score >= 50]"
                     description = f"Malicious IP from AbuseIPDB: {ip_address}. " + description
                 else:
                     description = f"IP from AbuseIPDB: {ip_address}. " + description
 
-                indicator = Indicator(
-                    pattern=pattern,
-                    pattern_type="stix",
+                record = IOCRecord.from_source_type(
+                    "AbuseIPDB", "IPv6" if ":" in ip_address else "IPv4", ip_address,
                     description=description,
-                    valid_from=last_reported if last_reported else time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
-                    object_marking_refs=[TLP_WHITE],
-                    # Add custom properties for more details if needed
+                    valid_from=last_reported,
+                    created=created,
+                    extra_pattern=extra_pattern,
                     custom_properties={
                         'x_abuseipdb_abuse_confidence_score': abuse_score,
                         'x_abuseipdb_is_whitelisted': is_whitelisted,
@@ -112,9 +249,9 @@ class AbuseIPDBFetcher:
                         'x_abuseipdb_last_reported_at': last_reported
                     }
                 )
-                stix_objects.extend([observable, indicator])
-                logging.info(f"Created STIX Indicator for IP: {ip_address} (Score: {abuse_score}%)")
+                records.append(record)
+                logging.debug("Created IOC record for IP: %s (Score: %s%%)", ip_address, abuse_score) # Per-indicator: DEBUG with lazy formatting
             else:
                 logging.warning(f"Could not get AbuseIPDB info for IP: {ip_address}")
 
-        return stix_objects
+        return records
@@ -0,0 +1,257 @@
+# archive.py
+# Append-only, time-partitioned NDJSON archive of every collected STIX object for bulk analytics.
+# Each segment file has a sidecar offset index, so a time range can be read without scanning whole files
+
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+from ioc_record import IOCRecord, normalize_timestamp, now_timestamp
+from metrics import STAGE_ITEMS
+from stix_ids import value_indicator_id
+from stix_shards import serialize_compact
+
+# Compression -> segment file extension
+SEGMENT_EXTENSIONS = {"": ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+# Partition -> length of the valid_from prefix naming its segment ('2024-01-01T05' / '2024-01-01')
+PARTITION_KEY_LENGTHS = {"hour": 13, "day": 10}
+SEGMENT_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2}(?:T\d{2})?)\.ndjson(\.gz|\.zst)?$")
+
+def _zstandard():
+    try:
+        import zstandard # Optional; only needed for zstd segments
+    except ImportError:
+        raise ValueError("zstd archive compression requires the zstandard package (pip install zstandard)")
+    return zstandard
+
+def _compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().compress(data)
+    return data
+
+def _decompress(data, extension):
+    if extension == ".gz":
+        return gzip.decompress(data)
+    if extension == ".zst":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    return data
+
+def time_key(timestamp):
+    """
+    Sortable form of a STIX timestamp: the trailing Z is dropped so that
+    '...T00:00:00' sorts before '...T00:00:00.500' as it should.
+    """
+    return timestamp[:-1] if timestamp.endswith("Z") else timestamp
+
+def _range_key(value):
+    """Time key of a reader bound given as a datetime or ISO 8601 / STIX timestamp string."""
+    if value is None:
+        return None
+    timestamp = normalize_timestamp(value if isinstance(value, str) else value.isoformat())
+    if timestamp is None:
+        raise ValueError(f"Not a valid timestamp: {value!r}")
+    return time_key(timestamp)
+
+def _archive_entries(item):
+    """Yields (valid_from, source, stix_object) for everything an IOCRecord or STIX object archives as."""
+    if isinstance(item, IOCRecord):
+        # The Observable is filed under its Indicator's valid_from and source. Each source's report is
+        # kept, under the id of the Indicator the collector publishes for the value (see correlation.py)
+        observable, indicator = item.to_stix_dicts()
+        indicator["id"] = value_indicator_id(item.stix_type, item.value)
+        yield item.valid_from, item.source, observable
+        yield item.valid_from, item.source, indicator
+        return
+    stix_object = item if isinstance(item, dict) else json.loads(item.serialize())
+    valid_from = normalize_timestamp(stix_object.get("valid_from") or stix_object.get("modified") or stix_object.get("created"))
+    yield valid_from or now_timestamp(), "", stix_object
+
+class IndicatorArchive:
+    """
+    Writes STIX objects as compact NDJSON into one segment file per `partition` ('hour' or
+    'day') of their valid_from, under `archive_dir`/YYYY-MM/, optionally gzip or zstd
+    compressed. Segments are only ever appended to.
+
+    Each append() adds one block per (segment, type, source) with its lines sorted by
+    valid_from. Compressed blocks are separate gzip members / zstd frames, so a block can be
+    decompressed on its own. The sidecar `<segment>.idx` gets one JSON line per block:
+    its byte offset and length, count, type, source, first/last valid_from and "marks",
+    the offset within the (uncompressed) block where each distinct valid_from starts.
+    The index line is written after the block, so a block torn by a crash is never read.
+    """
+
+    def __init__(self, archive_dir, partition="hour", compression="", fsync=False):
+        if partition not in PARTITION_KEY_LENGTHS:
+            raise ValueError(f"Unknown archive partition {partition!r}; use 'hour' or 'day'")
+        if compression not in SEGMENT_EXTENSIONS:
+            raise ValueError(f"Unknown archive compression {compression!r}; use '', 'gzip' or 'zstd'")
+        if compression == "zstd":
+            _zstandard()
+        self.archive_dir = archive_dir
+        self.partition = partition
+        self.compression = compression
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def segment_path(self, partition_key):
+        return os.path.join(self.archive_dir, partition_key[:7], partition_key + SEGMENT_EXTENSIONS[self.compression])
+
+    def append(self, items):
+        """Archives an iterable of IOCRecords or STIX objects. Returns the number of objects written."""
+        key_length = PARTITION_KEY_LENGTHS[self.partition]
+        blocks = {}
+        for item in items:
+            for valid_from, source, stix_object in _archive_entries(item):
+                line = (serialize_compact(stix_object) + "\n").encode("utf-8")
+                blocks.setdefault((valid_from[:key_length], stix_object["type"], source), []).append((time_key(valid_from), line))
+
+        written = 0
+        with self._lock:
+            for (partition_key, stix_type, source), lines in sorted(blocks.items()):
+                lines.sort(key=lambda entry: entry[0])
+                marks, chunks, block_bytes = [], [], 0
+                for key, line in lines:
+                    if not marks or marks[-1][0] != key:
+                        marks.append([key, block_bytes])
+                    chunks.append(line)
+                    block_bytes += len(line)
+                self._write_block(partition_key, b"".join(chunks), {
+                    "count": len(lines),
+                    "type": stix_type,
+                    "source": source,
+                    "first": lines[0][0],
+                    "last": lines[-1][0],
+                    "marks": marks
+                })
+                written += len(lines)
+        STAGE_ITEMS.inc(written, stage="archive", source="")
+        return written
+
+    def _write_block(self, partition_key, data, entry):
+        """Appends one block to its segment, then its entry to the sidecar index. Caller holds the lock."""
+        path = self.segment_path(partition_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = _compress(data, self.compression)
+        with open(path, "ab") as f:
+            entry = {"offset": f.tell(), "length": len(payload), **entry}
+            f.write(payload)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        with open(f"{path}.idx", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+class ArchiveReader:
+    """
+    Streams objects back out of an IndicatorArchive directory. Only segments whose partition
+    overlaps the requested [start, end) range are opened, only blocks whose index entry
+    matches are read, and the marks narrow each block down to the requested time range,
+    so no line outside it is read or parsed. Uncompressed segments are memory-mapped.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def segments(self, start=None, end=None):
+        """Returns the segment paths overlapping [start, end), oldest first."""
+        start_key, end_key = _range_key(start), _range_key(end)
+        segments = []
+        if not os.path.isdir(self.archive_dir):
+            return segments
+        for month in sorted(os.listdir(self.archive_dir)):
+            month_dir = os.path.join(self.archive_dir, month)
+            if not os.path.isdir(month_dir):
+                continue
+            for name in os.listdir(month_dir):
+                match = SEGMENT_NAME.match(name)
+                if not match:
+                    continue
+                partition_key = match.group(1)
+                if start_key is not None and partition_key < start_key[:len(partition_key)]:
+                    continue
+                if end_key is not None and partition_key >= end_key:
+                    continue
+                segments.append((partition_key, os.path.join(month_dir, name)))
+        return [path for _, path in sorted(segments)]
+
+    @staticmethod
+    def _read_index(path):
+        try:
+            with open(f"{path}.idx", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break # Torn by a crash mid-write
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logging.error(f"Skipping unreadable archive index line in {path}.idx")
+        except FileNotFoundError:
+            return
+
+    def iter_lines(self, start=None, end=None, types=None, sources=None):
+        """
+        Yields the raw NDJSON lines (bytes, newline included) of every archived object with
+        start <= valid_from < end, optionally limited to the given STIX `types` and `sources`.
+        Bounds are datetimes or ISO 8601 timestamps; None leaves that side open.
+        Lines come out segment by segment, in valid_from order within each block.
+        """
+        start_key, end_key = _range_key(start), _range_key(end)
+        types = set(types) if types else None
+        sources = set(sources) if sources else None
+        for path in self.segments(start, end):
+            extension = os.path.splitext(path)[1]
+            with open(path, "rb") as f:
+                view = None
+                for entry in self._read_index(path):
+                    if types is not None and entry["type"] not in types:
+                        continue
+                    if sources is not None and entry["source"] not in sources:
+                        continue
+                    if (start_key is not None and entry["last"] < start_key) or (end_key is not None and entry["first"] >= end_key):
+                        continue
+                    mark_keys = [key for key, _ in entry["marks"]]
+                    begin = 0 if start_key is None else bisect.bisect_left(mark_keys, start_key)
+                    stop = len(mark_keys) if end_key is None else bisect.bisect_left(mark_keys, end_key)
+                    if begin >= stop:
+                        continue
+                    begin_offset = entry["marks"][begin][1]
+                    stop_offset = entry["marks"][stop][1] if stop < len(mark_keys) else None
+                    if extension == ".ndjson":
+                        # Uncompressed: slice just the wanted lines out of the mapped file
+                        if view is None:
+                            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        data = view[entry["offset"] + begin_offset:entry["offset"] + (entry["length"] if stop_offset is None else stop_offset)]
+                    else:
+                        f.seek(entry["offset"])
+                        data = _decompress(f.read(entry["length"]), extension)[begin_offset:stop_offset]
+                    yield from data.splitlines(keepends=True)
+                if view is not None:
+                    view.close()
+
+    def iter_objects(self, start=None, end=None, types=None, sources=None):
+        """Same as iter_lines(), parsed into STIX dicts."""
+        for line in self.iter_lines(start, end, types, sources):
+            yield json.loads(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streams archived STIX objects as NDJSON to stdout.")
+    parser.add_argument("archive_dir", help="Archive directory (ARCHIVE_DIR)")
+    parser.add_argument("--start", help="Earliest valid_from to include (ISO 8601)")
+    parser.add_argument("--end", help="Stop before this valid_from (ISO 8601)")
+    parser.add_argument("--type", action="append", dest="types", help="STIX type to include (repeatable)")
+    parser.add_argument("--source", action="append", dest="sources", help="Source to include (repeatable)")
+    args = parser.parse_args()
+    for line in ArchiveReader(args.archive_dir).iter_lines(args.start, args.end, args.types, args.sources):
+        sys.stdout.buffer.write(line)
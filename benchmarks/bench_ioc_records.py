@@ -0,0 +1,92 @@
+# bench_ioc_records.py
+# Micro-benchmark: STIX objects per second for per-IOC stix2 construction (the old
+# conversion path) versus IOCRecords emitted directly as STIX JSON (the current path).
+#
+# Usage: python benchmarks/bench_ioc_records.py [--iocs 20000]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ioc_record import IOCRecord, IOC_TYPE_MAP, now_timestamp, iter_stix_dicts
+
+SAMPLE_TYPES = ["IPv4", "domain", "URL", "FileHash-MD5", "FileHash-SHA256"]
+
+def _sample_value(ioc_type, i):
+    if ioc_type == "IPv4":
+        return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+    if ioc_type == "domain":
+        return f"host{i}.example.com"
+    if ioc_type == "URL":
+        return f"http://host{i}.example.com/path/{i}"
+    if ioc_type == "FileHash-MD5":
+        return f"{i:032x}"
+    return f"{i:064x}"
+
+def make_raw_iocs(count):
+    return [(SAMPLE_TYPES[i % len(SAMPLE_TYPES)], _sample_value(SAMPLE_TYPES[i % len(SAMPLE_TYPES)], i)) for i in range(count)]
+
+def convert_with_stix2(raw_iocs):
+    """The previous hot path: a validated stix2 observable and Indicator per IOC, then serialize."""
+    import stix2
+    observable_classes = {
+        "ipv4-addr": stix2.IPv4Address,
+        "ipv6-addr": stix2.IPv6Address,
+        "domain-name": stix2.DomainName,
+        "url": stix2.URL
+    }
+    created = now_timestamp()
+    fragments = []
+    for ioc_type, value in raw_iocs:
+        stix_type, hash_algorithm = IOC_TYPE_MAP[ioc_type]
+        if hash_algorithm:
+            observable = stix2.File(hashes={hash_algorithm: value})
+            pattern = f"[file:hashes.'{hash_algorithm}' = '{value}']"
+        else:
+            observable = observable_classes[stix_type](value=value)
+            pattern = f"[{stix_type}:value = '{value}']"
+        indicator = stix2.Indicator(
+            pattern=pattern,
+            pattern_type="stix",
+            description=f"{ioc_type} indicator: {value}",
+            valid_from=created,
+            object_marking_refs=[stix2.TLP_WHITE]
+        )
+        fragments.append(observable.serialize())
+        fragments.append(indicator.serialize())
+    return fragments
+
+def convert_with_records(raw_iocs, validate=False):
+    """The current hot path: IOCRecords, emitted as STIX dicts and serialized at publish time."""
+    created = now_timestamp()
+    records = [
+        IOCRecord.from_source_type("Benchmark", ioc_type, value, f"{ioc_type} indicator: {value}", created=created)
+        for ioc_type, value in raw_iocs
+    ]
+    return [json.dumps(stix_object, separators=(",", ":")) for stix_object in iter_stix_dicts(records, validate)]
+
+def _measure(label, convert, raw_iocs):
+    started = time.perf_counter()
+    fragments = convert(raw_iocs)
+    elapsed = time.perf_counter() - started
+    rate = len(fragments) / elapsed
+    print(f"{label:<32} {len(fragments):>8} objects  {elapsed:8.2f}s  {rate:>12,.0f} objects/sec")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare STIX conversion throughput of stix2 objects and IOC records.")
+    parser.add_argument("--iocs", type=int, default=20000, help="Number of IOCs to convert")
+    args = parser.parse_args()
+
+    raw_iocs = make_raw_iocs(args.iocs)
+    before = _measure("stix2 objects (before)", convert_with_stix2, raw_iocs)
+    after = _measure("IOC records (after)", convert_with_records, raw_iocs)
+    _measure("IOC records + stix2 validation", lambda iocs: convert_with_records(iocs, validate=True), raw_iocs)
+    print(f"Speedup: {after / before:.1f}x")
+
+if __name__ == "__main__":
+    main()
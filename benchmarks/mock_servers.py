@@ -0,0 +1,269 @@
+# mock_servers.py
+# Local stand-in HTTP server for the VirusTotal, AlienVault OTX and AbuseIPDB APIs and the
+# OpenTAXII Inbox service, used by the offline benchmarks. One server answers all four under
+# path prefixes (/vt/api/v3, /otx/api/v1, /abuseipdb/api/v2, /taxii/services/inbox).
+
+import gzip
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class MockSettings:
+    """
+    Knobs for a benchmark scenario.
+    `latency` is added to every response (seconds); every `rate_limit_every`-th request on each
+    route is answered with 429 and `Retry-After: retry_after` (0 disables injection). Counting per
+    route keeps the schedule fixed when several clients run concurrently.
+    The OTX subscription has `otx_pulses` pulses of `otx_indicators_per_pulse` indicators each.
+    """
+
+    def __init__(self, latency=0.0, rate_limit_every=0, retry_after=0.1,
+                 otx_pulses=200, otx_indicators_per_pulse=50, seed=1234):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.otx_pulses = otx_pulses
+        self.otx_indicators_per_pulse = otx_indicators_per_pulse
+        self.seed = seed
+
+class MockStats:
+    """Thread-safe request and byte counters collected by the mock server."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.rate_limited = 0
+        self.not_modified = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.taxii_objects = 0
+        self.taxii_indicators = 0
+        self.first_request_at = None # time.monotonic() of the first answered request
+
+    def record(self, route, bytes_in, bytes_out, rate_limited=False, taxii_objects=0, taxii_indicators=0, status=200):
+        with self._lock:
+            if self.first_request_at is None:
+                self.first_request_at = time.monotonic()
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.rate_limited += rate_limited
+            self.not_modified += status == 304
+            self.taxii_objects += taxii_objects
+            self.taxii_indicators += taxii_indicators
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "rate_limited": self.rate_limited,
+                "not_modified": self.not_modified,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_on_wire": self.bytes_in + self.bytes_out,
+                "taxii_objects": self.taxii_objects,
+                "taxii_indicators": self.taxii_indicators
+            }
+
+# Report times a day old, so the collector's TTLs keep everything served active (same length as any date)
+REPORTED_AT = time.strftime("%Y-%m-%dT%H:00:00", time.gmtime(time.time() - 86400))
+
+VT_OBJECT_TYPES = {"ip_addresses": "ip_address", "domains": "domain", "urls": "url", "files": "file"}
+OTX_TYPES = ["IPv4", "domain", "URL", "FileHash-MD5", "FileHash-SHA256", "hostname"]
+
+def _otx_value(indicator_type, n):
+    if indicator_type == "IPv4":
+        return f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+    if indicator_type in ("domain", "hostname"):
+        return f"h{n}.bench.example"
+    if indicator_type == "URL":
+        return f"http://h{n}.bench.example/p/{n}"
+    digest = hashlib.sha256(str(n).encode()).hexdigest()
+    return digest[:32] if indicator_type == "FileHash-MD5" else digest
+
+def _otx_pulse(settings, pulse_index):
+    base = pulse_index * settings.otx_indicators_per_pulse
+    return {
+        "id": f"{pulse_index:024x}",
+        "name": f"Benchmark pulse {pulse_index}",
+        "description": "Synthetic pulse served by the benchmark mock.",
+        "modified": f"{REPORTED_AT}.000000",
+        "indicators": [
+            {"type": OTX_TYPES[(base + i) % len(OTX_TYPES)], "indicator": _otx_value(OTX_TYPES[(base + i) % len(OTX_TYPES)], base + i)}
+            for i in range(settings.otx_indicators_per_pulse)
+        ]
+    }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Headers and body go out in separate writes; avoid delayed-ACK stalls on keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, route, status, payload, bytes_in=0, headers=None, taxii_objects=0, taxii_indicators=0):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.record(route, bytes_in, len(body), rate_limited=status == 429,
+                               taxii_objects=taxii_objects, taxii_indicators=taxii_indicators, status=status)
+
+    def _reply_cacheable(self, route, payload):
+        """Replies 200 with an ETag over the body, or 304 without one if the client already has it."""
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(route, 304, b"", headers={"ETag": etag})
+        else:
+            self._reply(route, 200, body, headers={"ETag": etag})
+
+    def _throttle(self, route, bytes_in=0):
+        """Applies latency and 429 injection. Returns True if the request was rate limited."""
+        settings = self.server.settings
+        if settings.latency:
+            time.sleep(settings.latency)
+        if settings.rate_limit_every:
+            with self.server.counter_lock:
+                count = self.server.counters.get(route, 0) + 1
+                self.server.counters[route] = count
+                limited = count % settings.rate_limit_every == 0
+            if limited:
+                self._reply(route, 429, {"error": "rate limited"}, bytes_in, {"Retry-After": str(settings.retry_after)})
+                return True
+        return False
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path
+        settings = self.server.settings
+
+        if path == "/otx/api/v1/pulses/subscribed":
+            if self._throttle("otx"):
+                return
+            page = int(query.get("page", 1))
+            limit = int(query.get("limit", 50))
+            start = (page - 1) * limit
+            end = min(start + limit, settings.otx_pulses)
+            next_url = None
+            if end < settings.otx_pulses:
+                next_url = f"http://{self.headers['Host']}{path}?limit={limit}&page={page + 1}"
+            payload = {
+                "count": settings.otx_pulses,
+                "results": [_otx_pulse(settings, i) for i in range(start, end)],
+                "next": next_url
+            }
+            self._reply_cacheable("otx", payload)
+        elif path == "/abuseipdb/api/v2/check":
+            if self._throttle("abuseipdb_check"):
+                return
+            ip_address = query.get("ip", "")
+            rng = random.Random(f"{settings.seed}-{ip_address}")
+            score = rng.choice([0, 0, 0, 25, 75, 100])
+            payload = {"data": {
+                "ipAddress": ip_address,
+                "isWhitelisted": False,
+                "abuseConfidenceScore": score,
+                "totalReports": score // 5,
+                "lastReportedAt": f"{REPORTED_AT}+00:00" if score else None
+            }}
+            self._reply_cacheable("abuseipdb_check", payload)
+        elif path == "/abuseipdb/api/v2/check-block":
+            if self._throttle("abuseipdb_check_block"):
+                return
+            network = query.get("network", "0.0.0.0/24")
+            prefix = network.rsplit(".", 1)[0]
+            payload = {"data": {
+                "networkAddress": network.split("/")[0],
+                "reportedAddress": [
+                    {"ipAddress": f"{prefix}.{i}", "numReports": 3, "mostRecentReport": f"{REPORTED_AT}+00:00",
+                     "abuseConfidenceScore": 80, "countryCode": "ZZ"}
+                    for i in range(1, 255, 17)
+                ]
+            }}
+            self._reply_cacheable("abuseipdb_check_block", payload)
+        elif re.match(r"^/vt/api/v3/(ip_addresses|domains|urls|files)/[^/]+$", path):
+            if self._throttle("vt"):
+                return
+            object_id = path.rsplit("/", 1)[1]
+            rng = random.Random(f"{settings.seed}-{object_id}")
+            malicious = rng.choice([0, 0, 1, 5, 30])
+            payload = {"data": {
+                "id": object_id,
+                "type": VT_OBJECT_TYPES[path.split("/")[4]],
+                "attributes": {
+                    "last_analysis_stats": {"malicious": malicious, "suspicious": 0, "harmless": 60 - malicious, "undetected": 10},
+                    "reputation": -malicious
+                }
+            }}
+            self._reply_cacheable("vt", payload)
+        else:
+            self._reply("unknown", 404, {"error": f"no mock for {path}"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != "/taxii/services/inbox":
+            self._reply("unknown", 404, {"error": "no mock"}, len(body))
+            return
+        if self._throttle("taxii_inbox", len(body)):
+            return
+        message = gzip.decompress(body) if self.headers.get("Content-Encoding") == "gzip" else body
+        objects = indicators = 0
+        for content in re.findall(rb"<taxii_10:Content>(.*?)</taxii_10:Content>", message, re.S):
+            bundle_objects = json.loads(html.unescape(content.decode("utf-8"))).get("objects", [])
+            objects += len(bundle_objects)
+            indicators += sum(1 for stix_object in bundle_objects if stix_object.get("type") == "indicator")
+        self._reply("taxii_inbox", 200, b"<taxii_10:Status_Message status_type=\"SUCCESS\"/>", len(body),
+                    taxii_objects=objects, taxii_indicators=indicators)
+
+class MockCTIServer:
+    """Runs the mock HTTP server on a background thread. Use as a context manager."""
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.settings = settings or MockSettings()
+        self.stats = MockStats()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.settings = self.settings
+        self._server.stats = self.stats
+        self._server.counters = {}
+        self._server.counter_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-cti-server", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def base_urls(self):
+        return {
+            "vt": f"{self.url}/vt/api/v3",
+            "otx": f"{self.url}/otx/api/v1",
+            "abuseipdb": f"{self.url}/abuseipdb/api/v2",
+            "taxii": f"{self.url}/taxii"
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,320 @@
+# run_benchmarks.py
+# Offline benchmark harness. Each scenario runs in its own subprocess against the local mock
+# servers (benchmarks/mock_servers.py) and reports cycle latency, indicators/sec, peak RSS and
+# bytes on the wire. Results can be stored as a baseline and compared against later runs.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py                       # run all scenarios, compare to baseline
+#   python benchmarks/run_benchmarks.py --scenario otx_fetcher
+#   python benchmarks/run_benchmarks.py --save-baseline       # overwrite benchmarks/baseline.json
+
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Metric -> True if higher is better
+METRICS = {
+    "cycle_seconds": False,
+    "indicators_per_sec": True,
+    "peak_rss_mb": False,
+    "bytes_on_wire": False
+}
+
+def _bench_environment(server, workdir):
+    """Environment that points config.py at the mock server and a scratch data directory."""
+    urls = server.base_urls()
+    return {
+        "VIRUSTOTAL_API_KEY": "bench-key",
+        "ALIENVAULT_OTX_API_KEY": "bench-key",
+        "ABUSEIPDB_API_KEY": "bench-key",
+        "VIRUSTOTAL_BASE_URL": urls["vt"],
+        "ALIENVAULT_OTX_BASE_URL": urls["otx"],
+        "ABUSEIPDB_BASE_URL": urls["abuseipdb"],
+        "OPENTAXII_SERVER_URL": urls["taxii"],
+        # Measure the pipeline, not the client-side quota pacing
+        "VIRUSTOTAL_REQUESTS_PER_MINUTE": "600000",
+        "ALIENVAULT_OTX_REQUESTS_PER_MINUTE": "600000",
+        "ABUSEIPDB_REQUESTS_PER_MINUTE": "600000",
+        "VIRUSTOTAL_DAILY_QUOTA": "0",
+        "ABUSEIPDB_DAILY_QUOTA": "0",
+        "ABUSEIPDB_MAX_REQUESTS_PER_CYCLE": "100000",
+        "ALIENVAULT_OTX_BACKFILL": "true",
+        "ABUSEIPDB_CACHE_PATH": os.path.join(workdir, "abuseipdb_cache.sqlite3"),
+        "VIRUSTOTAL_CACHE_PATH": os.path.join(workdir, "virustotal_cache.sqlite3"),
+        "SEEN_STORE_PATH": os.path.join(workdir, "seen_indicators.sqlite3"),
+        "ALIENVAULT_OTX_CURSOR_PATH": os.path.join(workdir, "otx_cursor.json"),
+        "SCHEDULER_STATE_PATH": os.path.join(workdir, "scheduler_state.json"),
+        "OUTBOX_DIR": os.path.join(workdir, "outbox"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "HTTP_VALIDATOR_CACHE_PATH": os.path.join(workdir, "http_validators.sqlite3"),
+        "LIFECYCLE_DB_PATH": os.path.join(workdir, "lifecycle.sqlite3")
+    }
+
+def _ip_list(count):
+    # Clustered so block queries have something to group
+    return [f"172.{16 + (i // 65536) % 16}.{(i // 256) % 256}.{i % 256}" for i in range(count)]
+
+# --- Scenarios: each takes (server, workdir) and returns the number of indicators produced ---
+
+def scenario_otx_fetcher(server, workdir):
+    from otx_fetcher import AlienVaultOTXFetcher
+    fetcher = AlienVaultOTXFetcher("bench-key", base_url=server.base_urls()["otx"], requests_per_minute=600000,
+                                   cursor_path=os.path.join(workdir, "otx_cursor.json"))
+    return sum(1 for _ in fetcher.iter_indicators(backfill=True))
+
+def scenario_otx_poll_unchanged(server, workdir):
+    # Two polls of an unchanged subscription: the second should be a single 304
+    from otx_fetcher import AlienVaultOTXFetcher
+    from validator_cache import ValidatorCache
+    fetcher = AlienVaultOTXFetcher("bench-key", base_url=server.base_urls()["otx"], requests_per_minute=600000,
+                                   cursor_path=os.path.join(workdir, "otx_cursor.json"), sort="-modified",
+                                   validator_cache=ValidatorCache(os.path.join(workdir, "http_validators.sqlite3")))
+    indicators = 0
+    for _ in range(2):
+        indicators += sum(1 for _ in fetcher.iter_indicators(backfill=True))
+        fetcher.commit()
+    return indicators
+
+def scenario_abuseipdb_fetcher(server, workdir):
+    from abuseipdb_fetcher import AbuseIPDBFetcher
+    from reputation_cache import ReputationCache
+    fetcher = AbuseIPDBFetcher(
+        "bench-key", base_url=server.base_urls()["abuseipdb"],
+        cache=ReputationCache(os.path.join(workdir, "abuseipdb_cache.sqlite3"), 86400),
+        max_workers=8, block_query_min_ips=3, requests_per_minute=600000, daily_quota=None
+    )
+    return len(fetcher.fetch_recent_indicators(ip_list=_ip_list(2000)))
+
+def scenario_vt_enrichment(server, workdir):
+    from vt_fetcher import VirusTotalFetcher
+    from reputation_cache import ReputationCache
+    from ioc_record import IOCRecord
+    fetcher = VirusTotalFetcher(
+        "bench-key", base_url=server.base_urls()["vt"],
+        cache=ReputationCache(os.path.join(workdir, "virustotal_cache.sqlite3"), 86400),
+        max_workers=8, requests_per_minute=600000, daily_quota=None
+    )
+    # 1000 distinct values, each reported twice, across all four VT collections
+    kinds = [("IPv4", "10.0.{}.{}"), ("domain", "h{}-{}.bench.example"), ("URL", "http://h{}.bench.example/{}"), ("FileHash-MD5", "{:016x}{:016x}")]
+    records = [
+        IOCRecord.from_source_type(source, kinds[i % 4][0], kinds[i % 4][1].format(i // 256, i % 256), "Synthetic")
+        for source in ("Benchmark", "Benchmark-2") for i in range(1000)
+    ]
+    fetcher.enrich_records(records)
+    return sum(1 for record in records if record.custom_properties)
+
+def scenario_taxii_publisher(server, workdir, conversion_workers=1):
+    from taxii_publisher import TAXIIPublisher
+    from ioc_record import IOCRecord, now_timestamp
+    publisher = TAXIIPublisher(server.base_urls()["taxii"], "default_collection", "admin", "bench",
+                               conversion_workers=conversion_workers)
+    created = now_timestamp()
+    records = (
+        IOCRecord.from_source_type("Benchmark", "domain", f"h{i}.bench.example", "Synthetic", created=created)
+        for i in range(20000)
+    )
+    publisher.publish_objects(records)
+    publisher.close()
+    return server.stats.taxii_indicators
+
+def scenario_taxii_publisher_sharded(server, workdir):
+    # Includes worker start-up; bytes_on_wire must match the serial taxii_publisher scenario
+    return scenario_taxii_publisher(server, workdir, conversion_workers=4)
+
+def scenario_taxii_publisher_correlated(server, workdir):
+    # Three sources reporting the same 10000 domains (in different spellings) merge into 10000 Indicators
+    from correlation import correlate, normalize_records
+    from taxii_publisher import TAXIIPublisher
+    from ioc_record import IOCRecord, now_timestamp
+    publisher = TAXIIPublisher(server.base_urls()["taxii"], "default_collection", "admin", "bench")
+    created = now_timestamp()
+    records = [
+        IOCRecord.from_source_type(source, "domain", spelling.format(i), "Synthetic", created=created,
+                                   custom_properties={f"x_{key}_score": i % 100})
+        for source, key, spelling in (("AlienVault OTX", "otx", "h{}.bench.example"), ("AbuseIPDB", "abuseipdb", "H{}.Bench.Example"),
+                                      ("Benchmark", "bench", "h{}.bench.example."))
+        for i in range(10000)
+    ]
+    publisher.publish_objects(correlate(normalize_records(records)))
+    publisher.close()
+    return server.stats.taxii_indicators
+
+def scenario_index_lookup(server, workdir):
+    import requests
+    from indicator_index import IndicatorIndex, start_index_server
+    from ioc_record import IOCRecord
+    index = IndicatorIndex()
+    index.add_records(
+        IOCRecord.from_source_type("Benchmark", kind, pattern.format(i // 256, i % 256), "Synthetic")
+        for i in range(50000) for kind, pattern in (("IPv4", "10.0.{}.{}"), ("domain", "h{}-{}.bench.example"))
+    )
+    api = start_index_server(index, 0)
+    url = f"http://127.0.0.1:{api.server_address[1]}/lookup"
+    # Half hits (IPs and subdomains of indexed domains), half misses, in batches of 500
+    values = [f"10.0.{i // 256 % 256}.{i % 256}" if i % 4 == 0 else f"www.h{i // 256}-{i % 256}.bench.example" if i % 4 == 1
+              else f"192.0.2.{i % 256}" if i % 4 == 2 else f"miss{i}.example" for i in range(50000)]
+    with requests.Session() as session:
+        for i in range(0, len(values), 500):
+            session.post(url, json={"values": values[i:i + 500]}).raise_for_status()
+    api.shutdown()
+    return len(values)
+
+def scenario_lifecycle_sweep(server, workdir):
+    # 50000 indicators reported over the last 14 days, refreshed once, then aged out by 30 daily sweeps
+    import time
+    from ioc_record import IOCRecord
+    from lifecycle import DAY, IndicatorLifecycle
+    lifecycle = IndicatorLifecycle(os.path.join(workdir, "lifecycle.sqlite3"))
+    now = time.time()
+    records = [
+        IOCRecord.from_source_type("Benchmark", "IPv4", f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}", "Synthetic",
+                                   valid_from=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now - (i % 14) * DAY)))
+        for i in range(50000)
+    ]
+    lifecycle.observe(records, now)
+    lifecycle.observe(records[::2], now)
+    expired = 0
+    for day in range(1, 31):
+        batch = lifecycle.expire_due(now + day * DAY)
+        lifecycle.mark_expired(batch, now + day * DAY)
+        expired += len(lifecycle.expiry_updates(batch, now + day * DAY))
+    lifecycle.compact(now + 31 * DAY)
+    return expired
+
+def scenario_full_cycle(server, workdir):
+    import main
+    main.run_collection_and_publishing()
+    return server.stats.taxii_indicators
+
+SCENARIOS = {
+    "otx_fetcher": (scenario_otx_fetcher, {"otx_pulses": 1000, "otx_indicators_per_pulse": 50}),
+    "otx_fetcher_throttled": (scenario_otx_fetcher, {"otx_pulses": 200, "otx_indicators_per_pulse": 50,
+                                                     "latency": 0.01, "rate_limit_every": 3}),
+    "otx_poll_unchanged": (scenario_otx_poll_unchanged, {"otx_pulses": 200, "otx_indicators_per_pulse": 50}),
+    "abuseipdb_fetcher": (scenario_abuseipdb_fetcher, {"latency": 0.002}),
+    "vt_enrichment": (scenario_vt_enrichment, {"latency": 0.002}),
+    "taxii_publisher": (scenario_taxii_publisher, {"latency": 0.005}),
+    "taxii_publisher_sharded": (scenario_taxii_publisher_sharded, {"latency": 0.005}),
+    "taxii_correlated": (scenario_taxii_publisher_correlated, {"latency": 0.005}),
+    "index_lookup": (scenario_index_lookup, {}),
+    "lifecycle_sweep": (scenario_lifecycle_sweep, {}),
+    "full_cycle": (scenario_full_cycle, {"otx_pulses": 100, "otx_indicators_per_pulse": 50, "latency": 0.005}),
+    "full_cycle_throttled": (scenario_full_cycle, {"otx_pulses": 100, "otx_indicators_per_pulse": 50,
+                                                   "latency": 0.02, "rate_limit_every": 5})
+}
+
+def run_scenario_in_process(name):
+    """Runs one scenario in the current process and returns its result dict."""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from mock_servers import MockCTIServer, MockSettings
+
+    scenario, settings = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as workdir, MockCTIServer(MockSettings(**settings)) as server:
+        os.environ.update(_bench_environment(server, workdir))
+        started = time.perf_counter()
+        indicators = scenario(server, workdir)
+        elapsed = time.perf_counter() - started
+        stats = server.stats.as_dict()
+
+    return {
+        "cycle_seconds": round(elapsed, 4),
+        "indicators": indicators,
+        "indicators_per_sec": round(indicators / elapsed, 1) if elapsed else 0.0,
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "bytes_on_wire": stats["bytes_on_wire"],
+        "requests": stats["requests"],
+        "rate_limited": stats["rate_limited"]
+    }
+
+def run_scenario(name, log_level, repeat):
+    """
+    Runs a scenario `repeat` times, each in a fresh interpreter so peak RSS and module state
+    are isolated, and keeps the median of each metric.
+    """
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", name, "--log-level", log_level],
+            capture_output=True, text=True, cwd=REPO_DIR
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Scenario {name} failed:\n{completed.stderr[-4000:]}")
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    result = runs[-1]
+    for metric in METRICS:
+        result[metric] = statistics.median(run[metric] for run in runs)
+    return result
+
+def compare(results, baseline, tolerance):
+    """Prints results next to the baseline. Returns the list of regressed (scenario, metric) pairs."""
+    regressions = []
+    print(f"{'scenario':<24}{'metric':<22}{'current':>16}{'baseline':>16}{'change':>10}")
+    for name, result in results.items():
+        for metric, higher_is_better in METRICS.items():
+            current = result[metric]
+            previous = baseline.get(name, {}).get(metric)
+            change = ""
+            if previous:
+                delta = (current - previous) / previous
+                change = f"{delta:+.1%}"
+                worse = -delta if higher_is_better else delta
+                if worse > tolerance:
+                    regressions.append((name, metric))
+                    change += " !"
+            print(f"{name:<24}{metric:<22}{current:>16,.2f}{(previous if previous is not None else float('nan')):>16,.2f}{change:>10}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the CTI collector against local mock servers.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run (repeatable; default: all)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results to the baseline file")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the median is reported")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative change treated as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero if any metric regressed")
+    parser.add_argument("--log-level", default="WARNING", help="Collector log level inside scenarios")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+        print(json.dumps(run_scenario_in_process(args.child)))
+        return
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        print(f"Running {name}...", flush=True)
+        results[name] = run_scenario(name, args.log_level, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: " + ", ".join(f"{name}.{metric}" for name, metric in regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
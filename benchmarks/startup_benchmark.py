@@ -0,0 +1,125 @@
+# startup_benchmark.py
+# Cold-start benchmark for one-shot runs (cron, Kubernetes CronJobs): launches `main.py --once`
+# under `python -X importtime` against the local mock servers and reports import time and
+# time-to-first-request, i.e. how long the process takes before it does any useful work.
+#
+# Usage:
+#   python benchmarks/startup_benchmark.py                    # compare to benchmarks/startup_baseline.json
+#   python benchmarks/startup_benchmark.py --save-baseline
+#   python benchmarks/startup_benchmark.py --top 20           # show the 20 slowest imports
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "startup_baseline.json")
+
+sys.path.insert(0, BENCH_DIR)
+from mock_servers import MockCTIServer, MockSettings
+from run_benchmarks import _bench_environment
+
+# Metric -> True if higher is better
+METRICS = {
+    "time_to_first_request": False,
+    "import_seconds": False,
+    "run_seconds": False
+}
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output into [(module, self_us, cumulative_us, depth)].
+    Depth 0 entries are the imports made directly by the entry script (or by site).
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        stripped = name.lstrip(" ")
+        imports.append((stripped.strip(), int(self_us), int(cumulative_us), (len(name) - len(stripped) - 1) // 2))
+    return imports
+
+def run_once():
+    """Runs one cold `main.py --once` and returns its measurements."""
+    with tempfile.TemporaryDirectory() as workdir, MockCTIServer(MockSettings(otx_pulses=2, otx_indicators_per_pulse=10)) as server:
+        env = dict(os.environ, **_bench_environment(server, workdir))
+        env.update({"METRICS_PORT": "0", "INDEX_API_PORT": "0", "LOG_LEVEL": "WARNING", "STIX_CONVERSION_WORKERS": "1"})
+        started = time.monotonic()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", os.path.join(REPO_DIR, "main.py"), "--once"],
+            capture_output=True, text=True, cwd=REPO_DIR, env=env
+        )
+        finished = time.monotonic()
+        first_request_at = server.stats.first_request_at
+    if completed.returncode != 0:
+        raise RuntimeError(f"main.py --once failed:\n{completed.stderr[-4000:]}")
+    imports = parse_importtime(completed.stderr)
+    # Everything up to `site` is interpreter start-up; what follows is imported by the collector
+    site_index = max((i for i, entry in enumerate(imports) if entry[0] == "site" and entry[3] == 0), default=-1)
+    app_imports = [entry for entry in imports[site_index + 1:] if entry[3] == 0]
+    return {
+        "time_to_first_request": round(first_request_at - started, 4) if first_request_at else None,
+        "import_seconds": round(sum(entry[2] for entry in app_imports) / 1e6, 4),
+        "run_seconds": round(finished - started, 4),
+        "imports": imports
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures cold-start time of a one-shot collector run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs; the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list (by cumulative time)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative change treated as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit non-zero if any metric regressed")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.repeat)]
+    result = {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+
+    slowest = {}
+    for run in runs:
+        for name, _, cumulative_us, depth in run["imports"]:
+            if depth <= 1:
+                slowest.setdefault(name, []).append(cumulative_us)
+    print("Slowest imports (median cumulative, depth <= 1):")
+    for name, times in sorted(slowest.items(), key=lambda item: -statistics.median(item[1]))[:args.top]:
+        print(f"  {statistics.median(times) / 1000:8.1f} ms  {name}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = []
+    print(f"{'metric':<24}{'current':>12}{'baseline':>12}{'change':>10}")
+    for metric, higher_is_better in METRICS.items():
+        current, previous = result[metric], baseline.get(metric)
+        change = ""
+        if previous and current is not None:
+            delta = (current - previous) / previous
+            change = f"{delta:+.1%}"
+            if (-delta if higher_is_better else delta) > args.tolerance:
+                regressions.append(metric)
+                change += " !"
+        print(f"{metric:<24}{current if current is not None else float('nan'):>12.3f}"
+              f"{previous if previous is not None else float('nan'):>12.3f}{change:>10}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: " + ", ".join(regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -13,3 +13,116 @@ OPENTAXII_PASSWORD = os.getenv('OPENTAXII_PASSWORD', 'YvhzY3gGHHbpfNvXa0c-RpuqYn
 VIRUSTOTAL_API_KEY = os.getenv('VIRUSTOTAL_API_KEY', '513bf61cf011c015a0a5124ae7aa140412381e6b2115907fcfc500547e573fa2') # Free tier available
 ALIENVAULT_OTX_API_KEY = os.getenv('ALIENVAULT_OTX_API_KEY', 'cc10d2976dbe84523c003c2b0b3bdb9ba375683d1b3469aec36438aa2c98acec') # Free tier available
 ABUSEIPDB_API_KEY = os.getenv('ABUSEIPDB_API_KEY', '5489b1d7dd9346cae4ffc0eb4c64a43dba74678d2a667ea2181c088fa489da5d891a8e81a1ec1222') # Free tier available (requires registration)
+
+# CTI Feed API Base URLs (override to point at a proxy or the local benchmark mocks)
+VIRUSTOTAL_BASE_URL = os.getenv('VIRUSTOTAL_BASE_URL', 'https://www.virustotal.com/api/v3')
+ALIENVAULT_OTX_BASE_URL = os.getenv('ALIENVAULT_OTX_BASE_URL', 'https://otx.alienvault.com/api/v1')
+ABUSEIPDB_BASE_URL = os.getenv('ABUSEIPDB_BASE_URL', 'https://api.abuseipdb.com/api/v2')
+
+# Collection Stage Configuration
+# Each source runs concurrently and gets its own deadline (in seconds) per cycle.
+# A source that hits its deadline contributes whatever it collected up to that point.
+ALIENVAULT_OTX_FETCH_DEADLINE = float(os.getenv('ALIENVAULT_OTX_FETCH_DEADLINE', '300'))
+ABUSEIPDB_FETCH_DEADLINE = float(os.getenv('ABUSEIPDB_FETCH_DEADLINE', '300'))
+# A scheduled run processes and spools its records this many at a time, so a long OTX walk is never held in memory
+SOURCE_BATCH_SIZE = int(os.getenv('SOURCE_BATCH_SIZE', '10000'))
+
+# AbuseIPDB Batch Lookup Configuration
+# Reputation results are cached on a local volume so unchanged IPs are not re-checked every cycle.
+ABUSEIPDB_CACHE_PATH = os.getenv('ABUSEIPDB_CACHE_PATH', 'data/abuseipdb_cache.sqlite3')
+ABUSEIPDB_CACHE_TTL = int(os.getenv('ABUSEIPDB_CACHE_TTL', '86400')) # Seconds
+ABUSEIPDB_MAX_WORKERS = int(os.getenv('ABUSEIPDB_MAX_WORKERS', '4')) # Concurrent lookups for cache misses
+ABUSEIPDB_MAX_REQUESTS_PER_CYCLE = int(os.getenv('ABUSEIPDB_MAX_REQUESTS_PER_CYCLE', '40')) # Free tier: 1000 checks/day
+# When at least this many uncached IPs share a /24, query the whole block with one check-block request (0 disables)
+ABUSEIPDB_BLOCK_QUERY_MIN_IPS = int(os.getenv('ABUSEIPDB_BLOCK_QUERY_MIN_IPS', '3'))
+
+# VirusTotal Enrichment Configuration
+# IPs, domains, URLs and hashes from the other feeds are looked up on VirusTotal after each fetch.
+# Verdicts (including "not found") are cached so each value costs at most one request per TTL.
+VIRUSTOTAL_CACHE_PATH = os.getenv('VIRUSTOTAL_CACHE_PATH', 'data/virustotal_cache.sqlite3')
+VIRUSTOTAL_CACHE_TTL = int(os.getenv('VIRUSTOTAL_CACHE_TTL', '259200')) # Seconds; verdicts change slowly
+VIRUSTOTAL_MAX_WORKERS = int(os.getenv('VIRUSTOTAL_MAX_WORKERS', '4')) # Concurrent lookups for cache misses
+# Free tier: 500 lookups/day shared by ~120 source runs/day at the default intervals
+VIRUSTOTAL_MAX_LOOKUPS_PER_CYCLE = int(os.getenv('VIRUSTOTAL_MAX_LOOKUPS_PER_CYCLE', '5'))
+VIRUSTOTAL_ENRICH_DEADLINE = float(os.getenv('VIRUSTOTAL_ENRICH_DEADLINE', '120')) # Seconds per run; remaining lookups wait for the next one
+
+# API Rate Limits (requests per minute and per UTC day; a daily quota of 0 means unlimited)
+# Defaults follow each provider's documented free-tier limits.
+VIRUSTOTAL_REQUESTS_PER_MINUTE = int(os.getenv('VIRUSTOTAL_REQUESTS_PER_MINUTE', '4')) # 0 = unlimited
+VIRUSTOTAL_DAILY_QUOTA = int(os.getenv('VIRUSTOTAL_DAILY_QUOTA', '500'))
+ALIENVAULT_OTX_REQUESTS_PER_MINUTE = int(os.getenv('ALIENVAULT_OTX_REQUESTS_PER_MINUTE', '160')) # 10,000 per hour; 0 = unlimited
+ALIENVAULT_OTX_DAILY_QUOTA = int(os.getenv('ALIENVAULT_OTX_DAILY_QUOTA', '0'))
+ABUSEIPDB_REQUESTS_PER_MINUTE = int(os.getenv('ABUSEIPDB_REQUESTS_PER_MINUTE', '60')) # 0 = unlimited
+ABUSEIPDB_DAILY_QUOTA = int(os.getenv('ABUSEIPDB_DAILY_QUOTA', '1000'))
+# Retries for throttled or failed requests (bounded exponential backoff with jitter, or Retry-After)
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '4'))
+# ETag / Last-Modified of previous responses, so unchanged data is answered with 304 Not Modified ('' disables)
+HTTP_VALIDATOR_CACHE_PATH = os.getenv('HTTP_VALIDATOR_CACHE_PATH', 'data/http_validators.sqlite3')
+
+# Delta Publishing Configuration
+# Fingerprints of published objects; only new or changed objects are sent to OpenTAXII.
+SEEN_STORE_PATH = os.getenv('SEEN_STORE_PATH', 'data/seen_indicators.sqlite3')
+
+# TAXII Publishing Configuration
+# Objects are streamed to OpenTAXII in bounded chunks, each sent as its own Inbox message.
+TAXII_CHUNK_MAX_BYTES = int(os.getenv('TAXII_CHUNK_MAX_BYTES', '5000000'))
+TAXII_CHUNK_MAX_OBJECTS = int(os.getenv('TAXII_CHUNK_MAX_OBJECTS', '5000'))
+TAXII_GZIP = os.getenv('TAXII_GZIP', 'false').lower() in ('1', 'true', 'yes') # Requires a server/proxy that accepts Content-Encoding: gzip
+TAXII_MAX_PARALLEL_CHUNKS = int(os.getenv('TAXII_MAX_PARALLEL_CHUNKS', '2'))
+TAXII_CHUNK_RETRIES = int(os.getenv('TAXII_CHUNK_RETRIES', '3'))
+TAXII_CONNECT_TIMEOUT = float(os.getenv('TAXII_CONNECT_TIMEOUT', '10')) # Seconds
+TAXII_READ_TIMEOUT = float(os.getenv('TAXII_READ_TIMEOUT', '120')) # Seconds to wait for the Inbox to answer; a timed-out chunk is retried
+TAXII_VALIDATE_STIX = os.getenv('TAXII_VALIDATE_STIX', 'false').lower() in ('1', 'true', 'yes') # Full stix2 validation of every emitted object (slower)
+# Record -> STIX JSON conversion is sharded over worker processes; output is identical for any worker count
+STIX_CONVERSION_WORKERS = int(os.getenv('STIX_CONVERSION_WORKERS', '0')) # 0 = one per CPU, 1 = in-process
+STIX_CONVERSION_SHARD_SIZE = int(os.getenv('STIX_CONVERSION_SHARD_SIZE', '2000')) # Items per shard
+
+# AlienVault OTX Incremental Ingestion
+# The cursor records the latest pulse modification time seen so each cycle only pulls what changed.
+ALIENVAULT_OTX_CURSOR_PATH = os.getenv('ALIENVAULT_OTX_CURSOR_PATH', 'data/otx_cursor.json')
+ALIENVAULT_OTX_PAGE_SIZE = int(os.getenv('ALIENVAULT_OTX_PAGE_SIZE', '50'))
+ALIENVAULT_OTX_INITIAL_LOOKBACK_DAYS = int(os.getenv('ALIENVAULT_OTX_INITIAL_LOOKBACK_DAYS', '30')) # First run without a cursor; 0 = full backfill
+ALIENVAULT_OTX_BACKFILL = os.getenv('ALIENVAULT_OTX_BACKFILL', 'false').lower() in ('1', 'true', 'yes') # Ignore the cursor and walk the whole subscription
+ALIENVAULT_OTX_SORT = os.getenv('ALIENVAULT_OTX_SORT', '') # Explicit page order, e.g. '-modified'; empty = API default, which disables the conditional first page
+
+# Observability
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100')) # Prometheus /metrics endpoint; 0 disables
+# When set, the first cycle runs under a sampling profiler and its collapsed stacks are written here
+PROFILE_CYCLE_PATH = os.getenv('PROFILE_CYCLE_PATH', '')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005')) # Seconds between samples
+
+# Scheduling: each source is polled on its own interval (seconds), started up to *_JITTER seconds late
+ALIENVAULT_OTX_INTERVAL = int(os.getenv('ALIENVAULT_OTX_INTERVAL', '900')) # High churn, incremental and cheap
+ALIENVAULT_OTX_JITTER = int(os.getenv('ALIENVAULT_OTX_JITTER', '60'))
+ABUSEIPDB_INTERVAL = int(os.getenv('ABUSEIPDB_INTERVAL', '3600'))
+ABUSEIPDB_JITTER = int(os.getenv('ABUSEIPDB_JITTER', '120'))
+SCHEDULER_STATE_PATH = os.getenv('SCHEDULER_STATE_PATH', 'data/scheduler_state.json') # Start of the last successful run per source
+
+# Outbox: durable spool between the fetchers and the TAXII publisher worker
+OUTBOX_DIR = os.getenv('OUTBOX_DIR', 'data/outbox')
+OUTBOX_SEGMENT_MAX_BYTES = int(os.getenv('OUTBOX_SEGMENT_MAX_BYTES', '16000000')) # Roll over to a new segment file past this size
+OUTBOX_MAX_PENDING_BYTES = int(os.getenv('OUTBOX_MAX_PENDING_BYTES', '1000000000')) # Fetchers wait for the publisher above this
+OUTBOX_BACKPRESSURE_TIMEOUT = int(os.getenv('OUTBOX_BACKPRESSURE_TIMEOUT', '60')) # Seconds a fetcher waits before spooling anyway
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20000')) # Records per publish batch
+OUTBOX_FSYNC = os.getenv('OUTBOX_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+OUTBOX_RETRY_MAX = int(os.getenv('OUTBOX_RETRY_MAX', '300')) # Upper bound (seconds) on backoff between failed batches
+
+# Indicator lookup API: in-memory index of collected indicators with batch lookups over HTTP
+INDEX_API_PORT = int(os.getenv('INDEX_API_PORT', '8088')) # 0 disables the TCP listener
+INDEX_API_HOST = os.getenv('INDEX_API_HOST', '127.0.0.1') # Local only by default; use 0.0.0.0 to serve other containers
+INDEX_API_SOCKET = os.getenv('INDEX_API_SOCKET', '') # Unix socket path; when set it is used instead of TCP
+
+# Archive: every collected object is also appended to time-partitioned NDJSON segments for bulk analytics
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'data/archive') # '' disables the archive
+ARCHIVE_PARTITION = os.getenv('ARCHIVE_PARTITION', 'hour') # One segment per 'hour' or 'day' of valid_from
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', '') # '', 'gzip' or 'zstd' (needs the zstandard package)
+ARCHIVE_FSYNC = os.getenv('ARCHIVE_FSYNC', 'false').lower() in ('1', 'true', 'yes')
+
+# Indicator lifecycle: Indicators expire a TTL (per source and type) after their source last reported them.
+# Expired ones are re-published with valid_until set and dropped from the index and local state.
+LIFECYCLE_DB_PATH = os.getenv('LIFECYCLE_DB_PATH', 'data/lifecycle.sqlite3') # '' disables expiry
+LIFECYCLE_TTL_DAYS = os.getenv('LIFECYCLE_TTL_DAYS', '') # Overrides, e.g. 'AbuseIPDB:ipv4-addr=30,*:file=730'; see lifecycle.py for defaults
+LIFECYCLE_REVOKE = os.getenv('LIFECYCLE_REVOKE', 'false').lower() in ('1', 'true', 'yes') # Also mark expired Indicators revoked
+LIFECYCLE_SWEEP_INTERVAL = int(os.getenv('LIFECYCLE_SWEEP_INTERVAL', '900')) # Seconds between expiry sweeps
+LIFECYCLE_COMPACT_INTERVAL = int(os.getenv('LIFECYCLE_COMPACT_INTERVAL', '86400')) # Seconds between compactions of local state
@@ -0,0 +1,105 @@
+# correlation.py
+# Cross-source correlation: normalizes observable values and hash-joins records from every source
+# on them, so each value is published as one Observable and one Indicator carrying all attributions
+
+import ipaddress
+from urllib.parse import urlsplit, urlunsplit
+from ioc_record import IOCRecord
+
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21}
+
+def normalize_url(url):
+    """Lowercases scheme and host, drops the default port and the fragment and gives an empty path '/'."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.hostname:
+        return url
+    scheme = parts.scheme.lower()
+    host = parts.hostname.rstrip(".") # urlsplit already lowercases it
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host if port is None or port == DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+    if "@" in parts.netloc:
+        netloc = parts.netloc.rsplit("@", 1)[0] + "@" + netloc
+    # The fragment never reaches the server, so it does not identify a different resource
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+def normalize_value(stix_type, value):
+    """
+    Canonical form of an observable value: compressed IPs and CIDRs (a /32 or /128 becomes
+    the address), lowercased domains without the trailing dot, normalized URLs and lowercased
+    file hashes. Values that do not parse are only stripped.
+    """
+    value = value.strip()
+    if stix_type in ("ipv4-addr", "ipv6-addr"):
+        try:
+            if "/" not in value:
+                return str(ipaddress.ip_address(value))
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            return value
+        return str(network.network_address) if network.num_addresses == 1 else str(network)
+    if stix_type == "domain-name":
+        return value.lower().rstrip(".")
+    if stix_type == "url":
+        return normalize_url(value)
+    if stix_type == "file":
+        return value.lower()
+    return value
+
+def normalize_records(records):
+    """Rewrites the values of IOCRecords in place into their canonical form. Returns the records."""
+    for record in records:
+        if isinstance(record, IOCRecord):
+            record.value = normalize_value(record.stix_type, record.value)
+    return records
+
+def merge_records(records):
+    """
+    Merges per-source IOCRecords for one observable value into a new record with one
+    Indicator: its id depends on the value only, `sources` lists every reporting source,
+    custom properties (scores, verdicts) are combined, valid_from and created are the
+    earliest reported and descriptions and extra pattern terms are kept from each source.
+    """
+    records = sorted(records, key=lambda record: record.source)
+    first = records[0]
+    descriptions = list(dict.fromkeys(record.description for record in records if record.description))
+    extra_patterns = list(dict.fromkeys(record.extra_pattern for record in records if record.extra_pattern))
+    custom_properties = {}
+    for record in records:
+        custom_properties.update((key, value) for key, value in (record.custom_properties or {}).items() if value is not None)
+    return IOCRecord(
+        first.source, first.ioc_type, first.value, first.stix_type, first.hash_algorithm,
+        " | ".join(descriptions),
+        valid_from=min(record.valid_from for record in records),
+        created=min(record.created for record in records),
+        extra_pattern=" AND ".join(extra_patterns) or None,
+        custom_properties=custom_properties or None,
+        sources=list(dict.fromkeys(record.source for record in records))
+    )
+
+def correlate(items, active_records=None):
+    """
+    Hash-joins IOCRecords on their Observable id (i.e. type and normalized value) and returns
+    one merged record per value, in order of first appearance; other items pass through.
+    `active_records` optionally maps a list of Observable ids to {observable_id: [records]}
+    still active from earlier runs (see IndicatorLifecycle.active_records), so a value also
+    keeps the attributions of sources that reported it before. A source's record in `items`
+    replaces its earlier one.
+    """
+    groups = {}
+    passthrough = []
+    for item in items:
+        if isinstance(item, IOCRecord):
+            groups.setdefault(item.observable_dict()["id"], {})[item.source] = item
+        else:
+            passthrough.append(item)
+    if active_records is not None and groups:
+        for observable_id, records in active_records(list(groups)).items():
+            group = groups[observable_id]
+            for record in records:
+                group.setdefault(record.source, record)
+    return [merge_records(group.values()) for group in groups.values()] + passthrough
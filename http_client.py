@@ -0,0 +1,367 @@
+# http_client.py
+# Shared HTTP client layer for the CTI fetchers: per-source quota-aware rate limiting,
+# Retry-After handling, bounded exponential backoff with jitter, a circuit breaker
+# and conditional requests (ETag / Last-Modified)
+
+import requests
+from requests.adapters import HTTPAdapter
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+from metrics import HTTP_BYTES_SAVED, HTTP_REQUEST_DURATION, HTTP_RESPONSE_BYTES
+
+REQUEST_TIMEOUT = 30 # Seconds; upper bound for a single API request
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Returned by RateLimitedClient.get_json(..., if_changed=True) when the server answers 304
+NOT_MODIFIED = object()
+
+class TokenBucket:
+    """
+    Token bucket refilled at `requests_per_minute` (0 = unlimited), holding at most `burst`
+    tokens, plus an optional hard cap of `daily_quota` requests per UTC day.
+    Thread-safe; callers sleep outside the lock.
+    """
+
+    def __init__(self, requests_per_minute, daily_quota=None, burst=None):
+        if requests_per_minute < 0:
+            raise ValueError(f"requests_per_minute must be 0 (unlimited) or positive, not {requests_per_minute}")
+        self.rate = requests_per_minute / 60.0 or None
+        self.capacity = float(burst or max(1, requests_per_minute))
+        self.daily_quota = daily_quota
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._day = time.gmtime().tm_yday
+        self._used_today = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        today = time.gmtime().tm_yday
+        if today != self._day:
+            self._day = today
+            self._used_today = 0
+
+    def acquire(self, deadline=None):
+        """
+        Blocks until a request may be sent. Returns False without consuming a token if the
+        daily quota is exhausted or the wait would run past `deadline` (a time.monotonic() value).
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.daily_quota is not None and self._used_today >= self.daily_quota:
+                    return False
+                wait_seconds = max(self._blocked_until - now, 0.0)
+                if wait_seconds == 0.0:
+                    if self.rate is None or self._tokens >= 1:
+                        if self.rate is not None:
+                            self._tokens -= 1
+                        self._used_today += 1
+                        return True
+                    wait_seconds = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait_seconds >= deadline:
+                return False
+            time.sleep(wait_seconds)
+
+    def block_for(self, seconds):
+        """Pauses all callers for `seconds`, e.g. when the server sends Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def exhaust_daily_quota(self):
+        """Marks today's quota as spent, e.g. when the server reports zero remaining requests."""
+        with self._lock:
+            if self.daily_quota is not None:
+                self._used_today = self.daily_quota
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects requests for
+    `reset_timeout` seconds, then lets a single trial request through (half-open).
+    A trial that ends without an outcome (e.g. the quota ran out before it was sent) is
+    handed back with release_trial(), so the next request can make it instead.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def release_trial(self):
+        """Gives up the calling thread's trial request, if it holds one that has no outcome yet."""
+        with self._lock:
+            if self._trial_in_flight and self._trial_thread == threading.get_ident():
+                self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+# Limiters and breakers are shared per source for the life of the process, so quota usage
+# carries over between collection cycles and between fetcher instances.
+_source_limits = {}
+_source_limits_lock = threading.Lock()
+
+def get_source_limits(source_name, requests_per_minute, daily_quota=None, failure_threshold=5, reset_timeout=300):
+    """Returns the process-wide (TokenBucket, CircuitBreaker) pair for a source."""
+    with _source_limits_lock:
+        if source_name not in _source_limits:
+            _source_limits[source_name] = (
+                TokenBucket(requests_per_minute, daily_quota),
+                CircuitBreaker(failure_threshold, reset_timeout)
+            )
+        return _source_limits[source_name]
+
+def _request_key(source_name, endpoint, params):
+    """Identifies a request for the validator cache: source, endpoint and sorted parameters."""
+    query = urlencode(sorted((str(key), str(value)) for key, value in (params or {}).items()))
+    return f"{source_name}|{endpoint}?{query}"
+
+def _wire_bytes(response):
+    """Bytes the response body took on the wire (before gzip decoding, where the raw stream tells us)."""
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, TypeError, ValueError):
+        return len(response.content)
+
+def _parse_retry_after(value):
+    """Parses a Retry-After header given as delta-seconds or an HTTP-date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class RateLimitedClient:
+    """
+    GETs JSON from a CTI API through the source's shared rate limiter and circuit breaker.
+    Retries 429/5xx and connection errors up to `max_retries` times, waiting for the
+    server's Retry-After when given and for bounded exponential backoff with full jitter otherwise.
+
+    With a `validator_cache` (a ValidatorCache), requests carry If-None-Match / If-Modified-Since
+    from the last full response to the same endpoint and parameters, and a 304 answer costs no
+    download or parsing. The session keeps up to `pool_size` connections, one per concurrent caller.
+    """
+
+    def __init__(self, source_name, base_url, headers, requests_per_minute, daily_quota=None,
+                 max_retries=4, backoff_base=1.0, backoff_max=60.0, validator_cache=None, pool_size=1):
+        self.source_name = source_name
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.validator_cache = validator_cache
+        self.rate_limiter, self.circuit_breaker = get_source_limits(source_name, requests_per_minute, daily_quota)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        # A pool smaller than the number of worker threads makes urllib3 discard and reopen connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = {"not_modified": 0, "bytes_received": 0, "bytes_saved": 0}
+        self._stats_lock = threading.Lock()
+        self._pending_validators = {}
+        self._encoding_logged = False
+        self._local = threading.local()
+
+    @property
+    def last_request_sent(self):
+        """True if the calling thread's last get_json() call sent at least one request."""
+        return getattr(self._local, "sent", False)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _apply_rate_limit_headers(self, response):
+        """Syncs the local limiter with the server's view of the quota."""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.strip() == '0':
+            reset_at = response.headers.get('X-RateLimit-Reset')
+            try:
+                self.rate_limiter.block_for(max(float(reset_at) - time.time(), 0.0))
+            except (TypeError, ValueError):
+                self.rate_limiter.exhaust_daily_quota()
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _conditional_headers(self, request_key, if_changed):
+        """Returns (validators, headers) for a request; validators are None if none can be used."""
+        if self.validator_cache is None:
+            return None, None
+        validators = self.validator_cache.get(request_key)
+        # Without a stored body a 304 could not be answered, unless the caller handles NOT_MODIFIED itself
+        if validators is None or (validators[3] is None and not if_changed):
+            return None, None
+        etag, last_modified = validators[0], validators[1]
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return (validators if headers else None), (headers or None)
+
+    def _record_response(self, request_key, response, if_changed):
+        """Accounts a full response and stores its validators, if it has any."""
+        wire_bytes = _wire_bytes(response)
+        encoding = response.headers.get("Content-Encoding", "identity")
+        HTTP_RESPONSE_BYTES.inc(wire_bytes, source=self.source_name, encoding=encoding)
+        self._count(bytes_received=wire_bytes)
+        if not self._encoding_logged:
+            self._encoding_logged = True
+            if encoding == "identity":
+                logging.info(f"{self.source_name} responses are not compressed.")
+            else:
+                logging.info(f"{self.source_name} responses are {encoding}-compressed ({wire_bytes} bytes on the wire for {len(response.content)}).")
+        if self.validator_cache is None or request_key is None:
+            return
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        if if_changed:
+            # Only remembered once the caller has processed the data; see commit_validators()
+            with self._stats_lock:
+                self._pending_validators[request_key] = (etag, last_modified, wire_bytes)
+        else:
+            self.validator_cache.put(request_key, etag, last_modified, wire_bytes, response.content)
+
+    def commit_validators(self):
+        """
+        Persists the validators of responses fetched with if_changed=True. Callers invoke this
+        once they have fully processed those responses, so a later 304 (and the skipped work)
+        can never hide data that was fetched but not handled.
+        """
+        with self._stats_lock:
+            pending, self._pending_validators = self._pending_validators, {}
+        for request_key, (etag, last_modified, wire_bytes) in pending.items():
+            self.validator_cache.put(request_key, etag, last_modified, wire_bytes)
+
+    def discard_validators(self):
+        """Drops validators fetched with if_changed=True that were not committed."""
+        with self._stats_lock:
+            self._pending_validators = {}
+
+    def get_json(self, endpoint, params=None, deadline=None, missing_ok=False, if_changed=False, conditional=True):
+        """
+        Returns the decoded JSON body, or None if the request failed, the circuit is open,
+        the quota is exhausted, or `deadline` (a time.monotonic() value) would be exceeded.
+        With `missing_ok=True` a 404 returns {} instead, so callers can tell "not found" from a failure.
+        If the server answers 304 Not Modified, the body stored with the validators is returned,
+        or, with `if_changed=True`, NOT_MODIFIED so the caller can skip the work altogether.
+        `conditional=False` neither sends nor stores validators, for responses not worth keeping.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        request_key = _request_key(self.source_name, endpoint, params) if conditional else None
+        validators, conditional_headers = self._conditional_headers(request_key, if_changed) if conditional else (None, None)
+        self._local.sent = False
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                logging.warning(f"{self.source_name} circuit breaker is open. Skipping request to {endpoint}.")
+                return None
+            # An early return or unexpected error must not leave a half-open breaker waiting
+            # forever for the outcome of a trial request that was never sent
+            try:
+                if not self.rate_limiter.acquire(deadline):
+                    logging.warning(f"{self.source_name} quota or deadline reached. Skipping request to {endpoint}.")
+                    return None
+
+                timeout = REQUEST_TIMEOUT
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        logging.warning(f"Deadline reached before request to {endpoint}. Skipping.")
+                        return None
+
+                retry_after = None
+                request_started = time.perf_counter()
+                self._local.sent = True
+                try:
+                    response = self.session.get(url, params=params, timeout=timeout, headers=conditional_headers)
+                    HTTP_REQUEST_DURATION.observe(time.perf_counter() - request_started, source=self.source_name, status=response.status_code)
+                    self._apply_rate_limit_headers(response)
+                    if missing_ok and response.status_code == 404:
+                        self.circuit_breaker.record_success()
+                        return {}
+                    if response.status_code == 304 and validators is not None:
+                        self.circuit_breaker.record_success()
+                        HTTP_BYTES_SAVED.inc(validators[2], source=self.source_name)
+                        self._count(not_modified=1, bytes_saved=validators[2])
+                        logging.debug("%s: %s not modified, %s bytes saved", self.source_name, endpoint, validators[2]) # Per-request: DEBUG with lazy formatting
+                        return NOT_MODIFIED if if_changed else json.loads(validators[3])
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                        self.circuit_breaker.record_success()
+                        try:
+                            data = response.json()
+                        except ValueError as e:
+                            # The server answered; retrying would only fetch the same bad body again
+                            logging.error(f"{self.source_name} returned a malformed JSON body for {endpoint}: {e}")
+                            return None
+                        self._record_response(request_key, response, if_changed)
+                        return data
+                    logging.warning(f"{self.source_name} returned {response.status_code} for {endpoint} (attempt {attempt + 1}).")
+                    retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status_code == 429 and retry_after is not None:
+                        self.rate_limiter.block_for(retry_after)
+                except requests.exceptions.HTTPError as e:
+                    # Non-retryable client errors mean the request was bad, not that the service is down
+                    logging.error(f"HTTP error for {endpoint}: {e.response.status_code} - {e.response.text}")
+                    self.circuit_breaker.record_success()
+                    return None
+                except requests.exceptions.RequestException as e:
+                    HTTP_REQUEST_DURATION.observe(time.perf_counter() - request_started, source=self.source_name, status="error")
+                    logging.warning(f"Request error for {endpoint} (attempt {attempt + 1}): {e}")
+
+                self.circuit_breaker.record_failure()
+            finally:
+                self.circuit_breaker.release_trial()
+            if attempt == self.max_retries:
+                break
+            wait_seconds = retry_after if retry_after is not None else self._backoff(attempt)
+            if deadline is not None and time.monotonic() + wait_seconds >= deadline:
+                logging.warning(f"{self.source_name} deadline too close to retry {endpoint}. Giving up on request.")
+                return None
+            time.sleep(wait_seconds)
+
+        logging.error(f"{self.source_name} request to {endpoint} failed after {self.max_retries + 1} attempts.")
+        return None
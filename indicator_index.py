@@ -0,0 +1,400 @@
+# indicator_index.py
+# Live in-memory index of every converted indicator (CIDR trie for IPs, reversed-label suffix trie
+# for domains, hash maps for URLs and file hashes) and a small local HTTP / Unix-socket lookup API
+
+import ipaddress
+import json
+import logging
+import os
+import re
+import socketserver
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from correlation import normalize_value
+from stix_ids import value_indicator_id
+
+HEX_HASH = re.compile(r"^(?:[0-9a-fA-F]{32}|[0-9a-fA-F]{40}|[0-9a-fA-F]{64})$")
+MAX_BATCH_SIZE = 10000 # Values per lookup request
+
+def record_score(record):
+    """0-100 maliciousness score for a record: AbuseIPDB confidence, else VirusTotal's malicious share."""
+    properties = record.custom_properties or {}
+    score = properties.get("x_abuseipdb_abuse_confidence_score")
+    if score is not None:
+        return score
+    malicious = properties.get("x_virustotal_malicious")
+    if malicious is None:
+        return None
+    total = malicious + sum(properties.get(f"x_virustotal_{name}") or 0 for name in ("suspicious", "harmless", "undetected"))
+    return round(100 * malicious / total) if total else 0
+
+def _entry(record, indexed_value):
+    # Kept as a tuple (one per value and source) to keep the index compact; rendered on match
+    return (indexed_value, record.stix_type, record.source, record_score(record), record.valid_from, record.ioc_type, record.value)
+
+@lru_cache(maxsize=65536)
+def _indicator_id(stix_type, value):
+    # Published Indicators are correlated across sources, one per value
+    return value_indicator_id(stix_type, value)
+
+def _render(entry, match):
+    indexed_value, stix_type, source, score, valid_from, ioc_type, value = entry
+    return {
+        "value": indexed_value,
+        "type": stix_type,
+        "source": source,
+        "score": score,
+        "valid_from": valid_from,
+        "indicator_id": _indicator_id(stix_type, value),
+        "match": match
+    }
+
+def normalize_domain(value):
+    return value.strip().lower().rstrip(".")
+
+class CIDRTrie:
+    """
+    Binary radix trie of IP networks for one address family. Each node is
+    [zero_child, one_child, entries]; lookups return the entries of every network that
+    contains the address, most specific first. Single addresses belong in a hash map instead.
+    """
+
+    def __init__(self, max_prefix_len):
+        self.max_prefix_len = max_prefix_len
+        self._root = [None, None, None]
+
+    def insert(self, network, key, entry):
+        """Stores `entry` under `key` at `network`. Returns True if the network was not indexed yet."""
+        address = int(network.network_address)
+        node = self._root
+        for depth in range(network.prefixlen):
+            bit = (address >> (self.max_prefix_len - 1 - depth)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        is_new = node[2] is None
+        if is_new:
+            node[2] = {}
+        node[2][key] = entry
+        return is_new
+
+    def remove(self, network, key):
+        """Drops the entry under `key` at `network`. Returns True if the network is no longer indexed."""
+        address = int(network.network_address)
+        path = [self._root]
+        for depth in range(network.prefixlen):
+            node = path[-1][(address >> (self.max_prefix_len - 1 - depth)) & 1]
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if not node[2] or key not in node[2]:
+            return False
+        del node[2][key]
+        if node[2]:
+            return False
+        node[2] = None
+        # Prune the branch back up to the first node still in use
+        for depth in range(network.prefixlen, 0, -1):
+            node = path[depth]
+            if node[0] is not None or node[1] is not None or node[2]:
+                break
+            path[depth - 1][(address >> (self.max_prefix_len - depth)) & 1] = None
+        return True
+
+    def lookup(self, address):
+        address = int(address)
+        node = self._root
+        matches = []
+        for depth in range(self.max_prefix_len):
+            if node[2]:
+                matches.append(node[2])
+            node = node[(address >> (self.max_prefix_len - 1 - depth)) & 1]
+            if node is None:
+                break
+        else:
+            if node[2]:
+                matches.append(node[2])
+        return [entry for entries in reversed(matches) for entry in entries.values()]
+
+class DomainSuffixTrie:
+    """
+    Trie over reversed domain labels (com -> example -> www), so a lookup of
+    'a.b.example.com' also finds entries for 'b.example.com' and 'example.com'.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, domain, key, entry):
+        """Stores `entry` under `key` at `domain`. Returns True if the domain was not indexed yet."""
+        node = self._root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        is_new = None not in node
+        node.setdefault(None, {})[key] = entry # The None key holds the entries stored at this name
+        return is_new
+
+    def remove(self, domain, key):
+        """Drops the entry under `key` at `domain`. Returns True if the domain is no longer indexed."""
+        path = [(None, self._root)]
+        for label in reversed(domain.split(".")):
+            node = path[-1][1].get(label)
+            if node is None:
+                return False
+            path.append((label, node))
+        entries = path[-1][1].get(None)
+        if not entries or key not in entries:
+            return False
+        del entries[key]
+        if entries:
+            return False
+        del path[-1][1][None]
+        for depth in range(len(path) - 1, 0, -1):
+            label, node = path[depth]
+            if node:
+                break
+            del path[depth - 1][1][label]
+        return True
+
+    def lookup(self, domain):
+        """Returns [(entry, is_exact)] for the domain and every indexed parent, most specific first."""
+        node = self._root
+        labels = domain.split(".")
+        matches = []
+        for depth, label in enumerate(reversed(labels)):
+            node = node.get(label)
+            if node is None:
+                break
+            if None in node:
+                matches.append((node[None], depth == len(labels) - 1))
+        return [(entry, is_exact) for entries, is_exact in reversed(matches) for entry in entries.values()]
+
+class IndicatorIndex:
+    """
+    Thread-safe in-memory index of IOC records, updated incrementally with add_records()
+    as fetchers produce data. Entries are keyed by (value, source), so a newer record from
+    the same source replaces the older one and each source's attribution and score is kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._addresses = {} # Single IPs: ip_address -> {source: entry}
+        self._networks = {4: CIDRTrie(32), 6: CIDRTrie(128)}
+        self._domains = DomainSuffixTrie()
+        self._urls = {}
+        self._hashes = {}
+        self.counts = {"ip": 0, "network": 0, "domain": 0, "url": 0, "file": 0}
+
+    def _add(self, record):
+        stix_type = record.stix_type
+        if stix_type in ("ipv4-addr", "ipv6-addr"):
+            value = record.value.strip()
+            try:
+                if "/" not in value:
+                    address = ipaddress.ip_address(value)
+                    # Dotted IPv4 input is already canonical; IPv6 is re-rendered in compressed form
+                    self._put(self._addresses, address, record, value if address.version == 4 else str(address), "ip")
+                    return True
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                return False
+            if network.num_addresses == 1:
+                self._put(self._addresses, network.network_address, record, str(network.network_address), "ip")
+            else:
+                if self._networks[network.version].insert(network, record.source, _entry(record, str(network))):
+                    self.counts["network"] += 1
+        elif stix_type == "domain-name":
+            domain = normalize_domain(record.value)
+            if self._domains.insert(domain, record.source, _entry(record, domain)):
+                self.counts["domain"] += 1
+        elif stix_type == "url":
+            self._put(self._urls, record.value.strip(), record, record.value.strip(), "url")
+        elif stix_type == "file":
+            self._put(self._hashes, record.value.strip().lower(), record, record.value.strip().lower(), "file")
+        else:
+            return False
+        return True
+
+    def _remove(self, record):
+        stix_type = record.stix_type
+        if stix_type in ("ipv4-addr", "ipv6-addr"):
+            value = record.value.strip()
+            try:
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                return False
+            if network.num_addresses == 1:
+                return self._discard(self._addresses, network.network_address, record, "ip")
+            if self._networks[network.version].remove(network, record.source):
+                self.counts["network"] -= 1
+            return True
+        if stix_type == "domain-name":
+            if self._domains.remove(normalize_domain(record.value), record.source):
+                self.counts["domain"] -= 1
+            return True
+        if stix_type == "url":
+            return self._discard(self._urls, record.value.strip(), record, "url")
+        if stix_type == "file":
+            return self._discard(self._hashes, record.value.strip().lower(), record, "file")
+        return False
+
+    def _discard(self, table, key, record, kind):
+        entries = table.get(key)
+        if entries is None or entries.pop(record.source, None) is None:
+            return False
+        if not entries:
+            del table[key]
+            self.counts[kind] -= 1
+        return True
+
+    def _put(self, table, key, record, indexed_value, kind):
+        entries = table.get(key)
+        if entries is None:
+            entries = table[key] = {}
+            self.counts[kind] += 1
+        entries[record.source] = _entry(record, indexed_value)
+
+    def add_records(self, records):
+        """Indexes IOCRecords (other items are ignored). Returns the number indexed."""
+        added = 0
+        with self._lock:
+            for record in records:
+                if hasattr(record, "stix_type") and self._add(record):
+                    added += 1
+        return added
+
+    def remove_records(self, records):
+        """Drops the entries of IOCRecords, e.g. once they expired. Returns the number removed."""
+        removed = 0
+        with self._lock:
+            for record in records:
+                if hasattr(record, "stix_type") and self._remove(record):
+                    removed += 1
+        return removed
+
+    def _match_ip(self, address):
+        exact = self._addresses.get(address)
+        matches = [_render(entry, "exact") for entry in exact.values()] if exact else []
+        matches.extend(_render(entry, "cidr") for entry in self._networks[address.version].lookup(address))
+        return matches
+
+    def _match_domain(self, domain, match_type=None):
+        return [_render(entry, match_type or ("exact" if is_exact else "parent"))
+                for entry, is_exact in self._domains.lookup(domain)]
+
+    def lookup(self, value):
+        """
+        Returns every indexed entry matching `value`, which may be an IP, domain, URL or
+        file hash. IPs also match containing networks, domains match indexed parent
+        domains, and URLs also match entries for their host. URLs are normalized like the
+        indexed records, so e.g. an explicit default port or a fragment still matches.
+        """
+        value = value.strip()
+        if not value:
+            return []
+        with self._lock:
+            try:
+                return self._match_ip(ipaddress.ip_address(value))
+            except ValueError:
+                pass
+            if "://" in value:
+                matches = [_render(entry, "exact") for entry in self._urls.get(normalize_value("url", value), {}).values()]
+                host = urlsplit(value).hostname
+                if host:
+                    try:
+                        matches.extend(dict(entry, match="host") for entry in self._match_ip(ipaddress.ip_address(host)))
+                    except ValueError:
+                        matches.extend(self._match_domain(normalize_domain(host), "host"))
+                return matches
+            if HEX_HASH.match(value):
+                return [_render(entry, "exact") for entry in self._hashes.get(value.lower(), {}).values()]
+            return self._match_domain(normalize_domain(value))
+
+    def lookup_many(self, values):
+        """Batch lookup. Returns {value: [entries]} with an entry list for every value."""
+        return {value: self.lookup(value) for value in values}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+class _IndexHandler(BaseHTTPRequestHandler):
+    """
+    GET  /lookup?value=1.2.3.4&value=evil.example  -> {"results": {value: [entries]}}
+    POST /lookup  {"values": [...]}                -> same, for larger batches
+    GET  /stats                                    -> indexed value counts
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _lookup(self, values):
+        if len(values) > MAX_BATCH_SIZE:
+            self._send_json(413, {"error": f"at most {MAX_BATCH_SIZE} values per request"})
+            return
+        self._send_json(200, {"results": self.server.index.lookup_many(values)})
+
+    def do_GET(self):
+        parsed = urlsplit(self.path)
+        if parsed.path == "/lookup":
+            self._lookup(parse_qs(parsed.query).get("value", []))
+        elif parsed.path == "/stats":
+            self._send_json(200, self.server.index.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path != "/lookup":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            values = json.loads(body or b"{}").get("values", [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError("'values' must be a list of strings")
+        except (ValueError, AttributeError) as e:
+            self._send_json(400, {"error": f"invalid request body: {e}"})
+            return
+        self._lookup(values)
+
+class _TCPIndexHandler(_IndexHandler):
+    # Headers and body are separate writes; without this, keep-alive clients stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+class _UnixIndexServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0) # BaseHTTPRequestHandler expects a (host, port) client address
+
+def start_index_server(index, port=0, host="127.0.0.1", unix_socket=None):
+    """
+    Serves the lookup API for `index` on a daemon thread, over TCP on `host`:`port`
+    or, if `unix_socket` is given, on that Unix domain socket path. Returns the server.
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixIndexServer(unix_socket, _IndexHandler)
+        where = f"unix:{unix_socket}"
+    else:
+        server = ThreadingHTTPServer((host, port), _TCPIndexHandler)
+        server.daemon_threads = True
+        where = f"http://{host}:{server.server_address[1]}"
+    server.index = index
+    threading.Thread(target=server.serve_forever, name="index-api", daemon=True).start()
+    logging.info(f"Serving indicator lookups on {where}/lookup")
+    return server
@@ -0,0 +1,194 @@
+# ioc_record.py
+# Lightweight IOC record shared by all fetchers, with a single table-driven type -> STIX mapping.
+# STIX JSON is emitted directly from records at publish time; stix2 validation is opt-in.
+
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from stix_ids import observable_id, indicator_id, value_indicator_id
+
+# Well-known id of the STIX 2.1 TLP:WHITE marking definition
+TLP_WHITE_ID = "marking-definition--613f2e26-407d-48c7-9eca-b8e91df99dc9"
+
+# Source-native IOC type -> (STIX observable type, hash algorithm for file hashes)
+IOC_TYPE_MAP = {
+    # AlienVault OTX
+    "IPv4": ("ipv4-addr", None),
+    "IPv6": ("ipv6-addr", None),
+    "domain": ("domain-name", None),
+    "hostname": ("domain-name", None), # Treat hostname as domain for simplicity
+    "URL": ("url", None),
+    "FileHash-MD5": ("file", "MD5"),
+    "FileHash-SHA1": ("file", "SHA-1"),
+    "FileHash-SHA256": ("file", "SHA-256"),
+    # VirusTotal / generic
+    "ipv4-addr": ("ipv4-addr", None),
+    "ipv6-addr": ("ipv6-addr", None),
+    "domain-name": ("domain-name", None),
+    "url": ("url", None),
+    "file-hash": ("file", "MD5"),
+}
+
+def now_timestamp():
+    """Current UTC time as a STIX timestamp."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+@lru_cache(maxsize=4096)
+def normalize_timestamp(value):
+    """
+    Converts an API timestamp (e.g. '2024-01-01T00:00:00+00:00' or '2024-01-01T12:00:00.123000')
+    into a STIX UTC timestamp. Values without an offset are taken as UTC. Returns None if unparseable.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    if parsed.microsecond:
+        return parsed.strftime('%Y-%m-%dT%H:%M:%S.') + f"{parsed.microsecond // 1000:03d}Z"
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _escape_pattern_value(value):
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+def _pattern(stix_type, hash_algorithm, value):
+    if hash_algorithm:
+        return f"[file:hashes.'{hash_algorithm}' = '{_escape_pattern_value(value)}']"
+    return f"[{stix_type}:value = '{_escape_pattern_value(value)}']"
+
+class IOCRecord:
+    """
+    One indicator of compromise as reported by a source. Holds only the fields needed to
+    emit its STIX Observable and Indicator; building those dicts is deferred to publish time.
+    Records merged across sources (see correlation.py) list them in `sources`; their
+    Indicator id then depends on the value only.
+    """
+    __slots__ = (
+        "source", "ioc_type", "value", "stix_type", "hash_algorithm",
+        "description", "valid_from", "created", "extra_pattern", "custom_properties", "sources"
+    )
+
+    def __init__(self, source, ioc_type, value, stix_type, hash_algorithm, description,
+                 valid_from=None, created=None, extra_pattern=None, custom_properties=None, sources=None):
+        self.source = source
+        self.ioc_type = ioc_type
+        self.value = value
+        self.stix_type = stix_type
+        self.hash_algorithm = hash_algorithm
+        self.description = description
+        self.created = created or now_timestamp()
+        self.valid_from = normalize_timestamp(valid_from) or self.created
+        self.extra_pattern = extra_pattern
+        self.custom_properties = custom_properties
+        self.sources = sources
+
+    @classmethod
+    def from_source_type(cls, source, ioc_type, value, description, **kwargs):
+        """Builds a record from a source-native IOC type. Returns None for unsupported types."""
+        mapping = IOC_TYPE_MAP.get(ioc_type)
+        if mapping is None:
+            logging.warning(f"Unsupported {source} IOC type: {ioc_type} for value: {value}")
+            return None
+        return cls(source, ioc_type, value, mapping[0], mapping[1], description, **kwargs)
+
+    @property
+    def pattern(self):
+        pattern = _pattern(self.stix_type, self.hash_algorithm, self.value)
+        if self.extra_pattern:
+            pattern = f"{pattern} AND {self.extra_pattern}"
+        return pattern
+
+    def observable_dict(self):
+        if self.hash_algorithm:
+            hashes = {self.hash_algorithm: self.value}
+            return {
+                "type": "file",
+                "spec_version": "2.1",
+                "id": observable_id("file", self.value, hashes),
+                "hashes": hashes
+            }
+        return {
+            "type": self.stix_type,
+            "spec_version": "2.1",
+            "id": observable_id(self.stix_type, self.value),
+            "value": self.value
+        }
+
+    @property
+    def indicator_id(self):
+        if self.sources:
+            return value_indicator_id(self.stix_type, self.value)
+        return indicator_id(self.source, self.ioc_type, self.value)
+
+    def indicator_dict(self):
+        indicator = {
+            "type": "indicator",
+            "spec_version": "2.1",
+            "id": self.indicator_id,
+            "created": self.created,
+            "modified": self.created,
+            "description": self.description,
+            "pattern": self.pattern,
+            "pattern_type": "stix",
+            "pattern_version": "2.1",
+            "valid_from": self.valid_from,
+            "object_marking_refs": [TLP_WHITE_ID]
+        }
+        if self.sources:
+            indicator["x_cti_sources"] = self.sources
+        if self.custom_properties:
+            indicator.update((key, value) for key, value in self.custom_properties.items() if value is not None)
+        return indicator
+
+    def to_stix_dicts(self):
+        """Returns [observable, indicator] as plain STIX 2.1 dicts."""
+        return [self.observable_dict(), self.indicator_dict()]
+
+    def to_dict(self):
+        """Plain-dict form of the record (unset fields omitted), e.g. for spooling to disk."""
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = dict.fromkeys(cls.__slots__)
+        fields.update(data)
+        return cls(**fields)
+
+def item_to_json_line(item):
+    """One spool line: IOCRecords as their field dict, already-built STIX objects wrapped under 'stix'."""
+    if isinstance(item, IOCRecord):
+        data = item.to_dict()
+    else:
+        data = {"stix": item if isinstance(item, dict) else json.loads(item.serialize())}
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+def item_from_json_line(line):
+    """Inverse of item_to_json_line(): returns an IOCRecord or a STIX dict."""
+    data = json.loads(line)
+    if "stix" in data:
+        return data["stix"]
+    return IOCRecord.from_dict(data)
+
+def iter_stix_dicts(items, validate=False):
+    """
+    Flattens a stream of IOCRecords (and already-built STIX objects, passed through as-is)
+    into STIX objects. With `validate=True` every emitted dict is round-tripped through
+    stix2.parse for full validation and invalid ones are dropped.
+    """
+    if validate:
+        import stix2 # Only needed for opt-in validation
+    for item in items:
+        stix_objects = item.to_stix_dicts() if isinstance(item, IOCRecord) else [item]
+        for stix_object in stix_objects:
+            if validate and isinstance(stix_object, dict):
+                try:
+                    stix2.parse(stix_object, allow_custom=True)
+                except Exception as e:
+                    logging.error(f"Dropping invalid STIX object {stix_object.get('id')}: {e}")
+                    continue
+            yield stix_object
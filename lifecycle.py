@@ -0,0 +1,367 @@
+# lifecycle.py
+# Indicator lifecycle: TTLs per source and type, a min-heap of expiry times advanced each sweep,
+# valid_until updates for indicators that aged out and compaction of the state they leave behind
+
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from correlation import merge_records
+from ioc_record import IOCRecord, item_from_json_line, item_to_json_line
+from metrics import ACTIVE_INDICATORS, STAGE_ITEMS
+from stix_ids import value_indicator_id
+
+DAY = 86400
+
+# (source, STIX observable type) -> days an Indicator stays valid after its valid_from
+# (the source's last report of it). None matches any source or type; the most specific entry wins.
+DEFAULT_TTL_DAYS = {
+    (None, None): 90,
+    (None, "ipv4-addr"): 14, # Addresses are reassigned quickly
+    (None, "ipv6-addr"): 14,
+    ("AbuseIPDB", "ipv4-addr"): 30, # AbuseIPDB's own window is 90 days of reports
+    ("AbuseIPDB", "ipv6-addr"): 30,
+    (None, "url"): 60,
+    (None, "domain-name"): 90,
+    (None, "file"): 365 # A hash never stops identifying the same file
+}
+
+# Custom properties added by enrichment rather than reported by the source
+ENRICHMENT_PREFIXES = ("x_virustotal_",)
+# SQL filter for stored records that carry any of them
+ENRICHED_CONDITION = " AND (" + " OR ".join(f"instr(record, '\"{prefix}') > 0" for prefix in ENRICHMENT_PREFIXES) + ")"
+
+def _enrichment_properties(record):
+    return {name: value for name, value in (record.custom_properties or {}).items() if name.startswith(ENRICHMENT_PREFIXES)}
+
+def _timestamp_seconds(timestamp):
+    """Unix time of a STIX timestamp as produced by normalize_timestamp()."""
+    return datetime.fromisoformat(timestamp[:-1] + "+00:00").timestamp()
+
+def _report_key(object_id, source):
+    """In-memory key of one source's report: a single string costs less than a tuple of two."""
+    return f"{object_id}|{source}"
+
+def _format_timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+class TTLPolicy:
+    """Maps a record's source and STIX observable type to how long its Indicator stays valid."""
+
+    def __init__(self, ttl_days=None):
+        self.ttl_days = dict(DEFAULT_TTL_DAYS)
+        self.ttl_days.update(ttl_days or {})
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Builds a policy from overrides such as 'AbuseIPDB:ipv4-addr=30,*:file=730' (days;
+        '*' matches any source or type), applied on top of DEFAULT_TTL_DAYS.
+        """
+        overrides = {}
+        for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+            try:
+                key, days = entry.split("=")
+                source, stix_type = key.split(":")
+                overrides[(None if source.strip() == "*" else source.strip(),
+                           None if stix_type.strip() == "*" else stix_type.strip())] = float(days)
+            except ValueError:
+                raise ValueError(f"Invalid TTL override {entry!r}; expected 'source:type=days'")
+        return cls(overrides)
+
+    def ttl_seconds(self, source, stix_type):
+        for key in ((source, stix_type), (None, stix_type), (source, None), (None, None)):
+            if key in self.ttl_days:
+                return self.ttl_days[key] * DAY
+
+def expiry_update(record, expires_at, revoke=False):
+    """
+    The Indicator of an expired (usually merged) record re-issued with valid_until set to
+    its expiry (and revoked, if `revoke`). It keeps the Indicator's id, so consumers update it in place.
+    """
+    indicator = record.indicator_dict()
+    valid_from = _timestamp_seconds(indicator["valid_from"])
+    # STIX requires valid_until to be later than valid_from
+    indicator["valid_until"] = _format_timestamp(max(expires_at, valid_from + 1))
+    indicator["modified"] = max(_format_timestamp(time.time()), indicator["created"])
+    if revoke:
+        indicator["revoked"] = True
+    return indicator
+
+class IndicatorLifecycle:
+    """
+    Tracks every Indicator the collector publishes and expires each source's report of it
+    once its TTL has passed since that source last reported it.
+
+    Reports are persisted in SQLite, keyed by the (indicator_id, source) they come from;
+    indicator_id is the value_indicator_id the merged Indicator is published under. In memory
+    only {'indicator_id|source': expires_at} and a min-heap of (expires_at, 'indicator_id|source')
+    are kept for the active ones, one heap entry each. A refresh only moves the expiry in the
+    dict. A popped entry whose expiry has moved on is pushed back, so advancing the heap only
+    touches reports that came due. A count of active reports per Observable lets
+    active_records() skip the database for values no other source reports.
+
+    Expired rows are kept for `compaction_grace` seconds, long enough for their updates to be
+    published. compact() then drops them, and the fingerprints in `seen_store` of Indicators
+    and Observables no remaining row refers to.
+    """
+
+    def __init__(self, db_path, policy=None, revoke=False, seen_store=None, compaction_grace=DAY):
+        self.db_path = db_path
+        self.policy = policy or TTLPolicy()
+        self.revoke = revoke
+        self.seen_store = seen_store
+        self.compaction_grace = compaction_grace
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(lifecycle)")]
+        upgrade = bool(columns) and "source" not in columns
+        if upgrade:
+            # Rows from before they were keyed by (value_indicator_id, source) are re-keyed below
+            self._conn.execute("DROP INDEX IF EXISTS lifecycle_observable")
+            self._conn.execute("DROP INDEX IF EXISTS lifecycle_expired_at")
+            self._conn.execute("ALTER TABLE lifecycle RENAME TO lifecycle_per_source_ids")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lifecycle ("
+            " indicator_id TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " observable_id TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " expired_at REAL,"
+            " PRIMARY KEY (indicator_id, source))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lifecycle_observable ON lifecycle (observable_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lifecycle_expired_at ON lifecycle (expired_at)")
+        if upgrade:
+            self._upgrade_per_source_ids()
+        self._conn.commit()
+        self._expiry = {_report_key(object_id, source): expires_at for object_id, source, expires_at in self._conn.execute(
+            "SELECT indicator_id, source, expires_at FROM lifecycle WHERE expired_at IS NULL"
+        )}
+        self._heap = [(expires_at, key) for key, expires_at in self._expiry.items()]
+        heapq.heapify(self._heap)
+        self._active_per_observable = dict(self._conn.execute(
+            "SELECT observable_id, COUNT(*) FROM lifecycle WHERE expired_at IS NULL GROUP BY observable_id"
+        ))
+        ACTIVE_INDICATORS.set(len(self._expiry))
+
+    def _upgrade_per_source_ids(self):
+        """Copies the rows of a table keyed by per-source Indicator ids into the current one."""
+        rows = self._conn.execute("SELECT observable_id, record, expires_at, expired_at FROM lifecycle_per_source_ids").fetchall()
+        upgraded = []
+        for observable_id, line, expires_at, expired_at in rows:
+            record = item_from_json_line(line)
+            upgraded.append((value_indicator_id(record.stix_type, record.value), record.source, observable_id, line, expires_at, expired_at))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO lifecycle (indicator_id, source, observable_id, record, expires_at, expired_at) VALUES (?, ?, ?, ?, ?, ?)",
+            upgraded
+        )
+        self._conn.execute("DROP TABLE lifecycle_per_source_ids")
+        logging.info(f"Re-keyed {len(upgraded)} lifecycle rows by value Indicator id and source.")
+
+    def _select(self, columns, keys, condition=""):
+        """
+        Returns the `columns` of the rows with the given (indicator_id, source) keys, preceded
+        by those keys. `keys` is a set or dict; `condition` is an optional extra SQL filter.
+        """
+        object_ids = list({object_id for object_id, _ in keys})
+        rows = []
+        # Chunk the IN clause to stay under SQLite's bound-parameter limit
+        for i in range(0, len(object_ids), 500):
+            chunk = object_ids[i:i + 500]
+            rows.extend(row for row in self._conn.execute(
+                f"SELECT indicator_id, source, {columns} FROM lifecycle WHERE indicator_id IN ({','.join('?' * len(chunk))}){condition}", chunk
+            ) if row[:2] in keys)
+        return rows
+
+    def observe(self, records, now=None):
+        """
+        Registers freshly collected IOCRecords, (re)starting the TTL of each source's report
+        from its valid_from. Returns the records that are still active; those already past their
+        TTL (e.g. from a backfill of old pulses) are left out and not tracked.
+        A record that came without enrichment properties (its lookup was skipped for budget
+        or time) is given those of the source's previous report of the value, so the verdict
+        it was published with does not flap away and back.
+        """
+        now = now or time.time()
+        active, reports = [], {}
+        for record in records:
+            if not isinstance(record, IOCRecord):
+                active.append(record)
+                continue
+            expires_at = _timestamp_seconds(record.valid_from) + self.policy.ttl_seconds(record.source, record.stix_type)
+            if expires_at <= now:
+                continue
+            active.append(record)
+            reports[(value_indicator_id(record.stix_type, record.value), record.source)] = (record, expires_at)
+        if len(active) < len(records):
+            logging.info(f"Dropped {len(records) - len(active)} IOC records already past their TTL.")
+
+        with self._lock:
+            unenriched = {key for key, (record, _) in reports.items() if not _enrichment_properties(record)}
+            for object_id, source, previous in self._select("record", unenriched, ENRICHED_CONDITION) if unenriched else ():
+                carried = _enrichment_properties(item_from_json_line(previous))
+                if carried:
+                    record = reports[(object_id, source)][0]
+                    record.custom_properties = {**(record.custom_properties or {}), **carried}
+            rows = {key: (key[0], key[1], record.observable_dict()["id"], item_to_json_line(record).rstrip("\n"), expires_at)
+                    for key, (record, expires_at) in reports.items()}
+            # A report with an older valid_from never shortens a TTL
+            for object_id, source, expires_at in self._select("expires_at", rows):
+                key = (object_id, source)
+                if expires_at > rows[key][4]:
+                    rows[key] = rows[key][:4] + (expires_at,)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lifecycle (indicator_id, source, observable_id, record, expires_at, expired_at) VALUES (?, ?, ?, ?, ?, NULL)",
+                rows.values()
+            )
+            self._conn.commit()
+            for object_id, source, observable_id, _, expires_at in rows.values():
+                key = _report_key(object_id, source)
+                if key not in self._expiry:
+                    heapq.heappush(self._heap, (expires_at, key))
+                    self._active_per_observable[observable_id] = self._active_per_observable.get(observable_id, 0) + 1
+                self._expiry[key] = expires_at
+            ACTIVE_INDICATORS.set(len(self._expiry))
+        return active
+
+    def expire_due(self, now=None):
+        """
+        Advances the heap to `now` and returns [(indicator_id, observable_id, record, expires_at)]
+        for every source's report whose TTL has passed; the record's source completes the key.
+        They stop being active at once; call mark_expired() once their updates are spooled,
+        or they are expired again after a restart.
+        """
+        now = now or time.time()
+        due = set()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                expires_at = self._expiry.get(key)
+                if expires_at is None:
+                    continue
+                if expires_at > now:
+                    heapq.heappush(self._heap, (expires_at, key)) # Refreshed since it was pushed
+                    continue
+                del self._expiry[key]
+                due.add(tuple(key.split("|", 1)))
+            rows = [(object_id, observable_id, record, expires_at) for object_id, _, observable_id, record, expires_at
+                    in self._select("observable_id, record, expires_at", due)]
+            for _, observable_id, _, _ in rows:
+                remaining = self._active_per_observable.pop(observable_id, 1) - 1
+                if remaining:
+                    self._active_per_observable[observable_id] = remaining
+            ACTIVE_INDICATORS.set(len(self._expiry))
+        expired = [(object_id, observable_id, item_from_json_line(record), expires_at)
+                   for object_id, observable_id, record, expires_at in rows]
+        STAGE_ITEMS.inc(len(expired), stage="expire", source="")
+        return expired
+
+    def expiry_updates(self, expired, now=None):
+        """
+        What to publish for the output of expire_due(), per value Indicator: the merged
+        record of the sources still reporting it, now without the expired ones, or, once
+        no source does, its Indicator with valid_until set.
+        """
+        groups = {}
+        for object_id, observable_id, record, expires_at in expired:
+            groups.setdefault((object_id, observable_id), []).append((record, expires_at))
+        expired_keys = {(object_id, record.source) for object_id, _, record, _ in expired}
+        remaining = self.active_records([observable_id for _, observable_id in groups], now, exclude=expired_keys)
+        updates = []
+        for (_, observable_id), group in groups.items():
+            if observable_id in remaining:
+                updates.append(merge_records(remaining[observable_id]))
+            else:
+                updates.append(expiry_update(merge_records([record for record, _ in group]),
+                                             max(expires_at for _, expires_at in group), self.revoke))
+        return updates
+
+    def active_records(self, observable_ids, now=None, exclude=(), min_active=1):
+        """
+        Returns {observable_id: [IOCRecord]} with the active records of every source for the
+        given Observable ids, for correlate(). Reports whose (indicator_id, source) is in
+        `exclude` are left out, and so are Observables with fewer than `min_active` active reports.
+        """
+        now = now or time.time()
+        found = {}
+        with self._lock:
+            observable_ids = [observable_id for observable_id in observable_ids
+                              if self._active_per_observable.get(observable_id, 0) >= min_active]
+            for i in range(0, len(observable_ids), 500):
+                chunk = observable_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT indicator_id, source, observable_id, record FROM lifecycle WHERE observable_id IN ({','.join('?' * len(chunk))})"
+                    " AND expired_at IS NULL AND expires_at > ?", chunk + [now]
+                )
+                for object_id, source, observable_id, record in rows:
+                    if (object_id, source) not in exclude:
+                        found.setdefault(observable_id, []).append(item_from_json_line(record))
+        return found
+
+    def mark_expired(self, expired, now=None):
+        """Persists that the reports returned by expire_due() have expired."""
+        now = now or time.time()
+        with self._lock:
+            # Unless a source reported it again in the meantime
+            self._conn.executemany(
+                "UPDATE lifecycle SET expired_at = ? WHERE indicator_id = ? AND source = ? AND expires_at <= ?",
+                [(now, object_id, record.source, now) for object_id, _, record, _ in expired]
+            )
+            self._conn.commit()
+
+    def iter_active_records(self):
+        """Yields the IOCRecords of all active reports, e.g. to rebuild the lookup index on start."""
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM lifecycle WHERE expired_at IS NULL").fetchall()
+        for (record,) in rows:
+            yield item_from_json_line(record)
+
+    @property
+    def active_count(self):
+        with self._lock:
+            return len(self._expiry)
+
+    def compact(self, now=None):
+        """
+        Drops reports that expired more than `compaction_grace` ago, then the fingerprints in
+        the seen store of the value Indicators and Observables no remaining report (active, or
+        expired within the grace period) refers to, and truncates the WAL files.
+        Returns the number of reports dropped.
+        """
+        cutoff = (now or time.time()) - self.compaction_grace
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT indicator_id, observable_id FROM lifecycle WHERE expired_at IS NOT NULL AND expired_at < ?", (cutoff,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM lifecycle WHERE expired_at IS NOT NULL AND expired_at < ?", (cutoff,))
+            unreferenced = []
+            for column, ids in (("indicator_id", {object_id for object_id, _ in rows}),
+                                ("observable_id", {observable_id for _, observable_id in rows})):
+                ids = list(ids)
+                referenced = set()
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    referenced.update(object_id for (object_id,) in self._conn.execute(
+                        f"SELECT DISTINCT {column} FROM lifecycle WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+                    ))
+                unreferenced.extend(object_id for object_id in ids if object_id not in referenced)
+            self._conn.commit()
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if self.seen_store is not None:
+            self.seen_store.forget(unreferenced)
+            self.seen_store.compact()
+        logging.info(f"Lifecycle compaction dropped {len(rows)} expired reports; {self.active_count} remain active.")
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,87 +1,487 @@
 # main.py
 # Orchestrates fetching from CTI feeds and publishing to OpenTAXII
 
+import argparse
+import signal
+import sys
 import time
 import logging
-from vt_fetcher import VirusTotalFetcher
-from otx_fetcher import AlienVaultOTXFetcher
-from abuseipdb_fetcher import AbuseIPDBFetcher
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+# Fetchers, the lookup index and the archive are imported where they are built, so a
+# one-shot run only loads the modules of the sources and features that are configured
+from correlation import correlate, normalize_records
 from taxii_publisher import TAXIIPublisher
+from seen_store import SeenIndicatorStore
+from scheduler import SourceScheduler
+from outbox import Outbox, OutboxWorker
+from metrics import CYCLE_DURATION, LAST_CYCLE_TIMESTAMP, STAGE_ITEMS, SamplingProfiler, stage_timer, start_metrics_server
 from config import (
     VIRUSTOTAL_API_KEY, ALIENVAULT_OTX_API_KEY, ABUSEIPDB_API_KEY,
-    OPENTAXII_SERVER_URL, OPENTAXII_COLLECTION_ID, OPENTAXII_USERNAME, OPENTAXII_PASSWORD
+    OPENTAXII_SERVER_URL, OPENTAXII_COLLECTION_ID, OPENTAXII_USERNAME, OPENTAXII_PASSWORD,
+    ALIENVAULT_OTX_FETCH_DEADLINE, ABUSEIPDB_FETCH_DEADLINE, SOURCE_BATCH_SIZE,
+    ABUSEIPDB_CACHE_PATH, ABUSEIPDB_CACHE_TTL, ABUSEIPDB_MAX_WORKERS,
+    ABUSEIPDB_MAX_REQUESTS_PER_CYCLE, ABUSEIPDB_BLOCK_QUERY_MIN_IPS,
+    VIRUSTOTAL_REQUESTS_PER_MINUTE, VIRUSTOTAL_DAILY_QUOTA,
+    ALIENVAULT_OTX_REQUESTS_PER_MINUTE, ALIENVAULT_OTX_DAILY_QUOTA,
+    ABUSEIPDB_REQUESTS_PER_MINUTE, ABUSEIPDB_DAILY_QUOTA, HTTP_MAX_RETRIES, HTTP_VALIDATOR_CACHE_PATH,
+    SEEN_STORE_PATH, TAXII_CHUNK_MAX_BYTES, TAXII_CHUNK_MAX_OBJECTS, TAXII_GZIP,
+    TAXII_MAX_PARALLEL_CHUNKS, TAXII_CHUNK_RETRIES, TAXII_CONNECT_TIMEOUT, TAXII_READ_TIMEOUT, TAXII_VALIDATE_STIX,
+    STIX_CONVERSION_WORKERS, STIX_CONVERSION_SHARD_SIZE,
+    ALIENVAULT_OTX_CURSOR_PATH, ALIENVAULT_OTX_PAGE_SIZE, ALIENVAULT_OTX_INITIAL_LOOKBACK_DAYS, ALIENVAULT_OTX_SORT,
+    ALIENVAULT_OTX_BACKFILL, VIRUSTOTAL_BASE_URL, ALIENVAULT_OTX_BASE_URL, ABUSEIPDB_BASE_URL,
+    METRICS_PORT, PROFILE_CYCLE_PATH, PROFILE_SAMPLE_INTERVAL,
+    ALIENVAULT_OTX_INTERVAL, ALIENVAULT_OTX_JITTER,
+    ABUSEIPDB_INTERVAL, ABUSEIPDB_JITTER, SCHEDULER_STATE_PATH,
+    OUTBOX_DIR, OUTBOX_SEGMENT_MAX_BYTES, OUTBOX_MAX_PENDING_BYTES, OUTBOX_BACKPRESSURE_TIMEOUT,
+    OUTBOX_BATCH_SIZE, OUTBOX_FSYNC, OUTBOX_RETRY_MAX,
+    VIRUSTOTAL_CACHE_PATH, VIRUSTOTAL_CACHE_TTL, VIRUSTOTAL_MAX_WORKERS, VIRUSTOTAL_MAX_LOOKUPS_PER_CYCLE,
+    VIRUSTOTAL_ENRICH_DEADLINE, INDEX_API_PORT, INDEX_API_HOST, INDEX_API_SOCKET,
+    ARCHIVE_DIR, ARCHIVE_PARTITION, ARCHIVE_COMPRESSION, ARCHIVE_FSYNC, LOG_LEVEL,
+    LIFECYCLE_DB_PATH, LIFECYCLE_TTL_DAYS, LIFECYCLE_REVOKE, LIFECYCLE_SWEEP_INTERVAL, LIFECYCLE_COMPACT_INTERVAL
 )
-from stix2 import Bundle
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Extra time (seconds) given to a source past its deadline before its results are abandoned.
+# Fetchers stop cooperatively at their deadline; this only covers a request that is mid-flight.
+DEADLINE_GRACE_SECONDS = 5
 
-def run_collection_and_publishing():
-    logging.info("Starting CTI collection and publishing cycle...")
+# Source name -> (interval_seconds, jitter_seconds) for the scheduler
+SOURCE_SCHEDULES = {
+    "AlienVault OTX": (ALIENVAULT_OTX_INTERVAL, ALIENVAULT_OTX_JITTER),
+    "AbuseIPDB": (ABUSEIPDB_INTERVAL, ABUSEIPDB_JITTER)
+}
 
-    # Initialize fetchers
-    vt_fetcher = VirusTotalFetcher(VIRUSTOTAL_API_KEY)
-    otx_fetcher = AlienVaultOTXFetcher(ALIENVAULT_OTX_API_KEY)
-    abuseipdb_fetcher = AbuseIPDBFetcher(ABUSEIPDB_API_KEY)
+def _collect_from_source(source_name, fetch, deadline):
+    """Runs a single fetcher to the end and returns (records, elapsed_seconds)."""
+    started = time.monotonic()
+    with stage_timer("fetch", source_name):
+        try:
+            records = list(fetch(deadline) or [])
+        except Exception as e:
+            logging.error(f"Unexpected error while fetching from {source_name}: {e}")
+            records = []
+    STAGE_ITEMS.inc(len(records), stage="fetch", source=source_name)
+    return records, time.monotonic() - started
 
-    # Initialize TAXII Publisher
-    taxii_publisher = TAXIIPublisher(
-        OPENTAXII_SERVER_URL,
-        OPENTAXII_COLLECTION_ID,
-        OPENTAXII_USERNAME,
-        OPENTAXII_PASSWORD
-    )
+def collect_concurrently(sources):
+    """
+    Runs every source's fetch function in parallel, each bounded by its own deadline.
+    `sources` is a list of (source_name, fetch, deadline_seconds, commit) tuples as built by
+    build_sources(). Returns (all_records, source_timings) where source_timings maps each
+    source that finished within its own deadline (plus grace) to its wall-clock time in
+    seconds; only those may be committed. Records of the other sources are dropped.
+    """
+    all_records = []
+    source_timings = {}
+    if not sources:
+        return all_records, source_timings
 
-    all_stix_objects = []
+    cycle_start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="fetcher")
+    futures = {}
+    for source_name, fetch, deadline_seconds, _ in sources:
+        logging.info(f"Fetching from {source_name} (deadline: {deadline_seconds:.0f}s)...")
+        future = executor.submit(_collect_from_source, source_name, fetch, cycle_start + deadline_seconds)
+        futures[future] = (source_name, deadline_seconds)
 
-    # Fetch from VirusTotal
-    if VIRUSTOTAL_API_KEY and VIRUSTOTAL_API_KEY != '513bf61cf011c015a0a5124ae7aa140412381e6b2115907fcfc500547e573fa2':
-        logging.info("Fetching from VirusTotal...")
-        vt_stix = vt_fetcher.fetch_recent_indicators(limit=5) # Reduced limit for free tier
-        all_stix_objects.extend(vt_stix)
-        logging.info(f"Collected {len(vt_stix)} STIX objects from VirusTotal.")
-    else:
-        logging.warning("VirusTotal API key not configured. Skipping VirusTotal fetch.")
+    # Wait until the last deadline (plus grace); stragglers are abandoned rather than waited on.
+    max_deadline = max(deadline_seconds for _, _, deadline_seconds, _ in sources)
+    wait(futures, timeout=max_deadline + DEADLINE_GRACE_SECONDS)
+
+    for future, (source_name, deadline_seconds) in futures.items():
+        # A source that finished, but later than its own (shorter) deadline, counts as missing it too
+        if future.done() and future.result()[1] <= deadline_seconds + DEADLINE_GRACE_SECONDS:
+            records, elapsed = future.result()
+            all_records.extend(records)
+            source_timings[source_name] = elapsed
+            logging.info(f"Collected {len(records)} IOC records from {source_name} in {elapsed:.2f}s.")
+        else:
+            logging.error(f"{source_name} did not finish within its {deadline_seconds:.0f}s deadline. Skipping its results.")
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    return all_records, source_timings
+
+def build_validator_cache():
+    """Returns the ValidatorCache for the OTX fetcher's conditional requests, or None if disabled."""
+    if not HTTP_VALIDATOR_CACHE_PATH:
+        return None
+    from validator_cache import ValidatorCache
+    return ValidatorCache(HTTP_VALIDATOR_CACHE_PATH)
+
+def build_sources(validator_cache=None):
+    """
+    Builds a fetcher for every configured source. Returns a list of
+    (source_name, fetch, deadline_seconds, commit) tuples: `fetch` takes an absolute
+    time.monotonic() deadline and returns an iterable of records, and `commit` (or None)
+    persists the source's progress once those records are spooled.
+    """
+    sources = []
 
-    # Fetch from AlienVault OTX
+    # AlienVault OTX
     if ALIENVAULT_OTX_API_KEY and ALIENVAULT_OTX_API_KEY != 'cc10d2976dbe84523c003c2b0b3bdb9ba375683d1b3469aec36438aa2c98acec':
-        logging.info("Fetching from AlienVault OTX...")
-        otx_stix = otx_fetcher.fetch_recent_pulses(limit=5) # Reduced limit for free tier
-        all_stix_objects.extend(otx_stix)
-        logging.info(f"Collected {len(otx_stix)} STIX objects from AlienVault OTX.")
+        from otx_fetcher import AlienVaultOTXFetcher
+        otx_fetcher = AlienVaultOTXFetcher(
+            ALIENVAULT_OTX_API_KEY,
+            base_url=ALIENVAULT_OTX_BASE_URL,
+            requests_per_minute=ALIENVAULT_OTX_REQUESTS_PER_MINUTE,
+            daily_quota=ALIENVAULT_OTX_DAILY_QUOTA or None,
+            max_retries=HTTP_MAX_RETRIES,
+            cursor_path=ALIENVAULT_OTX_CURSOR_PATH,
+            page_size=ALIENVAULT_OTX_PAGE_SIZE,
+            initial_lookback_days=ALIENVAULT_OTX_INITIAL_LOOKBACK_DAYS,
+            validator_cache=validator_cache,
+            sort=ALIENVAULT_OTX_SORT or None
+        )
+        sources.append((
+            "AlienVault OTX",
+            # Lazily walks every page of pulses modified since the persisted cursor
+            lambda deadline: otx_fetcher.iter_indicators(backfill=ALIENVAULT_OTX_BACKFILL, deadline=deadline),
+            ALIENVAULT_OTX_FETCH_DEADLINE,
+            otx_fetcher.commit
+        ))
     else:
         logging.warning("AlienVault OTX API key not configured. Skipping AlienVault OTX fetch.")
 
-    # Fetch from AbuseIPDB
+    # AbuseIPDB
     if ABUSEIPDB_API_KEY and ABUSEIPDB_API_KEY != '5489b1d7dd9346cae4ffc0eb4c64a43dba74678d2a667ea2181c088fa489da5d891a8e81a1ec1222':
-        logging.info("Fetching from AbuseIPDB...")
+        from abuseipdb_fetcher import AbuseIPDBFetcher
+        from reputation_cache import ReputationCache
+        abuseipdb_fetcher = AbuseIPDBFetcher(
+            ABUSEIPDB_API_KEY,
+            base_url=ABUSEIPDB_BASE_URL,
+            cache=ReputationCache(ABUSEIPDB_CACHE_PATH, ABUSEIPDB_CACHE_TTL),
+            max_workers=ABUSEIPDB_MAX_WORKERS,
+            max_requests_per_cycle=ABUSEIPDB_MAX_REQUESTS_PER_CYCLE,
+            block_query_min_ips=ABUSEIPDB_BLOCK_QUERY_MIN_IPS,
+            requests_per_minute=ABUSEIPDB_REQUESTS_PER_MINUTE,
+            daily_quota=ABUSEIPDB_DAILY_QUOTA or None,
+            max_retries=HTTP_MAX_RETRIES
+        )
         # For AbuseIPDB, we provide a list of IPs to check.
         # In a real scenario, these IPs might come from other feeds or internal systems.
         # For this demo, we use a small hardcoded list of example IPs.
         example_ips_to_check = ["1.1.1.1", "8.8.8.8", "185.192.126.111", "192.168.1.1"] # Add/remove as needed
-        abuseipdb_stix = abuseipdb_fetcher.fetch_recent_indicators(ip_list=example_ips_to_check)
-        all_stix_objects.extend(abuseipdb_stix)
-        logging.info(f"Collected {len(abuseipdb_stix)} STIX objects from AbuseIPDB.")
+        sources.append((
+            "AbuseIPDB",
+            lambda deadline: abuseipdb_fetcher.fetch_recent_indicators(ip_list=example_ips_to_check, deadline=deadline),
+            ABUSEIPDB_FETCH_DEADLINE,
+            None
+        ))
     else:
         logging.warning("AbuseIPDB API key not configured. Skipping AbuseIPDB fetch.")
 
-    if all_stix_objects:
-        logging.info(f"Total STIX objects collected: {len(all_stix_objects)}. Publishing to OpenTAXII...")
-        stix_bundle = Bundle(all_stix_objects, allow_custom=True) # allow_custom for TLP_WHITE and custom properties
-        success = taxii_publisher.publish_bundle(stix_bundle)
-        if success:
-            logging.info("STIX bundle successfully published to OpenTAXII.")
-        else:
-            logging.error("Failed to publish STIX bundle to OpenTAXII.")
+    return sources
+
+def build_enricher():
+    """Returns the VirusTotal enricher, or None if VirusTotal is not configured."""
+    if not VIRUSTOTAL_API_KEY or VIRUSTOTAL_API_KEY == '513bf61cf011c015a0a5124ae7aa140412381e6b2115907fcfc500547e573fa2':
+        logging.warning("VirusTotal API key not configured. Skipping VirusTotal enrichment.")
+        return None
+    from vt_fetcher import VirusTotalFetcher
+    from reputation_cache import ReputationCache
+    return VirusTotalFetcher(
+        VIRUSTOTAL_API_KEY,
+        base_url=VIRUSTOTAL_BASE_URL,
+        cache=ReputationCache(VIRUSTOTAL_CACHE_PATH, VIRUSTOTAL_CACHE_TTL),
+        max_workers=VIRUSTOTAL_MAX_WORKERS,
+        max_lookups_per_cycle=VIRUSTOTAL_MAX_LOOKUPS_PER_CYCLE,
+        requests_per_minute=VIRUSTOTAL_REQUESTS_PER_MINUTE,
+        daily_quota=VIRUSTOTAL_DAILY_QUOTA or None,
+        max_retries=HTTP_MAX_RETRIES
+    )
+
+def enrich_records(enricher, records, budget=None):
+    """
+    Adds VirusTotal verdicts to freshly collected records, bounded by VIRUSTOTAL_ENRICH_DEADLINE.
+    A run that enriches several batches shares one LookupBudget `budget` between them.
+    """
+    if enricher is None or not records:
+        return records
+    with stage_timer("enrich", "VirusTotal"):
+        try:
+            enricher.enrich_records(records, deadline=time.monotonic() + VIRUSTOTAL_ENRICH_DEADLINE, budget=budget)
+        except Exception as e:
+            logging.error(f"Unexpected error while enriching with VirusTotal: {e}")
+    return records
+
+def build_publisher():
+    return TAXIIPublisher(
+        OPENTAXII_SERVER_URL,
+        OPENTAXII_COLLECTION_ID,
+        OPENTAXII_USERNAME,
+        OPENTAXII_PASSWORD,
+        seen_store=SeenIndicatorStore(SEEN_STORE_PATH),
+        chunk_max_bytes=TAXII_CHUNK_MAX_BYTES,
+        chunk_max_objects=TAXII_CHUNK_MAX_OBJECTS,
+        gzip_body=TAXII_GZIP,
+        max_parallel_chunks=TAXII_MAX_PARALLEL_CHUNKS,
+        chunk_retries=TAXII_CHUNK_RETRIES,
+        timeout=(TAXII_CONNECT_TIMEOUT, TAXII_READ_TIMEOUT),
+        validate_stix=TAXII_VALIDATE_STIX,
+        conversion_workers=STIX_CONVERSION_WORKERS,
+        conversion_shard_size=STIX_CONVERSION_SHARD_SIZE
+    )
+
+def build_outbox():
+    return Outbox(
+        OUTBOX_DIR,
+        segment_max_bytes=OUTBOX_SEGMENT_MAX_BYTES,
+        max_pending_bytes=OUTBOX_MAX_PENDING_BYTES,
+        backpressure_timeout=OUTBOX_BACKPRESSURE_TIMEOUT,
+        fsync=OUTBOX_FSYNC
+    )
+
+def build_outbox_worker(outbox, taxii_publisher):
+    return OutboxWorker(outbox, taxii_publisher, batch_size=OUTBOX_BATCH_SIZE, retry_max=OUTBOX_RETRY_MAX)
+
+def build_archive():
+    if not ARCHIVE_DIR:
+        return None
+    from archive import IndicatorArchive
+    return IndicatorArchive(ARCHIVE_DIR, partition=ARCHIVE_PARTITION, compression=ARCHIVE_COMPRESSION, fsync=ARCHIVE_FSYNC)
+
+def archive_records(archive, name, records):
+    """Appends records to the history archive. Failures are logged; they never hold up publishing."""
+    if archive is None or not records:
+        return
+    with stage_timer("archive", name):
+        try:
+            archive.append(records)
+        except OSError as e:
+            logging.error(f"Could not archive {len(records)} {name} records: {e}")
+
+def build_lifecycle(seen_store=None):
+    """Returns the indicator lifecycle engine, or None if expiry is disabled."""
+    if not LIFECYCLE_DB_PATH:
+        return None
+    from lifecycle import IndicatorLifecycle, TTLPolicy
+    return IndicatorLifecycle(LIFECYCLE_DB_PATH, TTLPolicy.from_spec(LIFECYCLE_TTL_DAYS),
+                              revoke=LIFECYCLE_REVOKE, seen_store=seen_store)
+
+def track_lifecycle(lifecycle, name, records):
+    """Starts or refreshes the TTL of collected records. Returns the records that are still active."""
+    if lifecycle is None or not records:
+        return records
+    with stage_timer("lifecycle", name):
+        return lifecycle.observe(records)
+
+def expire_indicators(lifecycle, outbox, index=None, archive=None):
+    """
+    Expiry sweep: spools valid_until updates for every Indicator past its TTL, archives
+    them and drops the expired reports from the lookup index.
+    """
+    with stage_timer("lifecycle"):
+        expired = lifecycle.expire_due()
+        if not expired:
+            return True
+        updates = lifecycle.expiry_updates(expired)
+        outbox.append(updates)
+        lifecycle.mark_expired(expired)
+        if index is not None:
+            index.remove_records(record for _, _, record, _ in expired)
+    archive_records(archive, "", updates)
+    logging.info(f"Expired {len(expired)} indicators; {lifecycle.active_count} remain active.")
+    return True
+
+def correlate_records(lifecycle, name, records):
+    """
+    Merges records for the same observable value into one record per value, with the
+    attributions of every source that reported it in this run or is still active in the lifecycle.
+    """
+    if not records:
+        return records
+    # The records were just registered with the lifecycle, so only values with a second
+    # active Indicator can have attributions from other sources to add
+    active_records = partial(lifecycle.active_records, min_active=2) if lifecycle is not None else None
+    with stage_timer("correlate", name):
+        merged = correlate(records, active_records)
+    STAGE_ITEMS.inc(len(merged), stage="correlate", source=name)
+    logging.info(f"Correlated {len(records)} IOC records into {len(merged)} indicators.")
+    return merged
+
+def compact_lifecycle(lifecycle):
+    with stage_timer("lifecycle"):
+        lifecycle.compact()
+    return True
+
+def spool_records(outbox, records):
+    """Writes collected records to the outbox, from where the publisher worker sends them to OpenTAXII."""
+    if not records:
+        logging.info("No new IOC records collected to publish.")
+        return
+    spooled = outbox.append(records)
+    logging.info(f"Spooled {spooled} IOC records to the outbox ({outbox.pending_bytes} bytes pending).")
+
+def commit_sources(sources, finished):
+    """Lets each source that finished persist its progress (e.g. the OTX cursor) once its records are spooled."""
+    for source_name, _, _, commit in sources:
+        if commit is not None and source_name in finished:
+            commit()
+
+def run_collection_and_publishing():
+    """Runs every configured source once, concurrently, then drains the outbox to OpenTAXII."""
+    logging.info("Starting CTI collection and publishing cycle...")
+    cycle_started = time.monotonic()
+
+    outbox = build_outbox()
+    validator_cache = build_validator_cache()
+    sources = build_sources(validator_cache)
+    all_records, source_timings = collect_concurrently(sources)
+    normalize_records(all_records)
+    if source_timings:
+        timings_summary = ", ".join(f"{name}: {elapsed:.2f}s" for name, elapsed in source_timings.items())
+        logging.info(f"Per-source collection time: {timings_summary}")
+    all_records = enrich_records(build_enricher(), all_records)
+    archive = build_archive()
+    archive_records(archive, "", all_records)
+    taxii_publisher = build_publisher()
+    lifecycle = build_lifecycle(taxii_publisher.seen_store)
+    all_records = track_lifecycle(lifecycle, "", all_records)
+    spool_records(outbox, correlate_records(lifecycle, "", all_records))
+    commit_sources(sources, source_timings)
+    if lifecycle is not None:
+        expire_indicators(lifecycle, outbox, archive=archive)
+        lifecycle.close()
+    if build_outbox_worker(outbox, taxii_publisher).drain():
+        logging.info("STIX objects successfully published to OpenTAXII.")
     else:
-        logging.info("No new STIX objects collected to publish.")
+        logging.error("Failed to publish some STIX objects to OpenTAXII. They stay in the outbox for the next cycle.")
+    taxii_publisher.close()
+    outbox.close()
 
+    CYCLE_DURATION.observe(time.monotonic() - cycle_started)
+    LAST_CYCLE_TIMESTAMP.set(time.time())
     logging.info("CTI collection and publishing cycle finished.")
 
-if __name__ == "__main__":
-    # This loop will make the container run continuously and fetch periodically
-    # In a production environment, you might use a proper scheduler like Cron or Kubernetes cron jobs.
+def process_batch(name, records, outbox, enricher=None, index=None, archive=None, lifecycle=None, budget=None):
+    """
+    Takes one batch of a source's records through the pipeline: normalize values, enrich,
+    archive, drop records already past their TTL, add the rest to the lookup index, then
+    merge them with other sources' records per value and spool them to the outbox.
+    """
+    records = enrich_records(enricher, normalize_records(records), budget)
+    archive_records(archive, name, records)
+    records = track_lifecycle(lifecycle, name, records)
+    if index is not None and records:
+        with stage_timer("index", name):
+            index.add_records(records)
+    spool_records(outbox, correlate_records(lifecycle, name, records))
+
+def run_source(source, outbox, enricher=None, index=None, archive=None, lifecycle=None, batch_size=SOURCE_BATCH_SIZE):
+    """
+    One scheduled run of a single source. Records are taken from the fetcher `batch_size`
+    at a time as it produces them and each batch is processed and spooled before the next
+    is fetched, so memory stays bounded however long an OTX walk is. The fetchers stop
+    at their deadline themselves; the OTX walk counts only its own page requests against it,
+    not the time batches spend here. The source commits its progress (the OTX cursor, or the
+    checkpoint of a walk cut short) only after its last batch is spooled, so a crash mid-run
+    re-reads the data instead of losing it.
+    """
+    source_name, fetch, deadline_seconds, commit = source
+    logging.info(f"Fetching from {source_name} (deadline: {deadline_seconds:.0f}s)...")
+    started = time.monotonic()
+    budget = None
+    if enricher is not None:
+        from vt_fetcher import LookupBudget
+        budget = LookupBudget(enricher.max_lookups_per_cycle)
+    records = None
+    collected = 0
     while True:
-        run_collection_and_publishing()
-        # Wait for an hour before the next cycle
-        logging.info("Waiting for 3600 seconds (1 hour) before next collection cycle...")
-        time.sleep(3600)
+        with stage_timer("fetch", source_name):
+            try:
+                if records is None:
+                    records = iter(fetch(started + deadline_seconds) or [])
+                batch = list(islice(records, batch_size))
+            except Exception as e:
+                logging.error(f"Unexpected error while fetching from {source_name}: {e}")
+                return False
+        if not batch:
+            break
+        collected += len(batch)
+        STAGE_ITEMS.inc(len(batch), stage="fetch", source=source_name)
+        process_batch(source_name, batch, outbox, enricher, index, archive, lifecycle, budget)
+    if commit is not None:
+        commit()
+    logging.info(f"Collected {collected} IOC records from {source_name} in {time.monotonic() - started:.2f}s.")
+    LAST_CYCLE_TIMESTAMP.set(time.time())
+    return True
+
+def build_scheduler(outbox, index=None, archive=None, lifecycle=None):
+    """
+    Builds fetchers once and schedules each configured source on its own interval,
+    plus the lifecycle's expiry sweeps and compactions.
+    """
+    scheduler = SourceScheduler(SCHEDULER_STATE_PATH)
+    validator_cache = build_validator_cache()
+    enricher = build_enricher()
+    for source in build_sources(validator_cache):
+        interval, jitter = SOURCE_SCHEDULES[source[0]]
+        scheduler.add_job(source[0], partial(run_source, source, outbox, enricher, index, archive, lifecycle), interval, jitter)
+    if lifecycle is not None:
+        scheduler.add_job("Indicator expiry", partial(expire_indicators, lifecycle, outbox, index, archive), LIFECYCLE_SWEEP_INTERVAL)
+        scheduler.add_job("Lifecycle compaction", partial(compact_lifecycle, lifecycle), LIFECYCLE_COMPACT_INTERVAL)
+    return scheduler
+
+def configure_logging():
+    """Sets up logging once for the process; library modules only log."""
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Collects CTI from the configured feeds and publishes it to OpenTAXII.")
+    parser.add_argument("--once", action="store_true",
+                        help="Run every source that is due once, drain the outbox and exit (for cron or Kubernetes CronJobs)")
+    args = parser.parse_args()
+
+    index = None
+    if not args.once:
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
+        if INDEX_API_PORT or INDEX_API_SOCKET:
+            from indicator_index import IndicatorIndex, start_index_server
+            index = IndicatorIndex()
+            start_index_server(index, INDEX_API_PORT, INDEX_API_HOST, INDEX_API_SOCKET or None)
+    outbox = build_outbox()
+    taxii_publisher = build_publisher()
+    outbox_worker = build_outbox_worker(outbox, taxii_publisher)
+    lifecycle = build_lifecycle(taxii_publisher.seen_store)
+    if index is not None and lifecycle is not None:
+        # The index lives in memory; repopulate it with what is still active
+        index.add_records(lifecycle.iter_active_records())
+    scheduler = build_scheduler(outbox, index, build_archive(), lifecycle)
+
+    if args.once or PROFILE_CYCLE_PATH:
+        if PROFILE_CYCLE_PATH:
+            # Opt-in: profile only the first round of runs
+            logging.info(f"Profiling the first run (sampling every {PROFILE_SAMPLE_INTERVAL * 1000:.0f}ms)...")
+            with SamplingProfiler(PROFILE_SAMPLE_INTERVAL) as profiler:
+                futures = scheduler.run_due(wait_for_completion=True, ignore_jitter=True)
+                published = outbox_worker.drain()
+            profiler.write_folded(PROFILE_CYCLE_PATH)
+        else:
+            futures = scheduler.run_due(wait_for_completion=True, ignore_jitter=True)
+            published = outbox_worker.drain()
+        if args.once:
+            scheduler.shutdown()
+            taxii_publisher.close()
+            if lifecycle is not None:
+                lifecycle.close()
+            outbox.close()
+            if not futures:
+                logging.info("No source is due yet.")
+            sys.exit(0 if published and all(future.result() for future in futures.values()) else 1)
+
+    # Fetching and publishing run independently: sources spool on their own intervals
+    # while the worker drains the outbox, so a slow OpenTAXII never holds up a fetch.
+    def _shutdown(signum, frame):
+        scheduler.stop()
+        outbox_worker.stop()
+    signal.signal(signal.SIGTERM, _shutdown)
+    outbox_worker.start()
+    scheduler.run_forever()
+    outbox_worker.stop()
+    taxii_publisher.close()
+    if lifecycle is not None:
+        lifecycle.close()
+    outbox.close()
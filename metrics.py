@@ -0,0 +1,247 @@
+# metrics.py
+# In-process metrics (counters, gauges, histograms) with Prometheus text exposition,
+# a small /metrics HTTP endpoint, and an opt-in sampling profiler for a single cycle
+
+import logging
+import sys
+import threading
+import time
+from collections import Counter as _TallyCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+DEFAULT_BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000)
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [(name, value) for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+def _escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+class Gauge(Counter):
+    """Value per label set that can go up and down."""
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set, matching Prometheus semantics."""
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0] # bucket counts, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (bucket_counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', repr(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_SECONDS_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# Collector metrics shared by all modules
+STAGE_DURATION = REGISTRY.histogram(
+    "cti_stage_duration_seconds", "Time spent per pipeline stage (fetch, enrich, index, archive, lifecycle, correlate, convert, serialize, publish).", ("stage", "source"))
+STAGE_ITEMS = REGISTRY.counter(
+    "cti_stage_items_total", "Items processed per pipeline stage.", ("stage", "source"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "cti_http_request_duration_seconds", "Outbound HTTP request latency by source and status code.", ("source", "status"))
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "cti_http_response_bytes_total", "Response body bytes received from CTI APIs as sent on the wire, by content encoding.", ("source", "encoding"))
+HTTP_BYTES_SAVED = REGISTRY.counter(
+    "cti_http_bytes_saved_total", "Response bytes not downloaded because the API answered 304 Not Modified.", ("source",))
+PUBLISHED_CHUNK_BYTES = REGISTRY.histogram(
+    "cti_published_chunk_bytes", "Size of each TAXII Inbox message body sent.", (), buckets=DEFAULT_BYTES_BUCKETS)
+PUBLISHED_BYTES = REGISTRY.counter(
+    "cti_published_bytes_total", "Bytes of TAXII Inbox message bodies sent.")
+CYCLE_DURATION = REGISTRY.histogram(
+    "cti_cycle_duration_seconds", "Wall-clock time of a full collection and publishing cycle.")
+LAST_CYCLE_TIMESTAMP = REGISTRY.gauge(
+    "cti_last_cycle_timestamp_seconds", "Unix time the last cycle finished.")
+ACTIVE_INDICATORS = REGISTRY.gauge(
+    "cti_active_indicators", "Indicators tracked by the lifecycle engine that have not expired yet.")
+REPUTATION_CACHE_LOOKUPS = REGISTRY.counter(
+    "cti_reputation_cache_lookups_total", "AbuseIPDB and VirusTotal cache lookups by result (hit or miss).", ("source", "result"))
+API_REQUESTS_SAVED = REGISTRY.counter(
+    "cti_api_requests_saved_total", "API requests not sent because the answer was cached or already being looked up.", ("source",))
+OUTBOX_PENDING_BYTES = REGISTRY.gauge(
+    "cti_outbox_pending_bytes", "Bytes spooled in the outbox and not yet published.")
+
+@contextmanager
+def stage_timer(stage, source=""):
+    """Times a block into cti_stage_duration_seconds{stage, source}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=stage, source=source)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves /metrics on a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return server
+
+class SamplingProfiler:
+    """
+    Low-overhead wall-clock sampling profiler. While running, a background thread records the
+    stack of every other thread every `interval` seconds; write_folded() emits the samples in
+    collapsed-stack format (one 'frame;frame;frame count' line per stack) for flamegraph tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = _TallyCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            if len(thread_names) != threading.active_count():
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Wrote {sum(self.samples.values())} profiler samples to {path}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
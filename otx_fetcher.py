@@ -1,110 +1,296 @@
 # otx_fetcher.py
-# Fetches pulses from AlienVault OTX API and converts them to STIX 2.x
+# Fetches pulses from AlienVault OTX API and converts them to IOC records for STIX 2.x publishing
 
-import requests
+from http_client import NOT_MODIFIED, RateLimitedClient
+from ioc_record import IOCRecord, now_timestamp
 import json
-from stix2 import Indicator, Observable, Bundle, TLP_WHITE # Added TLP_WHITE import
 import logging
+import os
 import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qsl
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def pulse_to_records(pulse, created):
+    """Converts one OTX pulse's indicators into IOCRecords stamped with `created`."""
+    records = []
+    pulse_id = pulse.get('id')
+    name = pulse.get('name', 'Unnamed Pulse')
+    modified = pulse.get('modified')
+    description_suffix = f" from OTX Pulse '{name}' (ID: {pulse_id})"
+
+    logging.debug("Processing OTX Pulse: %s (ID: %s)", name, pulse_id)
+
+    for indicator_data in pulse.get('indicators', []):
+        indicator_type = indicator_data.get('type')
+        indicator_value = indicator_data.get('indicator')
+        if not indicator_value:
+            continue
+
+        record = IOCRecord.from_source_type(
+            "AlienVault OTX", indicator_type, indicator_value,
+            description=f"{indicator_type} indicator: {indicator_value}{description_suffix}",
+            valid_from=modified,
+            created=created
+        )
+        if record is not None:
+            records.append(record)
+            logging.debug("Created IOC record for %s: %s", indicator_type, indicator_value) # Per-indicator: DEBUG with lazy formatting
+    return records
+
+def _parse_otx_time(value):
+    """Parses an OTX timestamp into an aware UTC datetime, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
 
 class AlienVaultOTXFetcher:
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=None, requests_per_minute=160, daily_quota=None, max_retries=4,
+                 cursor_path=None, page_size=50, initial_lookback_days=30, validator_cache=None, sort=None):
+        """
+        `cursor_path` is an optional JSON file holding the high-water mark (the latest pulse
+        `modified` time seen), so iter_indicators only pulls pulses modified since the last
+        completed run whose records were stored (see commit()). A walk cut short by its
+        deadline is checkpointed there too and the next run resumes it at its first unread page.
+        Without a cursor, the first run looks back `initial_lookback_days` (0 means a full
+        backfill of the subscription).
+        `sort` is an optional sort order (e.g. '-modified') sent with every page request.
+        With a `validator_cache` and a `sort`, the first page of each walk is a conditional
+        request, so an unchanged subscription costs one 304 instead of a download and a parse.
+        Without an explicit order the first page need not change when a later one does, so no
+        request is conditional.
+        """
         self.api_key = api_key
-        self.base_url = "https://otx.alienvault.com/api/v1"
+        self.cursor_path = cursor_path
+        self.page_size = page_size
+        self.initial_lookback_days = initial_lookback_days
+        self.sort = sort
+        self.last_walk_complete = False
+        self._pending_cursor = None
+        self._pending_walk = None
+        self._next_page_params = None
+        self.base_url = base_url or "https://otx.alienvault.com/api/v1"
         self.headers = {
             "X-OTX-API-KEY": self.api_key,
             "Accept": "application/json"
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.client = RateLimitedClient(
+            "AlienVault OTX", self.base_url, self.headers,
+            requests_per_minute=requests_per_minute,
+            daily_quota=daily_quota,
+            max_retries=max_retries,
+            validator_cache=validator_cache
+        )
+        self.session = self.client.session
 
-    def _make_request(self, endpoint, params=None):
-        """Helper to make API requests with rate limiting."""
-        url = f"{self.base_url}/{endpoint}"
-        try:
-            response = self.session.get(url, params=params)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTP error for {endpoint}: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429: # Too Many Requests
-                logging.warning("AlienVault OTX rate limit hit. Waiting for 60 seconds...")
-                time.sleep(60)
-                return self._make_request(endpoint, params) # Retry after delay
-            return None
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error for {endpoint}: {e}")
-            return None
-
-    def fetch_recent_pulses(self, limit=10):
-        """Fetches recent public pulses from AlienVault OTX."""
-        stix_objects = []
+    def _make_request(self, endpoint, params=None, deadline=None, **options):
+        """
+        Helper to make API requests through the shared rate-limited client.
+        `deadline` is an optional time.monotonic() value the request must finish by.
+        `options` are passed on to RateLimitedClient.get_json (if_changed, conditional).
+        """
+        return self.client.get_json(endpoint, params, deadline, **options)
+
+    def fetch_recent_pulses(self, limit=10, deadline=None):
+        """
+        Fetches recent public pulses from AlienVault OTX.
+        Returns IOCRecords; STIX objects are emitted from them at publish time.
+        If `deadline` (a time.monotonic() value) passes, the indicators built so far are returned.
+        """
+        records = []
+        created = now_timestamp()
         logging.info(f"Fetching {limit} recent pulses from AlienVault OTX...")
         endpoint = "pulses/subscribed" # Or 'pulses/latest' for public
         params = {"limit": limit}
-        data = self._make_request(endpoint, params)
+        data = self._make_request(endpoint, params, deadline)
 
         if data and 'results' in data:
             for pulse in data['results']:
-                pulse_id = pulse.get('id')
-                name = pulse.get('name', 'Unnamed Pulse')
-                description = pulse.get('description', 'No description.')
-                modified = pulse.get('modified')
-
-                logging.info(f"Processing OTX Pulse: {name} (ID: {pulse_id})")
-
-                for indicator_data in pulse.get('indicators', []):
-                    indicator_type = indicator_data.get('type')
-                    indicator_value = indicator_data.get('indicator')
-                    if not indicator_value:
-                        continue
-
-                    # Map OTX indicator types to STIX observable types and patterns
-                    observable = None
-                    pattern = None
-                    description_suffix = f" from OTX Pulse '{name}' (ID: {pulse_id})"
-
-                    if indicator_type == 'IPv4':
-                        observable = Observable(value=indicator_value, type='ipv4-addr')
-                        pattern = f"[ipv4-addr:value = '{indicator_value}']"
-                    elif indicator_type == 'IPv6':
-                        observable = Observable(value=indicator_value, type='ipv6-addr')
-                        pattern = f"[ipv6-addr:value = '{indicator_value}']"
-                    elif indicator_type == 'domain':
-                        observable = Observable(value=indicator_value, type='domain-name') # Corrected type to domain-name
-                        pattern = f"[domain-name:value = '{indicator_value}']"
-                    elif indicator_type == 'hostname': # Treat hostname as domain for simplicity
-                        observable = Observable(value=indicator_value, type='domain-name') # Corrected type to domain-name
-                        pattern = f"[domain-name:value = '{indicator_value}']"
-                    elif indicator_type == 'URL':
-                        observable = Observable(value=indicator_value, type='url')
-                        pattern = f"[url:value = '{indicator_value}']"
-                    elif indicator_type == 'FileHash-MD5':
-                        observable = Observable(value=indicator_value, type='file', hashes={'MD5': indicator_value})
-                        pattern = f"[file:hashes.'MD5' = '{indicator_value}']"
-                    elif indicator_type == 'FileHash-SHA1':
-                        observable = Observable(value=indicator_value, type='file', hashes={'SHA-1': indicator_value})
-                        pattern = f"[file:hashes.'SHA-1' = '{indicator_value}']"
-                    elif indicator_type == 'FileHash-SHA256':
-                        observable = Observable(value=indicator_value, type='file', hashes={'SHA-256': indicator_value})
-                        pattern = f"[file:hashes.'SHA-256' = '{indicator_value}']"
-                    else:
-                        logging.warning(f"Unsupported OTX indicator type: {indicator_type} for value: {indicator_value}")
-                        continue
-
-                    if observable and pattern:
-                        indicator = Indicator(
-                            pattern=pattern,
-                            pattern_type="stix",
-                            description=f"{indicator_type} indicator: {indicator_value}{description_suffix}",
-                            valid_from=modified if modified else time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
-                            # Add TLP marking
-                            object_marking_refs=[TLP_WHITE],
-                            # You might add a relationship to the observable here if needed
-                        )
-                        stix_objects.extend([observable, indicator])
-                        logging.info(f"Created STIX Indicator for {indicator_type}: {indicator_value}")
-
-        return stix_objects
+                if deadline is not None and time.monotonic() >= deadline:
+                    logging.warning("AlienVault OTX deadline reached. Returning indicators collected so far.")
+                    break
+
+                records.extend(pulse_to_records(pulse, created))
+
+        return records
+
+    def _load_state(self):
+        if not self.cursor_path or not os.path.exists(self.cursor_path):
+            return {}
+        try:
+            with open(self.cursor_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read OTX cursor from {self.cursor_path}: {e}")
+            return {}
+
+    def _save_state(self, state):
+        if not self.cursor_path:
+            return
+        cursor_dir = os.path.dirname(self.cursor_path)
+        if cursor_dir:
+            os.makedirs(cursor_dir, exist_ok=True)
+        tmp_path = f"{self.cursor_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.cursor_path)
+
+    def load_cursor(self):
+        """Returns the persisted `modified_since` high-water mark, or None."""
+        return self._load_state().get("modified_since")
+
+    def load_walk(self):
+        """
+        Returns the checkpoint of an unfinished walk: {"modified_since", "params", "high_water"}
+        with the query of its first unread page, or None.
+        """
+        return self._load_state().get("walk")
+
+    def save_cursor(self, modified_since):
+        """Atomically persists the `modified_since` high-water mark, ending any unfinished walk."""
+        self._save_state({"modified_since": modified_since})
+
+    def save_walk(self, walk):
+        """Atomically persists the checkpoint of an unfinished walk, keeping the cursor as is."""
+        self._save_state({"modified_since": self.load_cursor(), "walk": walk})
+
+    def iter_pulses(self, modified_since=None, deadline=None, resume_params=None, conditional=True):
+        """
+        Generator over every subscribed pulse, following `next` links one page at a time,
+        so only a single page is held in memory. Stops early if `deadline` passes or a
+        page request fails; check `self.last_walk_complete` afterwards.
+        Only the page requests count against `deadline`: time the consumer spends between
+        pulses (converting, enriching, spooling) moves it back. `resume_params` continues
+        an unfinished walk at the page they query.
+        With `conditional` and a `sort` order, the first page is a conditional request. If it is
+        answered 304 Not Modified, nothing is yielded and the walk counts as complete.
+        Call commit() once the pulses have been handled.
+        """
+        endpoint = "pulses/subscribed"
+        params = {"limit": self.page_size, "page": 1}
+        if modified_since:
+            params["modified_since"] = modified_since
+        if self.sort:
+            params["sort"] = self.sort
+        if resume_params:
+            params = dict(resume_params)
+        self.last_walk_complete = False
+        self.client.discard_validators()
+
+        first_page = conditional and bool(self.sort) and not resume_params
+        while True:
+            # Every page before this one has been yielded in full
+            self._next_page_params = params
+            # Only the first page is conditional: in a fixed order it changes whenever any later page would
+            data = self._make_request(endpoint, params, deadline, if_changed=first_page, conditional=first_page)
+            first_page = False
+            if data is NOT_MODIFIED:
+                logging.info(
+                    f"AlienVault OTX subscription not modified since the last walk. Skipping download "
+                    f"({self.client.stats['bytes_saved']} bytes saved so far)."
+                )
+                self.last_walk_complete = True
+                return
+            if not data or 'results' not in data:
+                logging.warning(f"OTX page {params.get('page')} could not be fetched. Stopping pagination.")
+                return
+            for pulse in data['results']:
+                suspended = time.monotonic()
+                yield pulse
+                if deadline is not None:
+                    deadline += time.monotonic() - suspended
+
+            next_url = data.get('next')
+            if not next_url:
+                self.last_walk_complete = True
+                return
+            # Re-request the same endpoint with the next page's query so base_url stays in control
+            params = dict(parse_qsl(urlparse(next_url).query))
+            if self.sort:
+                params.setdefault("sort", self.sort)
+            if deadline is not None and time.monotonic() >= deadline:
+                logging.warning("AlienVault OTX deadline reached. Stopping pagination.")
+                return
+
+    def iter_indicators(self, backfill=False, deadline=None):
+        """
+        Generator yielding IOCRecords as each pulse is parsed, walking all pages of pulses
+        modified since the persisted cursor (or the whole subscription if `backfill`).
+        The cursor only advances when commit() is called after a completed walk, so an
+        interrupted run, or one whose records were lost before they were stored, is retried.
+        An interrupted walk is checkpointed by commit() at its first unread page instead, and
+        the next call resumes it there, so a walk longer than one deadline still completes.
+        A lookback walk (no cursor yet) starts at a new time on every call, so it is never
+        conditional; once it completes, its start is kept as the cursor even if it found nothing.
+        """
+        walk = self.load_walk()
+        if walk is not None and backfill and walk.get("modified_since") is not None:
+            walk = None # Only a backfill is resumed as a backfill
+        lookback = False
+        if walk is not None:
+            modified_since = walk.get("modified_since")
+            logging.info(f"Resuming the AlienVault OTX walk of pulses modified since {modified_since or 'the beginning'} "
+                         f"at page {walk['params'].get('page')}...")
+        elif backfill:
+            modified_since = None
+        else:
+            modified_since = self.load_cursor()
+            if modified_since is None and self.initial_lookback_days:
+                lookback_start = datetime.now(timezone.utc) - timedelta(days=self.initial_lookback_days)
+                modified_since = lookback_start.strftime('%Y-%m-%dT%H:%M:%S')
+                lookback = True
+        if walk is None:
+            logging.info(f"Fetching AlienVault OTX pulses modified since {modified_since or 'the beginning (full backfill)'}...")
+
+        self._pending_cursor = None
+        self._pending_walk = None
+        self._next_page_params = None
+        created = now_timestamp()
+        high_water_raw = walk.get("high_water") if walk is not None else modified_since
+        high_water_mark = _parse_otx_time(high_water_raw)
+        pulse_count = 0
+        resume_params = walk["params"] if walk is not None else None
+        for pulse in self.iter_pulses(modified_since, deadline, resume_params, conditional=not lookback):
+            pulse_count += 1
+            pulse_modified = _parse_otx_time(pulse.get('modified'))
+            if pulse_modified and (high_water_mark is None or pulse_modified > high_water_mark):
+                high_water_mark = pulse_modified
+                high_water_raw = pulse.get('modified')
+            yield from pulse_to_records(pulse, created)
+
+        if self.last_walk_complete:
+            if high_water_raw and (high_water_raw != modified_since or lookback):
+                self._pending_cursor = high_water_raw
+            logging.info(f"Processed {pulse_count} OTX pulses. Cursor moves to {high_water_raw} once they are stored.")
+        elif pulse_count and self._next_page_params is not None:
+            self._pending_walk = {"modified_since": modified_since, "params": self._next_page_params, "high_water": high_water_raw}
+            logging.warning(f"OTX walk interrupted after {pulse_count} pulses. It resumes at page "
+                            f"{self._next_page_params.get('page')} once they are stored.")
+        else:
+            logging.warning(f"OTX walk interrupted after {pulse_count} pulses. Cursor left at {modified_since}.")
+
+    def commit(self):
+        """
+        Persists the cursor and HTTP validators of the last completed walk. Callers invoke
+        this once its records are durably stored (e.g. spooled to the outbox): until then a
+        crash, or a run abandoned at its deadline, makes the next walk fetch the same pulses
+        again instead of skipping them. Returns False if the last walk did not complete;
+        its checkpoint, if it got past the page it started at, is persisted instead.
+        """
+        if not self.last_walk_complete:
+            if self._pending_walk:
+                self.save_walk(self._pending_walk)
+                logging.info(f"AlienVault OTX walk checkpointed at page {self._pending_walk['params'].get('page')}.")
+                self._pending_walk = None
+            return False
+        if self._pending_cursor:
+            self.save_cursor(self._pending_cursor)
+            logging.info(f"AlienVault OTX cursor now at {self._pending_cursor}.")
+            self._pending_cursor = None
+        elif self.load_walk() is not None:
+            self.save_cursor(self.load_cursor()) # The resumed walk is done
+        self.client.commit_validators()
+        return True
@@ -0,0 +1,259 @@
+# outbox.py
+# Durable on-disk outbox between the fetchers and the TAXII publisher: an append-only spool of
+# NDJSON segment files plus a checkpoint, drained in batches by a background publisher worker
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+from ioc_record import item_to_json_line, item_from_json_line
+from metrics import OUTBOX_PENDING_BYTES, STAGE_ITEMS
+
+SEGMENT_NAME = re.compile(r"^segment-(\d{12})\.ndjson$")
+
+class Outbox:
+    """
+    Append-only spool in `spool_dir`. Items are written as JSON lines to numbered segment
+    files, rolling over at `segment_max_bytes`; checkpoint.json records the (segment, offset)
+    of the first unpublished line. A segment is deleted once the checkpoint moves past it.
+
+    Every process writes to a fresh segment, so a line torn by a crash is never appended to
+    and is skipped on read. When more than `max_pending_bytes` are waiting to be published,
+    append() blocks for up to `backpressure_timeout` seconds for the worker to catch up,
+    then writes anyway rather than lose data.
+    """
+
+    def __init__(self, spool_dir, segment_max_bytes=16_000_000, max_pending_bytes=1_000_000_000,
+                 backpressure_timeout=60, fsync=True):
+        self.spool_dir = spool_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.max_pending_bytes = max_pending_bytes
+        self.backpressure_timeout = backpressure_timeout
+        self.fsync = fsync
+        self.checkpoint_path = os.path.join(spool_dir, "checkpoint.json")
+        os.makedirs(spool_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._appended = threading.Event()
+        self._checkpoint = self._load_checkpoint()
+
+        segments = self._segments()
+        self._write_seq = max(segments[-1] if segments else 0, self._checkpoint[0]) + 1
+        self._write_file = None
+        self._write_bytes = 0
+        self._pending_bytes = self._bytes_after(self._checkpoint)
+        OUTBOX_PENDING_BYTES.set(self._pending_bytes)
+        if self._pending_bytes:
+            logging.info(f"Outbox has {self._pending_bytes} bytes left to publish from a previous run.")
+
+    def _segment_path(self, seq):
+        return os.path.join(self.spool_dir, f"segment-{seq:012d}.ndjson")
+
+    def _segments(self):
+        return sorted(int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(self.spool_dir)) if match)
+
+    def _bytes_after(self, position):
+        """Bytes on disk from `position` to the end of the spool."""
+        seq, offset = position
+        return max(sum(os.path.getsize(self._segment_path(s)) for s in self._segments() if s >= seq) - offset, 0)
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return (0, 0)
+        try:
+            with open(self.checkpoint_path) as f:
+                data = json.load(f)
+            return (data["segment"], data["offset"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not read outbox checkpoint from {self.checkpoint_path}: {e}. Replaying the whole spool.")
+            return (0, 0)
+
+    def _save_checkpoint(self, position):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    @property
+    def pending_bytes(self):
+        with self._lock:
+            return self._pending_bytes
+
+    def append(self, items):
+        """Durably spools an iterable of IOCRecords or STIX objects. Returns the number written."""
+        data = "".join(item_to_json_line(item) for item in items).encode("utf-8")
+        if not data:
+            return 0
+        count = data.count(b"\n")
+        with self._lock:
+            if self._pending_bytes > self.max_pending_bytes:
+                logging.warning(f"Outbox holds {self._pending_bytes} unpublished bytes. Waiting for the publisher to catch up...")
+                if not self._drained.wait_for(lambda: self._pending_bytes <= self.max_pending_bytes, self.backpressure_timeout):
+                    logging.warning("Outbox is still over its limit. Spooling anyway so no data is lost.")
+            if self._write_file is not None and self._write_bytes and self._write_bytes + len(data) > self.segment_max_bytes:
+                self._write_file.close()
+                self._write_file = None
+                self._write_seq += 1
+            if self._write_file is None:
+                self._write_file = open(self._segment_path(self._write_seq), "ab")
+                self._write_bytes = self._write_file.tell()
+            self._write_file.write(data)
+            self._write_file.flush()
+            if self.fsync:
+                os.fsync(self._write_file.fileno())
+            self._write_bytes += len(data)
+            self._pending_bytes += len(data)
+            OUTBOX_PENDING_BYTES.set(self._pending_bytes)
+        STAGE_ITEMS.inc(count, stage="spool", source="")
+        self._appended.set()
+        return count
+
+    def read_batch(self, max_items, decode=True):
+        """
+        Returns (items, position) with up to `max_items` unpublished items starting at the
+        checkpoint. Pass `position` to commit() once the batch has been published.
+        With `decode=False` the items are the raw JSON lines (bytes), left for the
+        publisher's conversion workers to parse.
+        """
+        with self._lock:
+            seq, offset = self._checkpoint
+            write_seq = self._write_seq
+        items = []
+        segments = [s for s in self._segments() if s >= seq]
+        for segment_seq in segments:
+            if segment_seq != seq:
+                seq, offset = segment_seq, 0
+            with open(self._segment_path(seq), "rb") as f:
+                f.seek(offset)
+                while len(items) < max_items:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break # End of segment, or a line torn by a crash
+                    offset += len(line)
+                    if not decode:
+                        items.append(line)
+                        continue
+                    try:
+                        items.append(item_from_json_line(line))
+                    except (ValueError, TypeError) as e:
+                        logging.error(f"Skipping unreadable outbox line in segment {seq}: {e}")
+            if len(items) >= max_items or seq >= write_seq:
+                break
+        return items, (seq, offset)
+
+    def commit(self, position):
+        """Advances the checkpoint to `position` and deletes segments that are fully published."""
+        with self._lock:
+            if position <= self._checkpoint:
+                return
+            self._save_checkpoint(position)
+            self._checkpoint = position
+            for seq in self._segments():
+                if seq >= position[0]:
+                    break
+                os.remove(self._segment_path(seq))
+            self._pending_bytes = self._bytes_after(position)
+            OUTBOX_PENDING_BYTES.set(self._pending_bytes)
+            self._drained.notify_all()
+
+    def wait_for_items(self, timeout):
+        """Blocks until something is appended, wake() is called or `timeout` passes."""
+        self._appended.wait(timeout)
+        self._appended.clear()
+
+    def wake(self):
+        self._appended.set()
+
+    def close(self):
+        with self._lock:
+            if self._write_file is not None:
+                self._write_file.close()
+                self._write_file = None
+
+class OutboxWorker:
+    """
+    Drains an Outbox into a TAXIIPublisher in batches of `batch_size` items. A batch is only
+    checkpointed once publish_objects() reports success; on failure the same batch is retried
+    after exponential backoff with full jitter (capped at `retry_max` seconds), so an outage
+    holds data in the spool instead of dropping it. Chunks of a partly failed batch that did
+    go out are skipped on retry by the publisher's seen store.
+    """
+
+    def __init__(self, outbox, publisher, batch_size=20000, poll_interval=5.0, retry_base=2.0, retry_max=300.0):
+        self.outbox = outbox
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish_next_batch(self):
+        """Publishes one batch. Returns the number of items published, 0 if empty, or None on failure."""
+        # Lines go to the publisher undecoded; its conversion workers parse them
+        items, position = self.outbox.read_batch(self.batch_size, decode=False)
+        if not items:
+            return 0
+        if not self.publisher.publish_objects(items):
+            return None
+        self.outbox.commit(position)
+        return len(items)
+
+    def drain(self, max_attempts=1):
+        """
+        Publishes until the outbox is empty, trying each batch up to `max_attempts` times.
+        Returns True if everything was published.
+        """
+        failures = 0
+        while not self._stop.is_set():
+            published = self.publish_next_batch()
+            if published == 0:
+                return True
+            if published is None:
+                failures += 1
+                if failures >= max_attempts:
+                    logging.error(f"Outbox drain stopped; {self.outbox.pending_bytes} bytes remain spooled for the next run.")
+                    return False
+                self._stop.wait(self._backoff(failures))
+            else:
+                failures = 0
+        return False
+
+    def _backoff(self, failures):
+        return random.uniform(0, min(self.retry_max, self.retry_base * (2 ** failures)))
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                published = self.publish_next_batch()
+            except Exception as e:
+                logging.error(f"Unexpected error in outbox worker: {e}")
+                published = None
+            if published is None:
+                failures += 1
+                wait_seconds = self._backoff(failures)
+                logging.warning(f"Publishing from the outbox failed ({failures} in a row). Retrying in {wait_seconds:.0f}s.")
+                self._stop.wait(wait_seconds)
+            elif published == 0:
+                failures = 0
+                self.outbox.wait_for_items(self.poll_interval)
+            else:
+                failures = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.outbox.wake()
+        if self._thread:
+            self._thread.join(timeout)
@@ -0,0 +1,82 @@
+# reputation_cache.py
+# Persistent TTL cache for IP reputation lookups, backed by SQLite
+
+import sqlite3
+import json
+import os
+import threading
+import time
+
+class ReputationCache:
+    """
+    Stores reputation results keyed by (ip, max_age_in_days) for `ttl_seconds`.
+    The database lives on a local volume so the cache survives container restarts.
+    A single connection is shared between worker threads and guarded by a lock.
+    Expired entries are purged on open and then at most once per TTL as new entries are
+    written, so the file holds about one TTL's worth of lookups.
+    """
+
+    def __init__(self, db_path, ttl_seconds):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reputation ("
+            " ip TEXT NOT NULL,"
+            " max_age_in_days INTEGER NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (ip, max_age_in_days))"
+        )
+        self._conn.commit()
+        self._next_purge = 0.0
+        self.purge_expired()
+
+    def get_many(self, ip_list, max_age_in_days):
+        """Returns {ip: data} for every IP with a cache entry younger than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        results = {}
+        with self._lock:
+            # Chunk the IN clause to stay under SQLite's bound-parameter limit
+            for i in range(0, len(ip_list), 500):
+                chunk = ip_list[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT ip, data FROM reputation WHERE max_age_in_days = ? AND fetched_at >= ? AND ip IN ({placeholders})",
+                    [max_age_in_days, cutoff, *chunk]
+                )
+                for ip, data in rows:
+                    results[ip] = json.loads(data)
+        return results
+
+    def put_many(self, entries, max_age_in_days):
+        """Stores {ip: data} entries, replacing any existing ones."""
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reputation (ip, max_age_in_days, fetched_at, data) VALUES (?, ?, ?, ?)",
+                [(ip, max_age_in_days, now, json.dumps(data)) for ip, data in entries.items()]
+            )
+            self._conn.commit()
+        if now >= self._next_purge:
+            self.purge_expired()
+
+    def purge_expired(self):
+        """Deletes entries older than the TTL. Returns the number of rows removed."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM reputation WHERE fetched_at < ?", (now - self.ttl_seconds,))
+            self._conn.commit()
+            self._next_purge = now + self.ttl_seconds
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
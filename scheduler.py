@@ -0,0 +1,179 @@
+# scheduler.py
+# Per-source scheduler: each source runs on its own interval with jitter, never overlaps
+# itself, keeps a fixed cadence regardless of run time and catches up after downtime
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Fraction of an interval a restarted job may come due early, so a cron schedule firing
+# exactly every interval is not thrown off by a few seconds of start-up variation
+DUE_TOLERANCE = 0.05
+
+class ScheduledJob:
+    """
+    One source's schedule. `run` is called with no arguments and returns True on success.
+    Slots are `interval` seconds apart and each run starts up to `jitter` seconds after its slot.
+    """
+
+    def __init__(self, name, run, interval, jitter=0):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.slot = None # Wall-clock time of the current slot, without jitter
+        self.next_run = None # Wall-clock time the job becomes due
+        self.running = False
+        self.last_success = None
+
+    def schedule(self, slot):
+        self.slot = slot
+        self.next_run = slot + random.uniform(0, self.jitter)
+
+    def advance(self, now):
+        """
+        Moves to the next slot after the one just run. Slots are counted from the previous
+        slot rather than from when the run finished, so a slow run does not push later runs back.
+        Slots missed while the run was in progress are skipped, not replayed.
+        """
+        slot = self.slot + self.interval
+        missed = 0
+        while slot <= now:
+            slot += self.interval
+            missed += 1
+        if missed:
+            logging.warning(f"{self.name} run overran its {self.interval:.0f}s interval. Skipping {missed} missed slot(s).")
+        self.schedule(slot)
+
+class SourceScheduler:
+    """
+    Runs jobs on a thread pool. A job that is still running when its next slot comes up is
+    not started again. The start time of each job's last successful run is persisted to
+    `state_path`, so after downtime a job whose interval has elapsed runs once straight away
+    instead of waiting for a full interval (missed runs are coalesced; the fetchers are
+    incremental). Counting from the start rather than the end of a run, with DUE_TOLERANCE,
+    keeps one-shot runs started by cron every `interval` seconds from skipping every other slot.
+    """
+
+    def __init__(self, state_path=None, max_workers=None):
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._state = self._load_state()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read scheduler state from {self.state_path}: {e}")
+            return {}
+
+    def _save_state(self):
+        """Atomically persists when each job's last successful run started. Caller holds the lock."""
+        if not self.state_path:
+            return
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def add_job(self, name, run, interval, jitter=0):
+        job = ScheduledJob(name, run, interval, jitter)
+        now = time.time()
+        job.last_success = self._state.get(name, {}).get("last_success")
+        if job.last_success is None:
+            job.schedule(now)
+        elif job.last_success + interval * (1 - DUE_TOLERANCE) <= now:
+            logging.info(f"{name} last ran {now - job.last_success:.0f}s ago (interval {interval:.0f}s). Catching up now.")
+            job.schedule(now)
+        else:
+            job.schedule(job.last_success + interval)
+        self.jobs[name] = job
+        return job
+
+    def _run_job(self, job):
+        started_at = time.time()
+        started = time.monotonic()
+        try:
+            ok = bool(job.run())
+        except Exception as e:
+            logging.error(f"Scheduled run of {job.name} failed: {e}")
+            ok = False
+        elapsed = time.monotonic() - started
+        with self._lock:
+            job.running = False
+            job.advance(time.time())
+            if ok:
+                job.last_success = started_at
+                self._state[job.name] = {"last_success": job.last_success}
+                self._save_state()
+        logging.info(f"{job.name} run {'succeeded' if ok else 'failed'} in {elapsed:.2f}s. "
+                     f"Next run in {max(job.next_run - time.time(), 0):.0f}s.")
+        self._wakeup.set()
+        return ok
+
+    def run_due(self, wait_for_completion=False, ignore_jitter=False):
+        """
+        Starts every due job that is not already running. Returns {job_name: future};
+        with `wait_for_completion=True` it blocks until those runs have finished.
+        `ignore_jitter=True` treats a job as due at its slot, for one-shot runs whose
+        timing is already chosen by cron.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers or max(1, len(self.jobs)),
+                                                thread_name_prefix="scheduler")
+        now = time.time()
+        futures = {}
+        with self._lock:
+            for job in self.jobs.values():
+                if (job.slot if ignore_jitter else job.next_run) > now:
+                    continue
+                if job.running:
+                    # Never overlap a source with itself; advance() skips this slot when the run ends
+                    continue
+                job.running = True
+                futures[job.name] = self._executor.submit(self._run_job, job)
+        if wait_for_completion and futures:
+            wait(futures.values())
+        return futures
+
+    def seconds_until_next(self):
+        with self._lock:
+            pending = [job.next_run for job in self.jobs.values() if not job.running]
+        if not pending:
+            return None
+        return max(min(pending) - time.time(), 0.0)
+
+    def run_forever(self):
+        """Runs jobs as they come due until stop() is called."""
+        for job in self.jobs.values():
+            logging.info(f"Scheduled {job.name} every {job.interval:.0f}s (jitter up to {job.jitter:.0f}s).")
+        while not self._stopping:
+            self._wakeup.clear()
+            self.run_due()
+            # Sleeps until the next job is due or a run finishes, whichever comes first
+            self._wakeup.wait(self.seconds_until_next())
+        self.shutdown()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
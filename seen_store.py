@@ -0,0 +1,150 @@
+# seen_store.py
+# Persistent fingerprint store of published STIX objects, used to publish only deltas
+
+import sqlite3
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Properties that change every cycle without changing what an object says
+VOLATILE_PROPERTIES = {"created", "modified", "valid_from"}
+
+def _as_dict(stix_object):
+    if hasattr(stix_object, "serialize"):
+        return json.loads(stix_object.serialize())
+    return dict(stix_object)
+
+def _now_timestamp():
+    now = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}Z"
+
+def restamp(stix_object, created):
+    """
+    Returns a changed object as a new version of the one first published with `created`:
+    STIX requires `created` to stay the same across versions, so only `modified` moves on.
+    """
+    stix_object = _as_dict(stix_object)
+    if "created" in stix_object:
+        stix_object["created"] = created
+        stix_object["modified"] = max(_now_timestamp(), created)
+    return stix_object
+
+def fingerprint(stix_object):
+    """Returns a SHA-256 hash of the object's semantic content (volatile timestamps excluded)."""
+    content = {key: value for key, value in _as_dict(stix_object).items() if key not in VOLATILE_PROPERTIES}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class SeenIndicatorStore:
+    """
+    Remembers the fingerprint last published for each STIX object id, so a publisher can
+    skip objects OpenTAXII already holds and only send new or changed ones. The `created`
+    of each object's first publish is kept too, so later versions can be restamped with it.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_objects ("
+            " object_id TEXT PRIMARY KEY,"
+            " fingerprint TEXT NOT NULL,"
+            " last_published REAL NOT NULL,"
+            " created TEXT)"
+        )
+        if "created" not in {row[1] for row in self._conn.execute("PRAGMA table_info(seen_objects)")}:
+            self._conn.execute("ALTER TABLE seen_objects ADD COLUMN created TEXT") # Stores from before `created` was kept
+        self._conn.commit()
+
+    def _select(self, column, object_ids):
+        known = {}
+        with self._lock:
+            # Chunk the IN clause to stay under SQLite's bound-parameter limit
+            for i in range(0, len(object_ids), 500):
+                chunk = object_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT object_id, {column} FROM seen_objects WHERE object_id IN ({placeholders}) AND {column} IS NOT NULL", chunk
+                )
+                known.update(rows)
+        return known
+
+    def _known_fingerprints(self, object_ids):
+        return self._select("fingerprint", object_ids)
+
+    def first_created(self, object_ids):
+        """Returns {object_id: created} of the first published version of each object published before."""
+        return self._select("created", list(object_ids))
+
+    def filter_changed(self, stix_objects):
+        """
+        Returns [(stix_object, fingerprint)] for objects that are new or whose content changed
+        since they were last published. Duplicates within the input are dropped.
+        """
+        candidates = {}
+        for stix_object in stix_objects:
+            candidates[stix_object["id"]] = (stix_object, fingerprint(stix_object))
+
+        known = self._known_fingerprints(list(candidates))
+        return [
+            (stix_object, object_fingerprint)
+            for object_id, (stix_object, object_fingerprint) in candidates.items()
+            if known.get(object_id) != object_fingerprint
+        ]
+
+    def filter_changed_ids(self, fingerprints):
+        """
+        Same as filter_changed() for fingerprints computed elsewhere: takes {object_id: fingerprint}
+        and returns the entries that are new or changed, in input order.
+        """
+        known = self._known_fingerprints(list(fingerprints))
+        return {object_id: object_fingerprint for object_id, object_fingerprint in fingerprints.items()
+                if known.get(object_id) != object_fingerprint}
+
+    def mark_published(self, fingerprinted_objects):
+        """Records [(stix_object, fingerprint)] pairs as successfully published."""
+        fingerprints, created = {}, {}
+        for stix_object, object_fingerprint in fingerprinted_objects:
+            stix_object = _as_dict(stix_object) # As serialized, for stix2 objects
+            fingerprints[stix_object["id"]] = object_fingerprint
+            if "created" in stix_object:
+                created[stix_object["id"]] = stix_object["created"]
+        self.mark_published_ids(fingerprints, created)
+
+    def mark_published_ids(self, fingerprints, created=None):
+        """
+        Records {object_id: fingerprint} as successfully published. `created` maps object ids
+        to their `created`; it is only stored for an object's first publish.
+        """
+        now = time.time()
+        created = created or {}
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO seen_objects (object_id, fingerprint, last_published, created) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (object_id) DO UPDATE SET fingerprint = excluded.fingerprint,"
+                " last_published = excluded.last_published, created = COALESCE(seen_objects.created, excluded.created)",
+                [(object_id, object_fingerprint, now, created.get(object_id)) for object_id, object_fingerprint in fingerprints.items()]
+            )
+            self._conn.commit()
+
+    def forget(self, object_ids):
+        """Drops the fingerprints of objects that no longer need delta tracking (e.g. expired Indicators)."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM seen_objects WHERE object_id = ?", [(object_id,) for object_id in object_ids])
+            self._conn.commit()
+
+    def compact(self):
+        """Truncates the WAL file after large deletions."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
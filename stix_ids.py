@@ -0,0 +1,27 @@
+# stix_ids.py
+# Deterministic STIX identifiers so the same IOC keeps the same id across collection cycles
+
+import json
+import uuid
+
+# Namespace defined by STIX 2.1 for deterministic Cyber-observable Object ids
+SCO_NAMESPACE = uuid.UUID("00abedb4-aa42-466c-9c01-fed23315a9b7")
+# Namespace for this collector's Indicator ids
+INDICATOR_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/nottherealslimshady/cti_taxi_hub/indicator")
+
+def observable_id(stix_type, value, hashes=None):
+    """
+    Returns the STIX 2.1 deterministic id for an observable: a UUIDv5 over its
+    ID-contributing properties (`hashes` for files, `value` for everything else).
+    """
+    contributing = {"hashes": hashes} if stix_type == "file" and hashes else {"value": value}
+    canonical = json.dumps(contributing, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{stix_type}--{uuid.uuid5(SCO_NAMESPACE, canonical)}"
+
+def indicator_id(source, ioc_type, value):
+    """Returns a stable Indicator id derived from the reporting source, IOC type and value."""
+    return f"indicator--{uuid.uuid5(INDICATOR_NAMESPACE, f'{source}|{ioc_type}|{value}')}"
+
+def value_indicator_id(stix_type, value):
+    """Returns a stable Indicator id for an observable value, whichever sources report it."""
+    return f"indicator--{uuid.uuid5(INDICATOR_NAMESPACE, f'{stix_type}|{value}')}"
@@ -0,0 +1,129 @@
+# stix_shards.py
+# Converts IOC records (or raw outbox lines) into compact STIX JSON fragments, in shards spread
+# over a process pool so conversion and serialization use every core instead of one
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from ioc_record import item_from_json_line, iter_stix_dicts
+from metrics import STAGE_DURATION, STAGE_ITEMS
+from seen_store import fingerprint
+
+def serialize_compact(stix_object):
+    """Serializes a stix2 object or plain dict as compact JSON."""
+    if hasattr(stix_object, "serialize"):
+        return stix_object.serialize()
+    return json.dumps(stix_object, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def _decode_items(items):
+    for item in items:
+        if isinstance(item, (bytes, str)):
+            try:
+                item = item_from_json_line(item)
+            except (ValueError, TypeError) as e:
+                logging.error(f"Skipping unreadable outbox line: {e}")
+                continue
+        yield item
+
+def serialize_shard(items, validate=False, with_fingerprints=False):
+    """
+    Converts one shard of IOCRecords, STIX objects or outbox lines into
+    [(object_id, fingerprint, fragment, created)] in input order; fingerprint and created
+    are None unless `with_fingerprints`. Returns (results, convert_seconds, serialize_seconds).
+    Runs in a worker process, so it takes and returns only picklable values.
+    """
+    results = []
+    convert_seconds = serialize_seconds = 0.0
+    stix_iter = iter_stix_dicts(_decode_items(items), validate)
+    while True:
+        # Time record -> STIX conversion and JSON serialization separately
+        started = time.perf_counter()
+        stix_object = next(stix_iter, None)
+        converted = time.perf_counter()
+        convert_seconds += converted - started
+        if stix_object is None:
+            break
+        fragment = serialize_compact(stix_object)
+        object_fingerprint = created = None
+        if with_fingerprints:
+            object_fingerprint = fingerprint(stix_object)
+            # stix2 objects hold a datetime; the serialized form is what gets published
+            created = stix_object.get("created") if isinstance(stix_object, dict) else json.loads(fragment).get("created")
+        serialize_seconds += time.perf_counter() - converted
+        results.append((stix_object["id"], object_fingerprint, fragment, created))
+    return results, convert_seconds, serialize_seconds
+
+class ShardedSerializer:
+    """
+    Splits a stream of items into shards of `shard_size` and serializes them with
+    serialize_shard() on `workers` processes (0 = one per CPU). Results are yielded in
+    input order, so the fragments are identical to a serial run with workers=1. At most
+    two shards per worker are in flight, keeping memory bounded on long streams.
+    The pool is only started once a stream is longer than one shard and is then reused.
+    """
+
+    def __init__(self, workers=1, shard_size=2000):
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = max(1, shard_size)
+        self._pool = None
+
+    def _shards(self, items):
+        shard = []
+        for item in items:
+            shard.append(item)
+            if len(shard) >= self.shard_size:
+                yield shard
+                shard = []
+        if shard:
+            yield shard
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Imported here so runs that never need a pool don't pay for multiprocessing at startup
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn rather than fork: the collector is multi-threaded by the time it publishes
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            logging.info(f"Started {self.workers} STIX conversion worker processes.")
+        return self._pool
+
+    @staticmethod
+    def _record_shard(shard_result):
+        results, convert_seconds, serialize_seconds = shard_result
+        STAGE_DURATION.observe(convert_seconds, stage="convert", source="")
+        STAGE_DURATION.observe(serialize_seconds, stage="serialize", source="")
+        STAGE_ITEMS.inc(len(results), stage="serialize", source="")
+        return results
+
+    def iter_serialized(self, items, validate=False, with_fingerprints=False):
+        """Yields (object_id, fingerprint, fragment, created) for every STIX object the items produce, in order."""
+        shards = self._shards(items)
+        first = next(shards, None)
+        if first is None:
+            return
+        if self.workers <= 1:
+            yield from self._record_shard(serialize_shard(first, validate, with_fingerprints))
+            for shard in shards:
+                yield from self._record_shard(serialize_shard(shard, validate, with_fingerprints))
+            return
+
+        second = next(shards, None)
+        if second is None:
+            # A single shard is cheaper to do here than to ship to a worker
+            yield from self._record_shard(serialize_shard(first, validate, with_fingerprints))
+            return
+        pool = self._get_pool()
+        pending = deque(pool.submit(serialize_shard, shard, validate, with_fingerprints) for shard in (first, second))
+        for shard in shards:
+            if len(pending) >= 2 * self.workers:
+                yield from self._record_shard(pending.popleft().result())
+            pending.append(pool.submit(serialize_shard, shard, validate, with_fingerprints))
+        while pending:
+            yield from self._record_shard(pending.popleft().result())
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
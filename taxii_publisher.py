@@ -2,15 +2,63 @@
 # Publishes STIX 2.x bundles to an OpenTAXII 1.x Inbox service
 
 import requests
-import json
-from stix2 import Bundle # Added Bundle import
+from requests.adapters import HTTPAdapter
+import gzip
 import logging
+import random
 import time
+import json
+import uuid
+from metrics import STAGE_ITEMS, PUBLISHED_CHUNK_BYTES, PUBLISHED_BYTES, stage_timer
+from seen_store import restamp
+from stix_shards import ShardedSerializer, serialize_compact
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from xml.sax.saxutils import escape
+
+TAXII_HEADERS = {
+    "Content-Type": "application/xml", # TAXII 1.x typically expects XML
+    "X-TAXII-Content-Type": "urn:taxii.mitre.org:message:xml:1.0",
+    "X-TAXII-Accept": "urn:taxii.mitre.org:message:xml:1.0",
+    "X-TAXII-Services": "urn:taxii.mitre.org:services:1.0"
+}
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def _build_taxii_message(collection_id, stix_json, message_id):
+    """Wraps serialized STIX JSON in a basic TAXII 1.x Inbox message with one Content Block."""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<taxii_10:Taxii_Message xmlns:taxii_10="http://taxii.mitre.org/messages/taxii_1.0/"
+    xmlns:taxii="http://taxii.mitre.org/messages/taxii_xml_binding-1"
+    xmlns:tdq="http://taxii.mitre.org/query/taxii_default_query_1.0/"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    message_id="{message_id}"
+    in_response_to="None">
+    <taxii_10:Inbox_Message>
+        <taxii_10:Destination_Collection_Name>{escape(collection_id)}</taxii_10:Destination_Collection_Name>
+        <taxii_10:Content_Block>
+            <taxii_10:Content_Binding binding_id="urn:stix.mitre.org:json:2.1"/>
+            <taxii_10:Content>{escape(stix_json)}</taxii_10:Content>
+        </taxii_10:Content_Block>
+    </taxii_10:Inbox_Message>
+</taxii_10:Taxii_Message>
+"""
 
 class TAXIIPublisher:
-    def __init__(self, server_url, collection_id, username, password):
+    def __init__(self, server_url, collection_id, username, password, seen_store=None,
+                 chunk_max_bytes=5_000_000, chunk_max_objects=5000, gzip_body=False,
+                 max_parallel_chunks=2, chunk_retries=3, timeout=(10, 120), validate_stix=False,
+                 conversion_workers=1, conversion_shard_size=2000):
+        """
+        `seen_store` is an optional SeenIndicatorStore; when given, only objects that are new
+        or changed since their last successful publish are sent.
+        publish_objects splits objects into Inbox messages of at most `chunk_max_objects`
+        objects / roughly `chunk_max_bytes` of JSON, optionally gzips them, and sends up to
+        `max_parallel_chunks` at once, retrying each failed chunk up to `chunk_retries` times.
+        `timeout` is the (connect, read) timeout of every POST, so a hung Inbox fails the
+        request (and the chunk is retried) instead of blocking the publisher worker.
+        With `validate_stix` every object emitted from an IOCRecord is validated with stix2 first.
+        Conversion to STIX JSON runs on `conversion_workers` processes (0 = one per CPU) in
+        shards of `conversion_shard_size` items; the output is the same for any worker count.
+        """
         self.server_url = server_url
         self.collection_id = collection_id
         self.username = username
@@ -18,6 +66,19 @@ class TAXIIPublisher:
         self.inbox_url = f"{self.server_url}/services/inbox" # Default OpenTAXII Inbox path
         self.session = requests.Session()
         self.session.auth = (self.username, self.password)
+        self.seen_store = seen_store
+        self.chunk_max_bytes = chunk_max_bytes
+        self.chunk_max_objects = chunk_max_objects
+        self.gzip_body = gzip_body
+        self.max_parallel_chunks = max(1, max_parallel_chunks)
+        self.chunk_retries = chunk_retries
+        self.timeout = timeout
+        self.validate_stix = validate_stix
+        self.serializer = ShardedSerializer(conversion_workers, conversion_shard_size)
+        # Keep one pooled connection per parallel chunk so POSTs reuse TCP connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_parallel_chunks)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def publish_bundle(self, stix_bundle):
         """
@@ -25,42 +86,38 @@ class TAXIIPublisher:
         OpenTAXII 1.x Inbox expects a TAXII Message (XML) containing STIX.
         For simplicity, we'll send the STIX bundle wrapped in a basic TAXII 1.x Content Block XML.
         """
+        from stix2 import Bundle # Heavy import; only this legacy single-bundle path needs it
         if not isinstance(stix_bundle, Bundle):
             stix_bundle = Bundle(stix_bundle) # Ensure it's a Bundle
 
+        fingerprinted_objects = None
+        if self.seen_store is not None:
+            fingerprinted_objects = self.seen_store.filter_changed(stix_bundle.objects)
+            unchanged = len(stix_bundle.objects) - len(fingerprinted_objects)
+            if not fingerprinted_objects:
+                logging.info(f"All {unchanged} STIX objects are unchanged since their last publish. Nothing to send.")
+                return True
+            logging.info(f"Skipping {unchanged} unchanged STIX objects; {len(fingerprinted_objects)} are new or changed.")
+            first_created = self.seen_store.first_created(stix_object["id"] for stix_object, _ in fingerprinted_objects)
+            fingerprinted_objects = [
+                (restamp(stix_object, first_created[stix_object["id"]]) if stix_object["id"] in first_created else stix_object, object_fingerprint)
+                for stix_object, object_fingerprint in fingerprinted_objects
+            ]
+            stix_bundle = Bundle([stix_object for stix_object, _ in fingerprinted_objects], allow_custom=True)
+
         stix_json = stix_bundle.serialize(pretty=True)
         logging.info(f"Attempting to publish STIX bundle with {len(stix_bundle.objects)} objects.")
 
-        # Construct a basic TAXII 1.x message for the Inbox service
-        taxii_message = f"""<?xml version="1.0" encoding="UTF-8"?>
-<taxii_10:Taxii_Message xmlns:taxii_10="http://taxii.mitre.org/messages/taxii_1.0/"
-    xmlns:taxii="http://taxii.mitre.org/messages/taxii_xml_binding-1"
-    xmlns:tdq="http://taxii.mitre.org/query/taxii_default_query_1.0/"
-    xmlns:stix="http://stix.mitre.org/stix-1"
-    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-    message_id="{int(time.time() * 1000)}"
-    in_response_to="None">
-    <taxii_10:Inbox_Message>
-        <taxii_10:Destination_Collection_Name>{self.collection_id}</taxii_10:Destination_Collection_Name>
-        <taxii_10:Content_Block>
-            <taxii_10:Content_Binding binding_id="urn:stix.mitre.org:json:2.1"/>
-            <taxii_10:Content>{stix_json}</taxii_10:Content>
-        </taxii_10:Content_Block>
-    </taxii_10:Inbox_Message>
-</taxii_10:Taxii_Message>
-"""
-        headers = {
-            "Content-Type": "application/xml", # TAXII 1.x typically expects XML
-            "X-TAXII-Content-Type": "urn:taxii.mitre.org:message:xml:1.0",
-            "X-TAXII-Accept": "urn:taxii.mitre.org:message:xml:1.0",
-            "X-TAXII-Services": "urn:taxii.mitre.org:services:1.0"
-        }
+        taxii_message = _build_taxii_message(self.collection_id, stix_json, int(time.time() * 1000))
+        headers = TAXII_HEADERS
 
         try:
-            response = self.session.post(self.inbox_url, data=taxii_message.encode('utf-8'), headers=headers)
+            response = self.session.post(self.inbox_url, data=taxii_message.encode('utf-8'), headers=headers, timeout=self.timeout)
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
 
             logging.info(f"Successfully published STIX bundle to OpenTAXII Inbox. Status: {response.status_code}")
+            if fingerprinted_objects is not None:
+                self.seen_store.mark_published(fingerprinted_objects)
             logging.debug(f"OpenTAXII Response: {response.text}")
             return True
         except requests.exceptions.HTTPError as e:
@@ -69,3 +126,122 @@ class TAXIIPublisher:
         except requests.exceptions.RequestException as e:
             logging.error(f"Request error publishing to OpenTAXII: {e}")
             return False
+
+    def _iter_chunks(self, stix_objects):
+        """
+        Lazily groups serialized objects into chunks bounded by chunk_max_objects and
+        chunk_max_bytes. Yields lists of (object_id, fingerprint, fragment, created).
+        """
+        chunk, chunk_bytes = [], 0
+        serialized = self.serializer.iter_serialized(stix_objects, self.validate_stix, self.seen_store is not None)
+        for entry in serialized:
+            fragment_bytes = len(entry[2].encode("utf-8"))
+            if chunk and (
+                (self.chunk_max_objects and len(chunk) >= self.chunk_max_objects)
+                or (self.chunk_max_bytes and chunk_bytes + fragment_bytes > self.chunk_max_bytes)
+            ):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(entry)
+            chunk_bytes += fragment_bytes + 1
+        if chunk:
+            yield chunk
+
+    def _send_chunk(self, chunk_index, fragments):
+        """POSTs one chunk as its own Inbox message, retrying with backoff. Returns True on success."""
+        stix_json = f'{{"type":"bundle","id":"bundle--{uuid.uuid4()}","objects":[{",".join(fragments)}]}}'
+        message_id = f"{int(time.time() * 1000)}-{chunk_index}"
+        body = _build_taxii_message(self.collection_id, stix_json, message_id).encode('utf-8')
+        headers = dict(TAXII_HEADERS)
+        if self.gzip_body:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        PUBLISHED_CHUNK_BYTES.observe(len(body))
+        for attempt in range(self.chunk_retries + 1):
+            try:
+                with stage_timer("publish"):
+                    response = self.session.post(self.inbox_url, data=body, headers=headers, timeout=self.timeout)
+                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                logging.debug(f"Published chunk {chunk_index} ({len(fragments)} objects, {len(body)} bytes).")
+                PUBLISHED_BYTES.inc(len(body))
+                STAGE_ITEMS.inc(len(fragments), stage="publish", source="")
+                return True
+            except requests.exceptions.HTTPError as e:
+                logging.warning(f"HTTP error publishing chunk {chunk_index} (attempt {attempt + 1}): {e.response.status_code} - {e.response.text}")
+            except requests.exceptions.Timeout as e:
+                logging.warning(f"Timed out publishing chunk {chunk_index} (attempt {attempt + 1}): {e}")
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Request error publishing chunk {chunk_index} (attempt {attempt + 1}): {e}")
+            if attempt < self.chunk_retries:
+                time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+        logging.error(f"Giving up on chunk {chunk_index} after {self.chunk_retries + 1} attempts.")
+        return False
+
+    def _publish_chunk(self, chunk_index, chunk):
+        """
+        Filters a chunk through the seen store, sends what changed and records it. A changed
+        object published before keeps its first `created` and gets a new `modified`.
+        Returns (sent, ok).
+        """
+        changed = None
+        if self.seen_store is not None:
+            # Duplicate ids collapse to their last occurrence, as in SeenIndicatorStore.filter_changed
+            latest = {}
+            for object_id, object_fingerprint, fragment, created in chunk:
+                latest[object_id] = (object_fingerprint, fragment, created)
+            changed = self.seen_store.filter_changed_ids({object_id: entry[0] for object_id, entry in latest.items()})
+            if not changed:
+                return 0, True
+            first_created = self.seen_store.first_created(changed)
+            fragments = [
+                serialize_compact(restamp(json.loads(latest[object_id][1]), first_created[object_id]))
+                if object_id in first_created else latest[object_id][1]
+                for object_id in changed
+            ]
+            created = {object_id: latest[object_id][2] for object_id in changed if latest[object_id][2] is not None}
+        else:
+            fragments = [fragment for _, _, fragment, _ in chunk]
+
+        ok = self._send_chunk(chunk_index, fragments)
+        if ok and changed is not None:
+            self.seen_store.mark_published_ids(changed, created)
+        return len(fragments), ok
+
+    def publish_objects(self, stix_objects):
+        """
+        Publishes an iterable of IOCRecords, STIX objects (stix2 objects or dicts) or raw outbox
+        lines as a stream of bounded Inbox messages. Objects are serialized compactly as they are consumed and
+        at most max_parallel_chunks chunks are in flight, so memory stays flat regardless
+        of how many objects there are. A failed chunk is retried on its own and does not
+        affect the others. Returns True only if every chunk was published.
+        """
+        chunks_total = chunks_failed = objects_sent = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_parallel_chunks, thread_name_prefix="taxii-publish")
+        in_flight = set()
+        try:
+            for chunk in self._iter_chunks(stix_objects):
+                if len(in_flight) >= self.max_parallel_chunks:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        sent, ok = future.result()
+                        objects_sent += sent
+                        chunks_failed += not ok
+                in_flight.add(executor.submit(self._publish_chunk, chunks_total, chunk))
+                chunks_total += 1
+            for future in in_flight:
+                sent, ok = future.result()
+                objects_sent += sent
+                chunks_failed += not ok
+        finally:
+            executor.shutdown(wait=True)
+
+        if chunks_failed:
+            logging.error(f"Failed to publish {chunks_failed} of {chunks_total} chunks to OpenTAXII.")
+            return False
+        logging.info(f"Published {objects_sent} STIX objects to OpenTAXII in {chunks_total} chunks.")
+        return True
+
+    def close(self):
+        """Stops the conversion worker processes, if any were started."""
+        self.serializer.close()
@@ -0,0 +1,98 @@
+# test_archive.py
+# Reading the archive back by time range, type and source through its block index
+
+import json
+import pytest
+from archive import ArchiveReader, IndicatorArchive
+from ioc_record import IOCRecord
+from stix_ids import value_indicator_id
+
+def _record(source, n, valid_from):
+    return IOCRecord.from_source_type(source, "IPv4", f"192.0.2.{n}", f"Record {n}", valid_from=valid_from)
+
+def _records():
+    # Two sources within one hour, at three distinct times, plus one record in the next hour
+    return [_record("AlienVault OTX", 1, "2026-01-01T05:10:00Z"), _record("AlienVault OTX", 2, "2026-01-01T05:20:00Z"),
+            _record("AbuseIPDB", 3, "2026-01-01T05:10:00Z"), _record("AbuseIPDB", 4, "2026-01-01T05:30:00Z"),
+            _record("AlienVault OTX", 5, "2026-01-01T06:00:00Z")]
+
+def _archived_dicts(record):
+    # Each report is archived under the value Indicator id the merged record is published with
+    observable, indicator = record.to_stix_dicts()
+    return [observable, dict(indicator, id=value_indicator_id(record.stix_type, record.value))]
+
+def _values(objects):
+    return sorted(stix_object["value"] for stix_object in objects if stix_object["type"] == "ipv4-addr")
+
+@pytest.mark.parametrize("compression", ["", "gzip"])
+def test_round_trip_with_time_range_type_and_source_filters(tmp_path, compression):
+    archive = IndicatorArchive(str(tmp_path), compression=compression)
+    records = _records()
+    assert archive.append(records) == 2 * len(records)
+    reader = ArchiveReader(str(tmp_path))
+
+    everything = list(reader.iter_objects())
+    assert sorted(json.dumps(o, sort_keys=True) for o in everything) == \
+        sorted(json.dumps(o, sort_keys=True) for record in records for o in _archived_dicts(record))
+    assert len(reader.segments()) == 2
+    assert len(reader.segments("2026-01-01T06:00:00Z")) == 1
+
+    assert _values(reader.iter_objects("2026-01-01T05:15:00Z", "2026-01-01T05:30:00Z")) == ["192.0.2.2"]
+    assert _values(reader.iter_objects("2026-01-01T05:10:00Z", "2026-01-01T05:30:00.001Z")) == \
+        ["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"]
+    assert _values(reader.iter_objects(end="2026-01-01T05:10:00Z")) == []
+    assert _values(reader.iter_objects(sources=["AbuseIPDB"])) == ["192.0.2.3", "192.0.2.4"]
+    assert {o["type"] for o in reader.iter_objects(types=["indicator"])} == {"indicator"}
+    assert len(list(reader.iter_objects(types=["indicator"], sources=["AlienVault OTX"]))) == 3
+
+@pytest.mark.parametrize("compression", ["", "gzip"])
+def test_blocks_outside_the_filters_are_never_read(tmp_path, compression):
+    archive = IndicatorArchive(str(tmp_path), compression=compression)
+    archive.append(_records())
+    reader = ArchiveReader(str(tmp_path))
+    segment = reader.segments(end="2026-01-01T06:00:00Z")[0]
+
+    # Overwrite every AbuseIPDB block and every Indicator block; reading them back would fail to parse
+    with open(segment, "r+b") as f:
+        for entry in reader._read_index(segment):
+            if entry["source"] == "AbuseIPDB" or entry["type"] == "indicator":
+                f.seek(entry["offset"])
+                f.write(b"\xff" * entry["length"])
+
+    objects = list(reader.iter_objects(types=["ipv4-addr"], sources=["AlienVault OTX"]))
+    assert _values(objects) == ["192.0.2.1", "192.0.2.2", "192.0.2.5"]
+    # The time range alone skips an AbuseIPDB block whose reports all fall before it
+    assert list(reader.iter_lines("2026-01-01T05:45:00Z", types=["ipv4-addr"])) == \
+        [line for line in reader.iter_lines(types=["ipv4-addr"], sources=["AlienVault OTX"]) if b"192.0.2.5" in line]
+
+def _indicator_ids(items):
+    objects = [o for item in items for o in (item.to_stix_dicts() if isinstance(item, IOCRecord) else [item])]
+    return {o["id"] for o in objects if o["type"] == "indicator"}
+
+def test_archived_indicators_carry_the_published_ids(tmp_path, monkeypatch):
+    import time
+    from lifecycle import IndicatorLifecycle, TTLPolicy
+    from main import expire_indicators, process_batch
+    from outbox import Outbox
+    archive = IndicatorArchive(str(tmp_path / "archive"))
+    lifecycle = IndicatorLifecycle(str(tmp_path / "lifecycle.sqlite3"), TTLPolicy({("AlienVault OTX", "ipv4-addr"): 1, ("AbuseIPDB", "ipv4-addr"): 1}))
+    outbox = Outbox(str(tmp_path / "outbox"), fsync=False)
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    for source in ("AlienVault OTX", "AbuseIPDB"):
+        process_batch(source, [_record(source, 1, now), _record(source, 2, now)], outbox, archive=archive, lifecycle=lifecycle)
+    published = _indicator_ids(outbox.read_batch(100)[0])
+    reader = ArchiveReader(str(tmp_path / "archive"))
+    assert {o["id"] for o in reader.iter_objects(types=["indicator"])} == published
+    assert len(published) == 2
+    assert {o["id"] for o in reader.iter_objects(types=["indicator"], sources=["AbuseIPDB"])} == published
+
+    # A day later both values expire; the valid_until updates are archived under the same ids
+    later = time.time() + 2 * 86400
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert expire_indicators(lifecycle, outbox, archive=archive)
+    updates = [o for o in reader.iter_objects(types=["indicator"]) if "valid_until" in o]
+    spooled = [item for item in outbox.read_batch(100)[0] if isinstance(item, dict) and "valid_until" in item]
+    assert {o["id"] for o in updates} == {o["id"] for o in spooled} == published
+    outbox.close()
+    lifecycle.close()
@@ -0,0 +1,37 @@
+# test_collect_concurrently.py
+# One-shot collection: only sources that finish within their own deadline are kept and committed
+
+import threading
+import time
+import main
+from ioc_record import IOCRecord
+
+def _record(value):
+    return IOCRecord.from_source_type("Test", "IPv4", value, "Test record")
+
+def test_only_sources_within_their_own_deadline_are_kept(monkeypatch):
+    monkeypatch.setattr(main, "DEADLINE_GRACE_SECONDS", 0)
+    released = threading.Event()
+
+    def late(deadline):
+        time.sleep(0.3) # Past its own 0.1s deadline, but before the slowest source's
+        return [_record("192.0.2.2")]
+
+    def straggler(deadline):
+        released.wait(5) # Still running when collection gives up on it
+        return [_record("192.0.2.3")]
+
+    commits = []
+    sources = [
+        ("Quick", lambda deadline: [_record("192.0.2.1")], 0.5, lambda: commits.append("Quick")),
+        ("Late", late, 0.1, lambda: commits.append("Late")),
+        ("Straggler", straggler, 0.5, lambda: commits.append("Straggler"))
+    ]
+
+    records, source_timings = main.collect_concurrently(sources)
+    main.commit_sources(sources, source_timings)
+    released.set()
+
+    assert [record.value for record in records] == ["192.0.2.1"]
+    assert list(source_timings) == ["Quick"]
+    assert commits == ["Quick"]
@@ -0,0 +1,61 @@
+# test_correlation.py
+# Value normalization and merging of every source's report of a value into one Indicator
+
+import time
+from correlation import correlate, merge_records, normalize_records, normalize_value
+from ioc_record import IOCRecord
+from lifecycle import IndicatorLifecycle
+from stix_ids import value_indicator_id
+
+def _record(source, ioc_type, value, valid_from="2026-01-01T00:00:00Z", **kwargs):
+    return IOCRecord.from_source_type(source, ioc_type, value, f"Reported by {source}", valid_from=valid_from, **kwargs)
+
+def test_single_address_networks_collapse_to_the_address():
+    assert normalize_value("ipv4-addr", " 192.0.2.7/32 ") == "192.0.2.7"
+    assert normalize_value("ipv6-addr", "2001:DB8:0:0::1/128") == "2001:db8::1"
+    assert normalize_value("ipv4-addr", "192.0.2.7/24") == "192.0.2.0/24"
+    assert normalize_value("ipv4-addr", "not-an-ip ") == "not-an-ip"
+
+def test_urls_lose_the_default_port_and_fragment():
+    assert normalize_value("url", "HTTP://Evil.Example:80/a?b=1#frag") == "http://evil.example/a?b=1"
+    assert normalize_value("url", "https://evil.example:443") == "https://evil.example/"
+    assert normalize_value("url", "https://evil.example:8443/x") == "https://evil.example:8443/x"
+    assert normalize_value("domain-name", "Evil.Example.") == "evil.example"
+
+def test_reports_of_one_value_merge_into_one_indicator():
+    otx = _record("AlienVault OTX", "IPv4", "192.0.2.7/32", valid_from="2026-01-03T00:00:00Z",
+                  custom_properties={"x_virustotal_malicious": 4})
+    abuse = _record("AbuseIPDB", "IPv4", "192.0.2.7", valid_from="2026-01-02T00:00:00Z",
+                    custom_properties={"x_abuseipdb_abuse_confidence_score": 90, "x_virustotal_malicious": None})
+    other = _record("AbuseIPDB", "IPv4", "192.0.2.8")
+
+    merged = correlate(normalize_records([otx, abuse, other]))
+    assert [record.value for record in merged] == ["192.0.2.7", "192.0.2.8"]
+    record = merged[0]
+    assert record.sources == ["AbuseIPDB", "AlienVault OTX"]
+    assert record.indicator_id == value_indicator_id("ipv4-addr", "192.0.2.7")
+    assert record.valid_from == "2026-01-02T00:00:00Z" # The earliest report
+    assert record.custom_properties == {"x_abuseipdb_abuse_confidence_score": 90, "x_virustotal_malicious": 4}
+    indicator = record.indicator_dict()
+    assert indicator["x_cti_sources"] == ["AbuseIPDB", "AlienVault OTX"]
+    assert indicator["description"] == "Reported by AbuseIPDB | Reported by AlienVault OTX"
+
+def test_new_reports_re_merge_with_those_still_active(tmp_path):
+    lifecycle = IndicatorLifecycle(str(tmp_path / "lifecycle.sqlite3"))
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    earlier = lifecycle.observe([_record("AbuseIPDB", "IPv4", "192.0.2.7", valid_from=now,
+                                         custom_properties={"x_abuseipdb_abuse_confidence_score": 80})])
+
+    update = _record("AlienVault OTX", "IPv4", "192.0.2.7", valid_from=now)
+    merged = correlate(lifecycle.observe([update]), lifecycle.active_records)
+    assert len(merged) == 1
+    assert merged[0].sources == ["AbuseIPDB", "AlienVault OTX"]
+    assert merged[0].custom_properties == {"x_abuseipdb_abuse_confidence_score": 80}
+    assert merged[0].indicator_id == merge_records(earlier).indicator_id
+
+    # A source's new report replaces its active one instead of being merged with it
+    rescored = _record("AbuseIPDB", "IPv4", "192.0.2.7", valid_from=now, custom_properties={"x_abuseipdb_abuse_confidence_score": 20})
+    merged = correlate(lifecycle.observe([rescored]), lifecycle.active_records)
+    assert merged[0].sources == ["AbuseIPDB", "AlienVault OTX"]
+    assert merged[0].custom_properties == {"x_abuseipdb_abuse_confidence_score": 20}
+    lifecycle.close()
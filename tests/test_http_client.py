@@ -0,0 +1,87 @@
+# test_http_client.py
+# Circuit breaker states, token bucket limits and how RateLimitedClient drives them
+
+import json
+import http_client
+from http_client import CircuitBreaker, RateLimitedClient, TokenBucket
+
+def _open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker._opened_at -= breaker.reset_timeout # Let the reset timeout pass
+
+def test_breaker_lets_one_trial_through_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    breaker._opened_at -= 60
+    assert breaker.allow_request()
+    assert not breaker.allow_request() # The trial is still in flight
+    breaker.record_success()
+    assert breaker.allow_request()
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    _open_breaker(breaker)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+def test_trial_is_released_when_quota_runs_out(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    bucket = TokenBucket(60, daily_quota=1)
+    monkeypatch.setitem(http_client._source_limits, "Breaker test", (bucket, breaker))
+    client = RateLimitedClient("Breaker test", "http://127.0.0.1:9", {}, requests_per_minute=60, max_retries=0)
+    _open_breaker(breaker)
+    bucket.exhaust_daily_quota()
+
+    assert client.get_json("check") is None
+
+    # Without the release, the breaker would reject every later request
+    assert breaker.allow_request()
+
+def test_trial_is_released_on_unexpected_error(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    monkeypatch.setitem(http_client._source_limits, "Breaker error test", (TokenBucket(60), breaker))
+    client = RateLimitedClient("Breaker error test", "http://127.0.0.1:9", {}, requests_per_minute=60, max_retries=0)
+    _open_breaker(breaker)
+
+    def broken_get(*args, **kwargs):
+        raise RuntimeError("unexpected")
+    monkeypatch.setattr(client.session, "get", broken_get)
+    try:
+        client.get_json("check")
+    except RuntimeError:
+        pass
+
+    assert breaker.allow_request()
+
+def test_zero_requests_per_minute_means_unlimited():
+    bucket = TokenBucket(0, daily_quota=3)
+    assert [bucket.acquire(deadline=0.0) for _ in range(4)] == [True, True, True, False]
+
+class _MalformedResponse:
+    status_code = 200
+    headers = {}
+    text = "<html>"
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.text)
+
+def test_malformed_body_is_not_retried(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    monkeypatch.setitem(http_client._source_limits, "Malformed test", (TokenBucket(0), breaker))
+    client = RateLimitedClient("Malformed test", "http://127.0.0.1:9", {}, requests_per_minute=0, max_retries=3)
+    calls = []
+    monkeypatch.setattr(client.session, "get", lambda *args, **kwargs: calls.append(args) or _MalformedResponse())
+
+    assert client.get_json("check") is None
+
+    assert len(calls) == 1
+    assert breaker.allow_request() # A bad body is not a sign the service is down
@@ -0,0 +1,57 @@
+# test_indicator_index.py
+# Matching in the live lookup index: CIDR networks, parent domains, URL hosts and removal
+
+from correlation import normalize_records
+from indicator_index import IndicatorIndex
+from ioc_record import IOCRecord
+
+def _record(source, ioc_type, value):
+    return IOCRecord.from_source_type(source, ioc_type, value, f"Reported by {source}", valid_from="2026-01-01T00:00:00Z")
+
+def _index(*records):
+    index = IndicatorIndex()
+    index.add_records(normalize_records(list(records)))
+    return index
+
+def _matches(index, value):
+    return sorted((match["value"], match["source"], match["match"]) for match in index.lookup(value))
+
+def test_address_matches_every_containing_network_most_specific_first():
+    index = _index(_record("AlienVault OTX", "IPv4", "198.51.100.0/24"), _record("AlienVault OTX", "IPv4", "198.51.0.0/16"),
+                   _record("AbuseIPDB", "IPv4", "198.51.100.7"), _record("AlienVault OTX", "IPv4", "198.51.100.8/32"))
+    assert [(match["value"], match["match"]) for match in index.lookup("198.51.100.7")] == [
+        ("198.51.100.7", "exact"), ("198.51.100.0/24", "cidr"), ("198.51.0.0/16", "cidr")
+    ]
+    assert _matches(index, "198.51.100.8") == [("198.51.0.0/16", "AlienVault OTX", "cidr"),
+                                               ("198.51.100.0/24", "AlienVault OTX", "cidr"),
+                                               ("198.51.100.8", "AlienVault OTX", "exact")] # A /32 is a single address
+    assert _matches(index, "198.52.0.1") == []
+    assert index.stats()["network"] == 2
+
+def test_domain_matches_indexed_parent_domains():
+    index = _index(_record("AlienVault OTX", "domain", "Example.COM."), _record("AlienVault OTX", "hostname", "cdn.example.com"))
+    assert _matches(index, "a.cdn.example.com") == [("cdn.example.com", "AlienVault OTX", "parent"),
+                                                    ("example.com", "AlienVault OTX", "parent")]
+    assert _matches(index, "cdn.example.com") == [("cdn.example.com", "AlienVault OTX", "exact"),
+                                                  ("example.com", "AlienVault OTX", "parent")]
+    assert _matches(index, "notexample.com") == []
+
+def test_url_query_is_normalized_and_falls_back_to_its_host():
+    index = _index(_record("AlienVault OTX", "URL", "http://evil.example/p/1"), _record("AbuseIPDB", "IPv4", "192.0.2.9"),
+                   _record("AlienVault OTX", "domain", "evil.example"))
+    assert _matches(index, "HTTP://Evil.Example:80/p/1#top") == [("evil.example", "AlienVault OTX", "host"),
+                                                                ("http://evil.example/p/1", "AlienVault OTX", "exact")]
+    assert _matches(index, "http://evil.example/other") == [("evil.example", "AlienVault OTX", "host")]
+    assert _matches(index, "https://192.0.2.9/login") == [("192.0.2.9", "AbuseIPDB", "host")]
+
+def test_removed_records_stop_matching_and_leave_other_sources():
+    otx, abuse = _record("AlienVault OTX", "IPv4", "192.0.2.1"), _record("AbuseIPDB", "IPv4", "192.0.2.1")
+    network, domain = _record("AlienVault OTX", "IPv4", "203.0.113.0/24"), _record("AlienVault OTX", "domain", "evil.example")
+    index = _index(otx, abuse, network, domain)
+
+    assert index.remove_records([otx, network, domain]) == 3
+    assert _matches(index, "192.0.2.1") == [("192.0.2.1", "AbuseIPDB", "exact")]
+    assert _matches(index, "203.0.113.5") == []
+    assert _matches(index, "www.evil.example") == []
+    assert index.remove_records([otx]) == 0
+    assert index.stats() == {"ip": 1, "network": 0, "domain": 0, "url": 0, "file": 0}
@@ -0,0 +1,48 @@
+# test_lifecycle.py
+# Expiry and compaction of a value reported by several sources, keyed by its value Indicator id
+
+from correlation import merge_records
+from ioc_record import IOCRecord
+from lifecycle import DAY, IndicatorLifecycle, TTLPolicy, _timestamp_seconds
+from seen_store import SeenIndicatorStore
+
+def _record(source, valid_from):
+    return IOCRecord.from_source_type(source, "IPv4", "192.0.2.7", f"Reported by {source}", valid_from=valid_from)
+
+def _seen_ids(store):
+    return {object_id for (object_id,) in store._conn.execute("SELECT object_id FROM seen_objects")}
+
+def test_value_id_is_forgotten_only_after_its_last_source_expires(tmp_path):
+    store = SeenIndicatorStore(str(tmp_path / "seen.sqlite3"))
+    policy = TTLPolicy({("AlienVault OTX", "ipv4-addr"): 10, ("AbuseIPDB", "ipv4-addr"): 30})
+    lifecycle = IndicatorLifecycle(str(tmp_path / "lifecycle.sqlite3"), policy, seen_store=store, compaction_grace=DAY)
+    records = [_record("AlienVault OTX", "2026-01-01T00:00:00Z"), _record("AbuseIPDB", "2026-01-01T00:00:00Z")]
+    start = _timestamp_seconds("2026-01-01T00:00:00Z")
+    lifecycle.observe(records, now=start)
+
+    merged = merge_records(records)
+    observable_id, indicator_id = merged.observable_dict()["id"], merged.indicator_id
+    store.mark_published_ids({observable_id: "observable", indicator_id: "indicator"})
+
+    # OTX's report expires first: the value is re-published with AbuseIPDB's attribution only
+    now = start + 11 * DAY
+    expired = lifecycle.expire_due(now)
+    assert [(object_id, record.source) for object_id, _, record, _ in expired] == [(indicator_id, "AlienVault OTX")]
+    updates = lifecycle.expiry_updates(expired, now)
+    assert [(update.indicator_id, update.sources) for update in updates] == [(indicator_id, ["AbuseIPDB"])]
+    lifecycle.mark_expired(expired, now)
+    lifecycle.compact(now + 2 * DAY)
+    assert _seen_ids(store) == {observable_id, indicator_id}
+
+    # Once AbuseIPDB's expires too, the Indicator gets valid_until, then both fingerprints go
+    now = start + 31 * DAY
+    expired = lifecycle.expire_due(now)
+    updates = lifecycle.expiry_updates(expired, now)
+    assert [update["id"] for update in updates] == [indicator_id]
+    assert "valid_until" in updates[0]
+    lifecycle.mark_expired(expired, now)
+    lifecycle.compact(now + 2 * DAY)
+    assert _seen_ids(store) == set()
+    assert lifecycle.active_count == 0
+    lifecycle.close()
+    store.close()
@@ -0,0 +1,99 @@
+# test_otx_fetcher.py
+# OTX cursor handling: it only moves on commit() after a completed walk, and interrupted walks resume
+
+import json
+import time
+from otx_fetcher import AlienVaultOTXFetcher
+
+def _pulse(pulse_id, modified):
+    return {"id": pulse_id, "name": pulse_id, "modified": modified,
+            "indicators": [{"type": "IPv4", "indicator": f"192.0.2.{pulse_id[-1]}"}]}
+
+def _fetcher(tmp_path, pages):
+    fetcher = AlienVaultOTXFetcher("test-key", base_url="http://127.0.0.1:9", cursor_path=str(tmp_path / "cursor.json"))
+    responses = iter(pages)
+    fetcher._make_request = lambda endpoint, params=None, deadline=None, **options: next(responses)
+    return fetcher
+
+def test_cursor_moves_only_on_commit(tmp_path):
+    fetcher = _fetcher(tmp_path, [
+        {"results": [_pulse("p1", "2026-10-01T00:00:00")], "next": "http://127.0.0.1:9/pulses/subscribed?page=2"},
+        {"results": [_pulse("p2", "2026-10-02T00:00:00")], "next": None}
+    ])
+
+    records = list(fetcher.iter_indicators(backfill=True))
+
+    assert [record.value for record in records] == ["192.0.2.1", "192.0.2.2"]
+    assert fetcher.load_cursor() is None # Not yet: the records are not stored anywhere
+    assert fetcher.commit()
+    with open(tmp_path / "cursor.json") as f:
+        assert json.load(f) == {"modified_since": "2026-10-02T00:00:00"}
+
+def test_interrupted_walk_is_not_committed(tmp_path):
+    fetcher = _fetcher(tmp_path, [
+        {"results": [_pulse("p1", "2026-10-01T00:00:00")], "next": "http://127.0.0.1:9/pulses/subscribed?page=2"},
+        None
+    ])
+
+    assert len(list(fetcher.iter_indicators(backfill=True))) == 1
+    assert not fetcher.commit()
+    assert fetcher.load_cursor() is None
+
+def test_interrupted_walk_resumes_at_its_first_unread_page(tmp_path):
+    fetcher = _fetcher(tmp_path, [
+        {"results": [_pulse("p1", "2026-10-01T00:00:00")], "next": "http://127.0.0.1:9/pulses/subscribed?page=2&limit=50"},
+        None
+    ])
+    assert len(list(fetcher.iter_indicators(backfill=True))) == 1
+    assert not fetcher.commit()
+    assert fetcher.load_walk() == {"modified_since": None, "params": {"page": "2", "limit": "50"},
+                                   "high_water": "2026-10-01T00:00:00"}
+
+    requested = []
+    pages = iter([{"results": [_pulse("p2", "2026-09-30T00:00:00")], "next": None}])
+    fetcher._make_request = lambda endpoint, params=None, deadline=None, **options: requested.append(params) or next(pages)
+    assert [record.value for record in fetcher.iter_indicators()] == ["192.0.2.2"]
+    assert requested == [{"page": "2", "limit": "50"}]
+    assert fetcher.commit()
+    with open(tmp_path / "cursor.json") as f:
+        assert json.load(f) == {"modified_since": "2026-10-01T00:00:00"}
+
+def test_consumer_time_does_not_count_against_the_deadline(tmp_path, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    fetcher = _fetcher(tmp_path, [
+        {"results": [_pulse("p1", "2026-10-01T00:00:00")], "next": "http://127.0.0.1:9/pulses/subscribed?page=2"},
+        {"results": [_pulse("p2", "2026-10-02T00:00:00")], "next": None}
+    ])
+
+    values = []
+    for record in fetcher.iter_indicators(backfill=True, deadline=60.0):
+        values.append(record.value)
+        clock[0] += 120 # Enriching and spooling the batch takes longer than the whole deadline
+
+    assert values == ["192.0.2.1", "192.0.2.2"]
+    assert fetcher.last_walk_complete
+
+def _recording_fetcher(tmp_path, pages, **kwargs):
+    fetcher = AlienVaultOTXFetcher("test-key", base_url="http://127.0.0.1:9", cursor_path=str(tmp_path / "cursor.json"), **kwargs)
+    requested, responses = [], iter(pages)
+    fetcher._make_request = lambda endpoint, params=None, deadline=None, **options: requested.append((params, options)) or next(responses)
+    return fetcher, requested
+
+def test_first_page_is_conditional_only_in_an_explicit_order(tmp_path):
+    page = {"results": [_pulse("p1", "2026-10-01T00:00:00")], "next": None}
+    fetcher, requested = _recording_fetcher(tmp_path, [page, page])
+    list(fetcher.iter_indicators(backfill=True))
+    assert requested[-1][1] == {"if_changed": False, "conditional": False}
+
+    fetcher.sort = "-modified"
+    list(fetcher.iter_indicators(backfill=True))
+    assert requested[-1] == ({"limit": 50, "page": 1, "sort": "-modified"}, {"if_changed": True, "conditional": True})
+
+def test_lookback_walk_is_not_conditional_and_keeps_its_start(tmp_path):
+    fetcher, requested = _recording_fetcher(tmp_path, [{"results": [], "next": None}], sort="-modified", initial_lookback_days=30)
+    assert list(fetcher.iter_indicators()) == []
+    assert requested[0][1] == {"if_changed": False, "conditional": False}
+    assert fetcher.commit()
+    # The next walk asks for the same range, so its validators can be reused
+    assert fetcher.load_cursor() == requested[0][0]["modified_since"]
@@ -0,0 +1,70 @@
+# test_outbox.py
+# Checkpointing, replay after a restart and backpressure of the on-disk outbox
+
+import json
+import time
+from outbox import Outbox, OutboxWorker
+
+def _objects(start, count):
+    return [{"type": "indicator", "id": f"indicator--{n:08d}", "name": f"Object {n}"} for n in range(start, start + count)]
+
+def _ids(lines):
+    return [json.loads(line)["stix"]["id"] for line in lines]
+
+class _Publisher:
+    """Stands in for TAXIIPublisher: records each batch and accepts or rejects it."""
+
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.batches = []
+
+    def publish_objects(self, items):
+        self.batches.append(_ids(items))
+        return self.accept
+
+def test_checkpoint_moves_only_after_an_accepted_batch(tmp_path):
+    outbox = Outbox(str(tmp_path), fsync=False)
+    outbox.append(_objects(0, 5))
+    publisher = _Publisher(accept=False)
+    worker = OutboxWorker(outbox, publisher, batch_size=3)
+
+    assert worker.publish_next_batch() is None
+    assert worker.publish_next_batch() is None
+    assert publisher.batches == [_ids(outbox.read_batch(3, decode=False)[0])] * 2 # The same batch is retried
+    assert not (tmp_path / "checkpoint.json").exists()
+
+    publisher.accept = True
+    assert worker.publish_next_batch() == 3
+    assert _ids(outbox.read_batch(10, decode=False)[0]) == [f"indicator--{n:08d}" for n in (3, 4)]
+    assert worker.publish_next_batch() == 2
+    assert worker.publish_next_batch() == 0
+    assert outbox.pending_bytes == 0
+    outbox.close()
+
+def test_unpublished_segments_are_replayed_after_a_restart(tmp_path):
+    outbox = Outbox(str(tmp_path), segment_max_bytes=200, fsync=False)
+    for start in range(0, 8, 2):
+        outbox.append(_objects(start, 2))
+    assert len(list(tmp_path.glob("segment-*.ndjson"))) > 1
+    OutboxWorker(outbox, _Publisher(), batch_size=3).publish_next_batch()
+    outbox.close() # Stands in for the process exiting
+
+    reopened = Outbox(str(tmp_path), segment_max_bytes=200, fsync=False)
+    assert reopened.pending_bytes > 0
+    reopened.append(_objects(8, 1)) # Written to a fresh segment
+    publisher = _Publisher()
+    assert OutboxWorker(reopened, publisher, batch_size=100).drain()
+    assert [object_id for batch in publisher.batches for object_id in batch] == [f"indicator--{n:08d}" for n in range(3, 9)]
+    assert reopened.pending_bytes == 0
+    assert len(list(tmp_path.glob("segment-*.ndjson"))) == 1
+    reopened.close()
+
+def test_backpressure_times_out_and_spools_anyway(tmp_path):
+    outbox = Outbox(str(tmp_path), max_pending_bytes=1, backpressure_timeout=0.2, fsync=False)
+    outbox.append(_objects(0, 1))
+
+    started = time.monotonic()
+    assert outbox.append(_objects(1, 1)) == 1 # Nothing drains the outbox, so this waits out the timeout
+    assert time.monotonic() - started >= 0.2
+    assert _ids(outbox.read_batch(10, decode=False)[0]) == ["indicator--00000000", "indicator--00000001"]
+    outbox.close()
@@ -0,0 +1,44 @@
+# test_reputation_cache.py
+# ReputationCache expiry and the cache counters exported to Prometheus
+
+import time
+from abuseipdb_fetcher import AbuseIPDBFetcher
+from metrics import API_REQUESTS_SAVED, REPUTATION_CACHE_LOOKUPS
+from reputation_cache import ReputationCache
+
+def _row_count(cache):
+    return cache._conn.execute("SELECT COUNT(*) FROM reputation").fetchone()[0]
+
+def test_expired_entries_are_purged_on_open_and_write(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = ReputationCache(db_path, ttl_seconds=60)
+    cache.put_many({"192.0.2.1": {"abuseConfidenceScore": 10}}, 90)
+    cache._conn.execute("UPDATE reputation SET fetched_at = ?", (time.time() - 3600,))
+    cache._conn.commit()
+    cache.close()
+
+    cache = ReputationCache(db_path, ttl_seconds=60)
+    assert _row_count(cache) == 0
+
+    cache.put_many({"192.0.2.2": {}}, 90)
+    cache._conn.execute("UPDATE reputation SET fetched_at = ?", (time.time() - 3600,))
+    cache._conn.commit()
+    cache._next_purge = 0.0 # A TTL has passed since the last purge
+    cache.put_many({"192.0.2.3": {}}, 90)
+    assert [ip for (ip,) in cache._conn.execute("SELECT ip FROM reputation")] == ["192.0.2.3"]
+    cache.close()
+
+def test_cache_hits_are_exported_as_counters(tmp_path):
+    cache = ReputationCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=3600)
+    cache.put_many({"192.0.2.1": {"ipAddress": "192.0.2.1"}}, 90)
+    fetcher = AbuseIPDBFetcher("test-key", base_url="http://127.0.0.1:9", cache=cache, max_requests_per_cycle=0)
+    hits = REPUTATION_CACHE_LOOKUPS.get(source="AbuseIPDB", result="hit")
+    misses = REPUTATION_CACHE_LOOKUPS.get(source="AbuseIPDB", result="miss")
+    saved = API_REQUESTS_SAVED.get(source="AbuseIPDB")
+
+    results = fetcher.check_ips(["192.0.2.1", "192.0.2.2"])
+
+    assert list(results) == ["192.0.2.1"]
+    assert REPUTATION_CACHE_LOOKUPS.get(source="AbuseIPDB", result="hit") == hits + 1
+    assert REPUTATION_CACHE_LOOKUPS.get(source="AbuseIPDB", result="miss") == misses + 1
+    assert API_REQUESTS_SAVED.get(source="AbuseIPDB") == saved + 1
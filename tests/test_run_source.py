@@ -0,0 +1,37 @@
+# test_run_source.py
+# Scheduled source runs: records are spooled batch by batch and progress is committed last
+
+from ioc_record import IOCRecord
+from main import run_source
+
+class RecordingOutbox:
+    pending_bytes = 0
+
+    def __init__(self, events):
+        self.events = events
+
+    def append(self, records):
+        self.events.append(("spool", len(records)))
+        return len(records)
+
+def _records(count, fail_after=None):
+    for i in range(count):
+        if i == fail_after:
+            raise ConnectionError("connection reset")
+        yield IOCRecord.from_source_type("Test", "IPv4", f"192.0.2.{i}", "Test record")
+
+def test_records_are_spooled_in_batches_before_commit():
+    events = []
+    source = ("Test", lambda deadline: _records(25), 60, lambda: events.append(("commit",)))
+
+    assert run_source(source, RecordingOutbox(events), batch_size=10)
+
+    assert events == [("spool", 10), ("spool", 10), ("spool", 5), ("commit",)]
+
+def test_failed_fetch_is_not_committed():
+    events = []
+    source = ("Test", lambda deadline: _records(25, fail_after=15), 60, lambda: events.append(("commit",)))
+
+    assert not run_source(source, RecordingOutbox(events), batch_size=10)
+
+    assert events == [("spool", 10)]
@@ -0,0 +1,51 @@
+# test_scheduler.py
+# Slot arithmetic and persisted state of the per-source scheduler
+
+import time
+from scheduler import ScheduledJob, SourceScheduler
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def _slow_run(clock, seconds):
+    def run():
+        clock.now += seconds
+        return True
+    return run
+
+def test_one_shot_runs_at_interval_cadence_are_all_due(tmp_path, monkeypatch):
+    clock = FakeClock(1_000_000.0)
+    monkeypatch.setattr(time, "time", clock)
+    state_path = str(tmp_path / "scheduler_state.json")
+    run = _slow_run(clock, 10)
+
+    for cron_fire in range(3):
+        # A CronJob starting a fresh process every 900s, each run taking 10s
+        clock.now = 1_000_000.0 + cron_fire * 900
+        scheduler = SourceScheduler(state_path)
+        scheduler.add_job("AlienVault OTX", run, 900)
+        futures = scheduler.run_due(wait_for_completion=True, ignore_jitter=True)
+        scheduler.shutdown()
+        assert list(futures) == ["AlienVault OTX"]
+
+def test_restart_within_interval_waits_for_next_slot(tmp_path, monkeypatch):
+    clock = FakeClock(1_000_000.0)
+    monkeypatch.setattr(time, "time", clock)
+    state_path = str(tmp_path / "scheduler_state.json")
+    scheduler = SourceScheduler(state_path)
+    job = scheduler.add_job("AbuseIPDB", _slow_run(clock, 10), 3600)
+    scheduler._run_job(job)
+
+    clock.now = 1_000_000.0 + 600
+    job = SourceScheduler(state_path).add_job("AbuseIPDB", _slow_run(clock, 10), 3600)
+    assert job.slot == 1_000_000.0 + 3600
+
+def test_overrun_skips_missed_slots():
+    job = ScheduledJob("AlienVault OTX", lambda: True, 900)
+    job.schedule(0.0)
+    job.advance(2000.0)
+    assert job.slot == 2700.0
@@ -0,0 +1,35 @@
+# test_seen_store.py
+# Delta filtering of published objects and the versioning of re-published ones
+
+import json
+from seen_store import SeenIndicatorStore, fingerprint
+from taxii_publisher import TAXIIPublisher
+
+def _indicator(created, description):
+    return {
+        "type": "indicator", "spec_version": "2.1", "id": "indicator--2f4c8f55-5d2c-5cde-9b23-6b8b3c5a1c11",
+        "created": created, "modified": created, "description": description,
+        "pattern": "[ipv4-addr:value = '192.0.2.1']", "pattern_type": "stix", "valid_from": created
+    }
+
+def test_changed_object_keeps_its_first_created(tmp_path):
+    store = SeenIndicatorStore(str(tmp_path / "seen.sqlite3"))
+    publisher = TAXIIPublisher("http://127.0.0.1:9", "collection", "user", "password", seen_store=store)
+    sent = []
+    publisher._send_chunk = lambda chunk_index, fragments: sent.extend(fragments) or True
+
+    first = _indicator("2024-01-01T00:00:00Z", "Seen once")
+    assert publisher.publish_objects([first])
+    assert publisher.publish_objects([_indicator("2024-03-01T00:00:00Z", "Seen once")]) # Only timestamps changed
+    assert len(sent) == 1
+
+    changed = _indicator("2024-03-01T00:00:00Z", "Seen twice")
+    assert publisher.publish_objects([changed])
+    assert len(sent) == 2
+    republished = json.loads(sent[1])
+    assert republished["created"] == "2024-01-01T00:00:00Z"
+    assert republished["modified"] > "2024-03-01T00:00:00Z"
+    assert store.first_created([changed["id"]]) == {changed["id"]: "2024-01-01T00:00:00Z"}
+    assert store.filter_changed_ids({changed["id"]: fingerprint(changed)}) == {}
+    publisher.close()
+    store.close()
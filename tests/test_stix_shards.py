@@ -0,0 +1,41 @@
+# test_stix_shards.py
+# A sharded serialization over a process pool yields exactly what a serial one does
+
+from ioc_record import IOCRecord, item_to_json_line
+from stix_shards import ShardedSerializer
+
+def _items(count):
+    items = []
+    for n in range(count):
+        record = IOCRecord.from_source_type("AlienVault OTX", "IPv4", f"192.0.2.{n}", f"Record {n}",
+                                            valid_from="2026-01-01T00:00:00Z", created=f"2026-01-{n % 28 + 1:02d}T00:00:00Z")
+        # Records, raw outbox lines and plain STIX dicts, as the publisher gets them
+        if n % 3 == 0:
+            items.append(record)
+        elif n % 3 == 1:
+            items.append(item_to_json_line(record).encode("utf-8"))
+        else:
+            items.append({"type": "identity", "spec_version": "2.1", "id": f"identity--00000000-0000-4000-8000-{n:012d}",
+                          "created": f"2025-12-{n % 28 + 1:02d}T00:00:00Z", "modified": "2026-01-01T00:00:00Z", "name": f"Org {n}"})
+    return items
+
+def test_two_workers_match_one_over_many_shards():
+    items = _items(40)
+    serial = ShardedSerializer(workers=1, shard_size=3)
+    sharded = ShardedSerializer(workers=2, shard_size=3) # 14 shards, more than the 4 kept in flight
+    try:
+        expected = list(serial.iter_serialized(items, with_fingerprints=True))
+        actual = list(sharded.iter_serialized(items, with_fingerprints=True))
+        assert sharded._pool is not None
+    finally:
+        serial.close()
+        sharded.close()
+
+    assert actual == expected
+    assert len({object_id for object_id, _, _, _ in actual}) == len(actual)
+    identities = [(object_id, created) for object_id, _, _, created in actual if object_id.startswith("identity--")]
+    assert identities == [(f"identity--00000000-0000-4000-8000-{n:012d}", f"2025-12-{n % 28 + 1:02d}T00:00:00Z")
+                          for n in range(40) if n % 3 == 2]
+    indicators = [created for object_id, _, _, created in actual if object_id.startswith("indicator--")]
+    assert indicators == [f"2026-01-{n % 28 + 1:02d}T00:00:00Z" for n in range(40) if n % 3 != 2]
+    assert all(created is None for object_id, _, _, created in actual if object_id.startswith("ipv4-addr--")) # SCOs have none
@@ -0,0 +1,25 @@
+# test_taxii_publisher.py
+# Chunk retries against an OpenTAXII Inbox that accepts connections but never answers
+
+import socket
+import time
+from taxii_publisher import TAXIIPublisher
+
+def test_hung_inbox_times_out_and_retries_the_chunk(monkeypatch):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8) # Connections are queued by the kernel but never read or answered
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    publisher = TAXIIPublisher(f"http://127.0.0.1:{listener.getsockname()[1]}", "collection", "user", "password",
+                               chunk_retries=1, timeout=(1, 0.2))
+    posts = []
+    post = publisher.session.post
+    publisher.session.post = lambda *args, **kwargs: posts.append(kwargs["timeout"]) or post(*args, **kwargs)
+
+    started = time.monotonic()
+    assert not publisher._send_chunk(0, ['{"type":"identity"}'])
+
+    assert posts == [(1, 0.2), (1, 0.2)]
+    assert time.monotonic() - started < 5
+    publisher.close()
+    listener.close()
@@ -0,0 +1,56 @@
+# test_vt_fetcher.py
+# Lookup budget accounting and verdicts carried over when a VirusTotal lookup is skipped
+
+import time
+from correlation import correlate
+from ioc_record import IOCRecord
+from lifecycle import IndicatorLifecycle
+from seen_store import SeenIndicatorStore
+from taxii_publisher import TAXIIPublisher
+from vt_fetcher import LookupBudget, VirusTotalFetcher
+
+VERDICT = {"data": {"attributes": {"last_analysis_stats": {"malicious": 7, "suspicious": 1, "harmless": 50, "undetected": 20},
+                                   "reputation": -12}}}
+
+def _records(count):
+    valid_from = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return [IOCRecord.from_source_type("AlienVault OTX", "IPv4", f"192.0.2.{n}", "Scanner", valid_from=valid_from)
+            for n in range(1, count + 1)]
+
+def test_lookups_never_sent_are_refunded_to_the_budget(monkeypatch):
+    fetcher = VirusTotalFetcher("key", base_url="http://127.0.0.1:9", requests_per_minute=0)
+    requests_sent = []
+    def get(url, **kwargs):
+        requests_sent.append(url)
+        raise AssertionError("No request is sent once the deadline has passed")
+    monkeypatch.setattr(fetcher.client.session, "get", get)
+
+    budget = LookupBudget(5)
+    fetcher.enrich_records(_records(3), deadline=time.monotonic() - 1, budget=budget)
+    assert requests_sent == []
+    assert budget.remaining == 5
+    assert fetcher.stats["api_requests"] == 0
+
+def test_unchanged_value_is_not_republished_when_its_lookup_is_skipped(tmp_path, monkeypatch):
+    fetcher = VirusTotalFetcher("key", base_url="http://127.0.0.1:9", requests_per_minute=0)
+    monkeypatch.setattr(fetcher, "_make_request", lambda endpoint, params=None, deadline=None: VERDICT)
+    lifecycle = IndicatorLifecycle(str(tmp_path / "lifecycle.sqlite3"))
+    store = SeenIndicatorStore(str(tmp_path / "seen.sqlite3"))
+    publisher = TAXIIPublisher("http://127.0.0.1:9", "collection", "user", "password", seen_store=store)
+    sent = []
+    publisher._send_chunk = lambda chunk_index, fragments: sent.extend(fragments) or True
+
+    def run(budget):
+        records = lifecycle.observe(fetcher.enrich_records(_records(1), budget=budget))
+        assert publisher.publish_objects(correlate(records, lifecycle.active_records))
+        return records[0]
+
+    assert run(LookupBudget(1)).custom_properties["x_virustotal_malicious"] == 7
+    published = len(sent)
+    assert published
+    record = run(LookupBudget(0)) # Budget used up: no verdict this time
+    assert record.custom_properties["x_virustotal_malicious"] == 7
+    assert len(sent) == published
+    publisher.close()
+    store.close()
+    lifecycle.close()
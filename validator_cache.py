@@ -0,0 +1,58 @@
+# validator_cache.py
+# Persistent store of HTTP response validators (ETag / Last-Modified) per API request,
+# so repeated polls can be sent as conditional requests and answered with 304 Not Modified
+
+import sqlite3
+import os
+import threading
+import time
+
+class ValidatorCache:
+    """
+    Maps a request key (source, endpoint and parameter set) to the ETag and Last-Modified
+    of its last full response, the number of bytes that response took on the wire and,
+    optionally, its body so a 304 can be answered from here.
+    A single connection is shared between worker threads and guarded by a lock.
+    """
+
+    def __init__(self, db_path, max_age=30 * 86400):
+        """Entries not refreshed for `max_age` seconds are dropped on open (e.g. keys of superseded cursors)."""
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS validators ("
+            " request_key TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " wire_bytes INTEGER NOT NULL,"
+            " body BLOB,"
+            " stored_at REAL NOT NULL)"
+        )
+        if max_age:
+            self._conn.execute("DELETE FROM validators WHERE stored_at < ?", (time.time() - max_age,))
+        self._conn.commit()
+
+    def get(self, request_key):
+        """Returns (etag, last_modified, wire_bytes, body) for a request, or None. `body` may be None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT etag, last_modified, wire_bytes, body FROM validators WHERE request_key = ?", (request_key,)
+            ).fetchone()
+
+    def put(self, request_key, etag, last_modified, wire_bytes, body=None):
+        """Stores the validators of a full response, replacing older ones."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO validators (request_key, etag, last_modified, wire_bytes, body, stored_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (request_key, etag, last_modified, wire_bytes, body, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
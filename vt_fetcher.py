@@ -1,93 +1,239 @@
 # vt_fetcher.py
-# Fetches indicators from VirusTotal API and converts them to STIX 2.x
+# Enriches IOC records collected from other feeds with VirusTotal verdicts
 
-import requests
-import json
-from stix2 import Indicator, Observable, Bundle, TLP_WHITE # Added TLP_WHITE import
+from http_client import RateLimitedClient
+from metrics import API_REQUESTS_SAVED, REPUTATION_CACHE_LOOKUPS
+import base64
 import logging
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# STIX observable type -> VirusTotal API v3 collection
+VT_COLLECTIONS = {
+    "ipv4-addr": "ip_addresses",
+    "ipv6-addr": "ip_addresses",
+    "domain-name": "domains",
+    "url": "urls",
+    "file": "files"
+}
+
+# When the quota can't cover every lookup, hashes go first (VT is the authority on files),
+# then URLs and domains; IPs come last since AbuseIPDB already scores them
+COLLECTION_PRIORITY = {"files": 0, "urls": 1, "domains": 2, "ip_addresses": 3}
+
+def lookup_key(record):
+    """Returns the (collection, object_id) VirusTotal lookup for a record, or None if VT has no endpoint for it."""
+    collection = VT_COLLECTIONS.get(record.stix_type)
+    if collection is None:
+        return None
+    if collection == "urls":
+        # URL identifiers are the unpadded URL-safe base64 of the URL
+        return collection, base64.urlsafe_b64encode(record.value.encode("utf-8")).decode("ascii").rstrip("=")
+    if collection == "domains":
+        return collection, record.value.lower().rstrip(".")
+    if collection == "files":
+        return collection, record.value.lower()
+    return collection, record.value
+
+def _lookup_priority(lookup, records):
+    """Sort key: values reported by more sources first, then by AbuseIPDB score, then by collection."""
+    sources = {record.source for record in records}
+    abuse_score = max(
+        ((record.custom_properties or {}).get("x_abuseipdb_abuse_confidence_score") or 0 for record in records),
+        default=0
+    )
+    return (-len(sources), -abuse_score, COLLECTION_PRIORITY[lookup[0]])
+
+def _verdict(data):
+    """Reduces a VirusTotal object response to the fields kept in the cache."""
+    if not data:
+        return {"not_found": True}
+    attributes = data.get("data", {}).get("attributes", {})
+    stats = attributes.get("last_analysis_stats", {})
+    return {
+        "malicious": stats.get("malicious", 0),
+        "suspicious": stats.get("suspicious", 0),
+        "harmless": stats.get("harmless", 0),
+        "undetected": stats.get("undetected", 0),
+        "reputation": attributes.get("reputation")
+    }
+
+class LookupBudget:
+    """
+    Lookups left for one source run whose records are enriched batch by batch, so the run
+    as a whole stays within max_lookups_per_cycle. None means unlimited.
+    Batches are spooled before the next one is fetched, so lookups are only ranked within
+    a batch: batches draw on the budget in arrival order and an early batch may use it up.
+    """
+
+    def __init__(self, max_lookups):
+        self.remaining = max_lookups
+
+    def take(self, wanted):
+        """Reserves up to `wanted` lookups and returns how many may be made."""
+        if self.remaining is None:
+            return wanted
+        granted = min(wanted, self.remaining)
+        self.remaining -= granted
+        return granted
+
+    def refund(self, unused):
+        """Returns reserved lookups that were never sent (deadline, quota or open breaker) to later batches."""
+        if self.remaining is not None:
+            self.remaining += unused
 
 class VirusTotalFetcher:
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=None, cache=None, max_workers=4, max_lookups_per_cycle=None,
+                 requests_per_minute=4, daily_quota=500, max_retries=4):
+        """
+        `cache` is an optional ReputationCache holding verdicts for its TTL, including
+        "not found" answers, so each value costs at most one request per TTL.
+        Cache misses are looked up by up to `max_workers` concurrent requests, highest
+        priority first within each call, and at most `max_lookups_per_cycle` API calls are
+        made per call (or per LookupBudget, shared by calls in arrival order).
+        Requests go through a RateLimitedClient honoring `requests_per_minute` and `daily_quota`.
+        They are not conditional: `cache` already keeps the answers, so storing validators
+        and a copy of every body for them would only duplicate it.
+        """
         self.api_key = api_key
-        self.base_url = "https://www.virustotal.com/api/v3"
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_lookups_per_cycle = max_lookups_per_cycle
+        self.stats = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "api_requests": 0,
+            "duplicates_skipped": 0
+        }
+        self._stats_lock = threading.Lock()
+        self.base_url = base_url or "https://www.virustotal.com/api/v3"
         self.headers = {
             "x-apikey": self.api_key,
             "Accept": "application/json"
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-
-    def _make_request(self, endpoint, params=None):
-        """Helper to make API requests with rate limiting."""
-        url = f"{self.base_url}/{endpoint}"
-        try:
-            response = self.session.get(url, params=params)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            logging.error(f"HTTP error for {endpoint}: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429: # Too Many Requests
-                logging.warning("VirusTotal rate limit hit. Waiting for 60 seconds...")
-                time.sleep(60)
-                return self._make_request(endpoint, params) # Retry after delay
-            return None
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error for {endpoint}: {e}")
+        self.client = RateLimitedClient(
+            "VirusTotal", self.base_url, self.headers,
+            requests_per_minute=requests_per_minute,
+            daily_quota=daily_quota,
+            max_retries=max_retries,
+            pool_size=max_workers
+        )
+        self.session = self.client.session
+
+    def _make_request(self, endpoint, params=None, deadline=None):
+        """
+        Helper to make API requests through the shared rate-limited client.
+        `deadline` is an optional time.monotonic() value the request must finish by.
+        VirusTotal answers 404 for values it has never seen; those come back as {}.
+        """
+        return self.client.get_json(endpoint, params, deadline, missing_ok=True)
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def lookup(self, collection, object_id, deadline=None):
+        """Fetches one object from /ip_addresses, /domains, /urls or /files. Returns its verdict, or None on failure."""
+        data = self._make_request(f"{collection}/{object_id}", deadline=deadline)
+        if self.client.last_request_sent:
+            self._count(api_requests=1)
+        if data is None:
             return None
+        return _verdict(data)
+
+    def _lookup_sent(self, collection, object_id, deadline):
+        """lookup() for the pool: returns (verdict, whether a request was sent)."""
+        verdict = self.lookup(collection, object_id, deadline)
+        return verdict, self.client.last_request_sent
 
-    def fetch_recent_indicators(self, limit=10):
+    def get_verdicts(self, records, deadline=None, budget=None):
         """
-        Fetches recent file, URL, domain, and IP indicators from VirusTotal.
-        Note: VirusTotal's public API has significant limitations on "recent" data.
-        This will typically get recent *detections* or *analyses* rather than a firehose of new IOCs.
-        For a true "feed," a premium VT subscription is usually required.
-        For this project, we'll simulate by fetching general file/URL/domain/IP info
-        which might have a recent analysis date.
+        Returns {(collection, object_id): verdict} for the records' values. Each distinct value
+        is looked up once; cached verdicts are reused and misses are fetched concurrently in
+        priority order until the per-cycle budget, the daily quota or `deadline` runs out.
+        A LookupBudget `budget` replaces the per-cycle budget for runs split into batches;
+        the priority order then only applies within this call's records.
         """
-        stix_objects = []
-        logging.info(f"Fetching {limit} recent indicators from VirusTotal...")
-
-        # Dummy data representing what VT might return
-        # In a real scenario, you'd feed specific observables to VT for lookup
-        # or use a premium feed for bulk recent data.
-        dummy_iocs = [
-            {"value": "8.8.8.8", "type": "ipv4-addr", "source": "VirusTotal", "context": "Malicious IP (dummy)"},
-            {"value": "malicious.example.com", "type": "domain", "source": "VirusTotal", "context": "Malicious Domain (dummy)"},
-            {"value": "http://phishing.example.org/login", "type": "url", "source": "VirusTotal", "context": "Phishing URL (dummy)"},
-            {"value": "d41d8cd98f00b204e9800998ecf8427e", "type": "file-hash", "source": "VirusTotal", "context": "Known bad MD5 (dummy)"}
-        ]
-
-        for ioc in dummy_iocs:
-            # Create STIX Observable
-            if ioc['type'] == 'ipv4-addr':
-                observable = Observable(value=ioc['value'], type='ipv4-addr')
-                pattern = f"[ipv4-addr:value = '{ioc['value']}']"
-            elif ioc['type'] == 'domain':
-                observable = Observable(value=ioc['value'], type='domain-name') # Corrected type to domain-name
-                pattern = f"[domain-name:value = '{ioc['value']}']"
-            elif ioc['type'] == 'url':
-                observable = Observable(value=ioc['value'], type='url')
-                pattern = f"[url:value = '{ioc['value']}']"
-            elif ioc['type'] == 'file-hash':
-                observable = Observable(value=ioc['value'], type='file', hashes={'MD5': ioc['value']})
-                pattern = f"[file:hashes.'MD5' = '{ioc['value']}']"
-            else:
-                logging.warning(f"Unsupported IOC type: {ioc['type']}")
-                continue
+        records_by_lookup = {}
+        for record in records:
+            key = lookup_key(record)
+            if key is not None:
+                records_by_lookup.setdefault(key, []).append(record)
+        duplicates = sum(len(group) - 1 for group in records_by_lookup.values())
+        self._count(duplicates_skipped=duplicates)
+
+        cache_keys = [f"{collection}/{object_id}" for collection, object_id in records_by_lookup]
+        # The cache's max_age_in_days dimension is unused for VT verdicts
+        cached = self.cache.get_many(cache_keys, 0) if self.cache else {}
+        verdicts = {key: cached[f"{key[0]}/{key[1]}"] for key in records_by_lookup if f"{key[0]}/{key[1]}" in cached}
+        misses = sorted(
+            (key for key in records_by_lookup if key not in verdicts),
+            key=lambda key: _lookup_priority(key, records_by_lookup[key])
+        )
+        self._count(cache_hits=len(verdicts), cache_misses=len(misses))
+        REPUTATION_CACHE_LOOKUPS.inc(len(verdicts), source="VirusTotal", result="hit")
+        REPUTATION_CACHE_LOOKUPS.inc(len(misses), source="VirusTotal", result="miss")
+        API_REQUESTS_SAVED.inc(len(verdicts) + duplicates, source="VirusTotal")
 
-            # Create STIX Indicator
-            indicator = Indicator(
-                pattern=pattern,
-                pattern_type="stix",
-                description=f"{ioc['context']} from {ioc['source']}",
-                valid_from=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
-                object_marking_refs=[TLP_WHITE], # Added TLP marking
-                # You might add a relationship to the observable here if needed
+        allowed = budget.take(len(misses)) if budget is not None else self.max_lookups_per_cycle
+        if allowed is not None and len(misses) > allowed:
+            logging.info(
+                f"VirusTotal lookup budget reached. "
+                f"Deferring {len(misses) - allowed} lower-priority lookups to a later cycle."
             )
-            stix_objects.extend([observable, indicator])
-            logging.info(f"Created STIX Indicator for {ioc['type']}: {ioc['value']}")
+            misses = misses[:allowed]
+
+        fetched, sent = {}, 0
+        if misses:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(misses))), thread_name_prefix="virustotal") as pool:
+                futures = {pool.submit(self._lookup_sent, collection, object_id, deadline): (collection, object_id)
+                           for collection, object_id in misses}
+                for future in as_completed(futures):
+                    verdict, request_sent = future.result()
+                    sent += request_sent
+                    if verdict is not None:
+                        fetched[futures[future]] = verdict
+        if budget is not None:
+            budget.refund(len(misses) - sent)
 
-        return stix_objects
+        if self.cache:
+            self.cache.put_many({f"{collection}/{object_id}": verdict for (collection, object_id), verdict in fetched.items()}, 0)
+        verdicts.update(fetched)
+
+        logging.info(
+            f"VirusTotal enrichment: {len(records_by_lookup)} distinct values, {len(cached)} cached, "
+            f"{len(misses)} looked up ({len(fetched)} answered)."
+        )
+        return verdicts
+
+    def enrich_records(self, records, deadline=None, budget=None):
+        """
+        Adds VirusTotal verdicts to IOC records from other feeds as x_virustotal_* properties
+        on their Indicators. Records are updated in place and returned.
+        If `deadline` (a time.monotonic() value) passes, remaining lookups are skipped.
+        `budget` is an optional LookupBudget shared by the batches of one run.
+        """
+        if not records:
+            return records
+        logging.info(f"Enriching {len(records)} IOC records with VirusTotal...")
+        verdicts = self.get_verdicts(records, deadline, budget)
+
+        enriched = 0
+        for record in records:
+            key = lookup_key(record)
+            verdict = verdicts.get(key) if key is not None else None
+            if not verdict or verdict.get("not_found"):
+                continue
+            record.custom_properties = {
+                **(record.custom_properties or {}),
+                'x_virustotal_malicious': verdict['malicious'],
+                'x_virustotal_suspicious': verdict['suspicious'],
+                'x_virustotal_harmless': verdict['harmless'],
+                'x_virustotal_undetected': verdict['undetected'],
+                'x_virustotal_reputation': verdict['reputation']
+            }
+            enriched += 1
+            logging.debug("Enriched %s with VirusTotal verdict: %s malicious", record.value, verdict['malicious']) # Per-indicator: DEBUG with lazy formatting
+        logging.info(f"Added VirusTotal verdicts to {enriched} of {len(records)} IOC records.")
+        return records